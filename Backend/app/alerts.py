@@ -2,6 +2,8 @@
 from typing import Dict, Any, List, Optional
 import logging
 
+from app.store import get_hospital
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,6 +29,11 @@ def build_alert_message(request_data: Dict[str, Any], best_match: Dict[str, Any]
         f"Required blood group: {bg}, Units: {units}, Urgency: {urgency}\n"
         f"Best donor: {name} ({donor_bg}), Phone: {phone}, Approx distance: {dist_km}"
     )
+    hospital = get_hospital(request_data.get("hospital_id"))
+    if hospital is not None:
+        msg += f"\nHospital: {hospital.name or hospital.hospital_id}"
+        if hospital.address:
+            msg += f", {hospital.address}"
     return msg
 
 
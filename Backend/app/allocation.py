@@ -0,0 +1,207 @@
+# app/allocation.py
+"""
+Global donor allocation across open requests.
+
+Ranking requests one at a time hands the same nearby donor to every hospital
+and ignores units_needed. Here each request is expanded into units_needed
+slots (at most ALLOCATION_MAX_UNITS) and donors are assigned to slots so
+that no donor is used twice and the total urgency-weighted match score is
+maximal:
+
+    value[slot, donor] = urgency_weight(request) * score(request, donor)
+
+(0 for blood-incompatible pairs). Small and medium instances are solved
+exactly (rectangular assignment via scipy's linear_sum_assignment over the
+dense slot x candidate matrix); above ALLOCATION_MAX_CELLS, or without
+scipy, the matrix is never built: a greedy pass takes each request's own
+top candidates in descending value order.
+"""
+from typing import Dict, Any, List, Tuple
+import time
+
+import numpy as np
+
+from app.config import (
+    ALLOCATION_URGENCY_WEIGHTS,
+    ALLOCATION_CANDIDATES_PER_UNIT,
+    ALLOCATION_MAX_CELLS,
+    ALLOCATION_MAX_UNITS,
+    ORS_REFINE_FACTOR,
+)
+from app.batch_match import score_batch
+from app.match_engine import top_positions
+from app.alerts import trigger_match_alert
+from app.store import load_requests
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy ships with scikit-learn; greedy still works without it
+    linear_sum_assignment = None
+
+
+def _units_needed(req: Dict[str,Any]) -> int:
+    try:
+        return max(1, int(float(req.get("units_needed") or 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _slots(req: Dict[str,Any]) -> int:
+    # units beyond the cap are reported unfilled instead of growing the problem
+    return min(_units_needed(req), ALLOCATION_MAX_UNITS)
+
+
+def _urgency_weight(req: Dict[str,Any]) -> float:
+    urgency = str(req.get("urgency_level") or "").strip().lower()
+    return ALLOCATION_URGENCY_WEIGHTS.get(urgency, ALLOCATION_URGENCY_WEIGHTS["medium"])
+
+
+def _top_compatible(scores: np.ndarray, compatible: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest-scoring compatible candidates (unordered)."""
+    pos = np.flatnonzero(compatible)
+    if len(pos) > k:
+        pos = pos[np.argpartition(-scores[pos], k - 1)[:k]]
+    return pos
+
+
+def _ranked(scores: np.ndarray, first: int):
+    """Positions in descending score order (ties by position), sorted a doubling block at a time."""
+    start, k = 0, max(first, 16)
+    while start < len(scores):
+        yield from top_positions(scores, k - start, start).tolist()
+        start, k = k, 2 * k
+
+
+def _assign_optimal(values: np.ndarray) -> List[tuple]:
+    rows, cols = linear_sum_assignment(values, maximize=True)
+    keep = values[rows, cols] > 0
+    return list(zip(rows[keep].tolist(), cols[keep].tolist()))
+
+
+def _assign_greedy(candidates: Dict[int, Tuple[np.ndarray, np.ndarray]], slots: Dict[int, int]) -> List[tuple]:
+    """
+    (request, candidate) pairs taken in descending value order (ties by
+    request, then candidate) while the request has open slots and the donor
+    is free. candidates: request -> (candidate positions, values).
+    """
+    if not candidates:
+        return []
+    req = np.concatenate([np.full(len(pos), i, dtype=np.int64) for i, (pos, _) in candidates.items()])
+    pos = np.concatenate([np.asarray(pos, dtype=np.int64) for pos, _ in candidates.values()])
+    val = np.concatenate([np.asarray(v, dtype=float) for _, v in candidates.values()])
+    keep = val > 0
+    req, pos, val = req[keep], pos[keep], val[keep]
+    open_slots = dict(slots)
+    used = set()
+    pairs = []
+    for k in np.lexsort((pos, req, -val)).tolist():
+        i, c = int(req[k]), int(pos[k])
+        if open_slots.get(i, 0) <= 0 or c in used:
+            continue
+        open_slots[i] -= 1
+        used.add(c)
+        pairs.append((i, c))
+    return pairs
+
+
+def allocate_donors(reqs: List[Dict[str,Any]], weights: Dict[str,float] = None,
+                    road_distances: bool = False, method: str = "auto") -> Dict[str,Any]:
+    """
+    Assign donors to requests globally. method: "auto" | "optimal" | "greedy".
+
+    Returns {"allocations": [...], "stats": {...}}; one allocation per request
+    in input order with the assigned donors (best first) and how many units
+    are left unfilled.
+    """
+    t0 = time.perf_counter()
+    refine_k = ORS_REFINE_FACTOR * max([_slots(r) for r in reqs] or [1])
+    reqs, scored_list, stats = score_batch(reqs, weights, road_distances, refine_k)
+
+    units = [_units_needed(r) for r in reqs]
+    slots = [_slots(r) for r in reqs]
+    active = [i for i, scored in enumerate(scored_list) if scored is not None]
+    scores = {i: scored_list[i].scores() for i in active}
+    compatible = {i: scored_list[i].s_blood > 0 for i in active}
+
+    # ----- candidate columns: each request's best few compatible donors -----
+    tops = {i: _top_compatible(scores[i], compatible[i], slots[i] * ALLOCATION_CANDIDATES_PER_UNIT) for i in active}
+    cols = np.unique(np.concatenate(list(tops.values()))) if tops else np.empty(0, dtype=np.int64)
+    n_slots = sum(slots[i] for i in active)
+
+    # decided before anything slot x candidate sized is allocated
+    if method == "auto":
+        fits = n_slots * len(cols) <= ALLOCATION_MAX_CELLS
+        method = "optimal" if fits and linear_sum_assignment is not None else "greedy"
+    if method == "optimal" and linear_sum_assignment is None:
+        method = "greedy"
+
+    if method == "optimal" and n_slots and len(cols):
+        # ----- one row per unit slot -----
+        slot_req = np.array([i for i in active for _ in range(slots[i])], dtype=np.int64)
+        values = np.zeros((len(active), len(cols)))
+        row_of = {i: r for r, i in enumerate(active)}
+        for i in active:
+            values[row_of[i]] = np.where(compatible[i][cols], _urgency_weight(reqs[i]) * scores[i][cols], 0.0)
+        values = values[[row_of[i] for i in slot_req]]
+        pairs = [(int(slot_req[r]), int(cols[c])) for r, c in _assign_optimal(values)]
+    else:
+        # tops only hold compatible donors
+        pairs = _assign_greedy(
+            {i: (tops[i], _urgency_weight(reqs[i]) * scores[i][tops[i]]) for i in active},
+            {i: slots[i] for i in active},
+        )
+
+    assigned: Dict[int, List[int]] = {i: [] for i in active}
+    used = set()
+    for i, pos in pairs:
+        assigned[i].append(pos)
+        used.add(pos)
+
+    # ----- top-up: slots left open because their candidate columns were taken -----
+    topped_up = 0
+    for i in sorted(active, key=lambda i: -_urgency_weight(reqs[i])):
+        missing = slots[i] - len(assigned[i])
+        if missing <= 0:
+            continue
+        # only as much of the ranking as the top-up reaches is sorted
+        for pos in _ranked(scores[i], len(tops[i]) + 2 * missing):
+            if missing == 0 or not compatible[i][pos]:
+                break
+            if int(pos) in used:
+                continue
+            assigned[i].append(int(pos))
+            used.add(int(pos))
+            missing -= 1
+            topped_up += 1
+
+    allocations = []
+    for i, req in enumerate(reqs):
+        scored = scored_list[i]
+        positions = sorted(assigned.get(i, []), key=lambda p: -scores[i][p])
+        donors = scored.results(positions) if scored is not None else []
+        allocations.append({
+            "request": req,
+            "units_needed": units[i],
+            "assigned": donors,
+            "unfilled": units[i] - len(donors),
+            "alert": trigger_match_alert(req, donors),
+        })
+
+    stats.update({
+        "method": method,
+        "slots": int(sum(slots)),
+        "candidate_donors": int(len(cols)),
+        "donors_assigned": len(used),
+        "topped_up": topped_up,
+        "unfilled": int(sum(a["unfilled"] for a in allocations)),
+        "total_ms": round((time.perf_counter() - t0) * 1000.0, 3),
+    })
+    return {"allocations": allocations, "stats": stats}
+
+
+def allocate_open_requests(road_distances: bool = False, method: str = "auto") -> Dict[str,Any]:
+    """allocate_donors() over every row of requests.csv."""
+    requests_df = load_requests()
+    if requests_df is None or requests_df.empty:
+        return {"allocations": [], "stats": {"requests": 0}}
+    return allocate_donors(requests_df.to_dict(orient="records"), road_distances=road_distances, method=method)
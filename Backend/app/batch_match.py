@@ -0,0 +1,179 @@
+# app/batch_match.py
+"""
+Match many requests in one pass.
+
+All requests share one donor snapshot: availability, blood-group codes and
+coordinates are computed once, geodesic distances once per distinct request
+location, and the ORS refinement of every request's shortlist goes out as a
+single (cached) many-to-many matrix instead of one call per request.
+
+CLI (matches every row of data/requests.csv):
+    python -m app.batch_match [--top-n 10] [--no-road] [--out results.json]
+"""
+from typing import Dict, Any, List, Optional, Tuple
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.store import load_donor_snapshot, load_requests
+from app.geo_cache import geocode_address_cached, cached_road_distances_many
+from app.alerts import trigger_match_alert
+from app.match_engine import (
+    DEFAULT_WEIGHTS,
+    _distances_from,
+    _resolve_target_coord,
+    _score_snapshot_rows,
+    _apply_road_distances,
+    refine_count,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _clean_request(req: Dict[str,Any]) -> Dict[str,Any]:
+    # CSV rows carry NaN for empty cells; the match code expects None
+    return {k: (None if not isinstance(v, str) and pd.isna(v) else v) for k, v in req.items()}
+
+
+def _resolve_origin(req: Dict[str,Any]) -> Optional[tuple]:
+    """
+    Request location, geocoding its address if needed. A failed lookup only
+    leaves this request unresolved (noted in req["geocode_error"]); the rest
+    of the batch is still matched.
+    """
+    coord = _resolve_target_coord(req)
+    if coord is None and req.get("address"):
+        try:
+            coord = geocode_address_cached(req["address"])
+        except Exception as e:
+            logger.warning(f"Batch geocoding failed for {req['address']!r}: {e}")
+            req["geocode_error"] = f"Geocoding failed for address: {req['address']}"
+            return None
+        if coord is not None:
+            req["lat"], req["lon"] = coord
+    return coord
+
+
+def score_batch(reqs: List[Dict[str,Any]], weights: Dict[str,float] = None,
+                road_distances: bool = True, refine_k: int = 0) -> Tuple[list, list, Dict[str,Any]]:
+    """
+    Score every request against one shared candidate set (the available
+    donors of a single load_donor_snapshot()), so position i refers to the
+    same donor in every returned ScoredDonors. Entries are None when there
+    are no candidates.
+
+    Returns (cleaned requests, scored list, stats).
+    """
+    t0 = time.perf_counter()
+    weights = weights or DEFAULT_WEIGHTS
+    reqs = [_clean_request(r) for r in reqs]
+
+    # ----- one snapshot for the whole batch -----
+    snapshot = load_donor_snapshot()
+    scored_list: List[Any] = [None] * len(reqs)
+    origins: List[Optional[tuple]] = [_resolve_origin(r) for r in reqs]
+    unique_origins = {o for o in origins if o is not None}
+
+    if snapshot is not None and snapshot.size:
+        rows = np.flatnonzero(snapshot.available)
+        lat, lon = snapshot.lat[rows], snapshot.lon[rows]
+
+        # ----- geodesic distances once per distinct location -----
+        dist_by_origin = {o: _distances_from(o, lat, lon) for o in unique_origins}
+        no_origin = np.full(len(rows), np.nan)
+
+        if len(rows):
+            for i, (req, origin) in enumerate(zip(reqs, origins)):
+                dist_m = dist_by_origin[origin] if origin is not None else no_origin
+                scored_list[i] = _score_snapshot_rows(req, snapshot, rows, weights, origin, dist_m=dist_m)
+    t_scored = time.perf_counter()
+
+    # ----- one road-distance lookup for every shortlist -----
+    road_status = "skipped"
+    refinable = [
+        (scored, scored.shortlist(refine_k)) for scored in scored_list
+        if road_distances and scored is not None and scored.target_coord is not None and refine_k > 0
+    ]
+    refinable = [(s, pos) for s, pos in refinable if len(pos)]
+    if refinable:
+        try:
+            ors_list = cached_road_distances_many(
+                [s.target_coord for s, _ in refinable],
+                [s.destination_coords(pos) for s, pos in refinable],
+            )
+            for (scored, positions), ors_raw in zip(refinable, ors_list):
+                _apply_road_distances(scored, positions, ors_raw)
+            road_status = "ok"
+        except Exception as e:
+            # keep geodesic fallback values for the whole batch
+            logger.warning(f"Batch road-distance lookup failed: {e}")
+            road_status = "error"
+    t_road = time.perf_counter()
+
+    stats = {
+        "requests": len(reqs),
+        "unique_locations": len(unique_origins),
+        "unresolved_locations": sum(o is None for o in origins),
+        "geocode_errors": sum("geocode_error" in r for r in reqs),
+        "road_distances": road_status,
+        "scoring_ms": round((t_scored - t0) * 1000.0, 3),
+        "road_ms": round((t_road - t_scored) * 1000.0, 3),
+    }
+    return reqs, scored_list, stats
+
+
+def match_batch(reqs: List[Dict[str,Any]], top_n: Optional[int] = 10, weights: Dict[str,float] = None,
+                road_distances: bool = True, refine_k: Optional[int] = None) -> Dict[str,Any]:
+    """
+    Rank donors for every request in reqs (same dict keys as
+    rank_donors_for_request). Returns {"results": [...], "stats": {...}} with
+    one result per request, in input order. top_n=None returns every match.
+    """
+    t0 = time.perf_counter()
+    if refine_k is None:
+        refine_k = refine_count(top_n)
+    reqs, scored_list, stats = score_batch(reqs, weights, road_distances, refine_k)
+
+    results = []
+    for req, scored in zip(reqs, scored_list):
+        matches = scored.top(top_n) if scored is not None else []
+        result = {
+            "request": req,
+            "matches": matches,
+            "alert": trigger_match_alert(req, matches),
+        }
+        if "geocode_error" in req:
+            result["error"] = req["geocode_error"]
+        results.append(result)
+
+    stats["total_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+    return {"results": results, "stats": stats}
+
+
+def match_open_requests(top_n: Optional[int] = 10, road_distances: bool = True) -> Dict[str,Any]:
+    """match_batch() over every row of requests.csv."""
+    requests_df = load_requests()
+    if requests_df is None or requests_df.empty:
+        return {"results": [], "stats": {"requests": 0}}
+    return match_batch(requests_df.to_dict(orient="records"), top_n=top_n, road_distances=road_distances)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match every request in requests.csv")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--no-road", action="store_true", help="skip ORS road distances (geodesic only)")
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    batch = match_open_requests(top_n=args.top_n, road_distances=not args.no_road)
+    text = json.dumps(batch, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Matched {batch['stats']['requests']} requests -> {args.out}")
+    else:
+        print(text)
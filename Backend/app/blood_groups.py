@@ -0,0 +1,61 @@
+# app/blood_groups.py
+import re
+import numpy as np
+import pandas as pd
+
+# Antigen bits. A red-cell donor is compatible with a recipient when the donor
+# carries no antigen the recipient lacks: donor_mask & ~recipient_mask == 0.
+ANTIGEN_A = 1
+ANTIGEN_B = 2
+ANTIGEN_RH = 4
+
+# code for missing / unparseable blood groups - never compatible
+UNKNOWN_CODE = -1
+
+ABO_BITS = {"O": 0, "A": ANTIGEN_A, "B": ANTIGEN_B, "AB": ANTIGEN_A | ANTIGEN_B}
+
+_BG_RE = re.compile(r"^(AB|A|B|O|0)\s*(RH)?\s*(\+|-|POS(?:ITIVE)?|NEG(?:ATIVE)?)?$")
+
+# canonical label for each code, e.g. 5 -> "A+"
+CODE_LABELS = {
+    abo_bits | rh: f"{abo}{'+' if rh else '-'}"
+    for abo, abo_bits in ABO_BITS.items()
+    for rh in (0, ANTIGEN_RH)
+}
+
+
+def encode_blood_group(bg) -> int:
+    """
+    "A+" -> A|RH, "O-" -> 0, "AB" -> A|B|RH ...
+
+    A missing Rh sign is treated as Rh-positive: as a donor that is the
+    conservative choice, and as a recipient it keeps ABO-only requests
+    matching the way they did before Rh was considered.
+    """
+    if bg is None or (not isinstance(bg, str) and pd.isna(bg)):
+        return UNKNOWN_CODE
+    m = _BG_RE.match(str(bg).upper().strip())
+    if not m:
+        return UNKNOWN_CODE
+    abo = "O" if m.group(1) == "0" else m.group(1)
+    sign = m.group(3)
+    rh = 0 if sign and (sign == "-" or sign.startswith("NEG")) else ANTIGEN_RH
+    return ABO_BITS[abo] | rh
+
+
+def encode_blood_groups(values: pd.Series) -> np.ndarray:
+    """Vectorized encode_blood_group; parses each distinct string once."""
+    if values is None or len(values) == 0:
+        return np.empty(0, dtype=np.int8)
+    codes = pd.Series(values).map(
+        {v: encode_blood_group(v) for v in pd.Series(values).dropna().unique()}
+    )
+    return codes.fillna(UNKNOWN_CODE).to_numpy(dtype=np.int8)
+
+
+def compatible_mask(donor_codes: np.ndarray, recipient_code: int) -> np.ndarray:
+    """Boolean mask of donors whose red cells the recipient can receive."""
+    if recipient_code == UNKNOWN_CODE:
+        return np.zeros(len(donor_codes), dtype=bool)
+    return (donor_codes >= 0) & ((donor_codes & ~np.int8(recipient_code)) == 0)
+
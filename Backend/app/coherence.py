@@ -0,0 +1,73 @@
+# app/coherence.py
+"""
+Change detection shared by every worker process.
+
+Each uvicorn worker keeps its own copy of the donor, request and hospital
+tables, so a change made through one worker has to be visible to the
+others. Readers check, on every access and in a few microseconds:
+
+  requests.csv / hospitals.csv   the file signature (inode, mtime, size: one
+                                 stat() call); uploads replace the file
+                                 atomically, so it always changes
+  donor store                    a stamp file (data/donors.stamp) rewritten
+                                 after every committed write; when its
+                                 content changed the version is read from
+                                 the store itself
+
+Nothing is reloaded unless the signature or stamp moved.
+"""
+from typing import Optional, Tuple
+from pathlib import Path
+import os
+import tempfile
+
+from app.config import DATA_DIR
+
+Signature = Tuple[int, int, int]
+
+
+def file_signature(path: Path) -> Optional[Signature]:
+    """(inode, mtime_ns, size) of path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def write_atomic(path: Path, data: bytes, durable: bool = True):
+    """Replace path with data so readers see the old or the new file, never a partial one."""
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def stamp_path(name: str) -> Path:
+    return DATA_DIR / f"{name}.stamp"
+
+
+def write_stamp(name: str, value: str):
+    """Announce a committed change of `name` to the other workers; value must differ per write."""
+    write_atomic(stamp_path(name), value.encode("utf-8"), durable=False)
+
+
+def read_stamp(name: str) -> Optional[str]:
+    # the value, not the file's mtime: mtimes are coarse and two writes can share one
+    try:
+        with open(stamp_path(name), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
@@ -1,11 +1,12 @@
 # app/config.py
 from pathlib import Path
+import os
 
-# Base directories
+# Base directories (PULSENET_DATA_DIR / PULSENET_MODELS_DIR point them elsewhere, e.g. for tests)
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.getenv("PULSENET_DATA_DIR", BASE_DIR / "data"))
 DATA_DIR.mkdir(exist_ok=True)
-MODELS_DIR = BASE_DIR / "models"
+MODELS_DIR = Path(os.getenv("PULSENET_MODELS_DIR", BASE_DIR / "models"))
 MODELS_DIR.mkdir(exist_ok=True)
 
 # CSV data paths
@@ -26,6 +27,9 @@ UPLOADED_HOSPITALS = Path(
 
 # Optional ML model path
 MATCH_MODEL_PATH = MODELS_DIR / "blood_match_model.joblib"
+# Uploaded model versions (never overwritten) and the name of the active one
+MODEL_VERSIONS_DIR = MODELS_DIR / "versions"
+ACTIVE_MODEL_POINTER = MODELS_DIR / "ACTIVE"
 
 # 🔹 AUTH / DATABASE CONFIG 🔹
 
@@ -33,9 +37,106 @@ MATCH_MODEL_PATH = MODELS_DIR / "blood_match_model.joblib"
 DB_PATH = DATA_DIR / "users.db"
 # add near other paths
 CHAT_DB_PATH = DATA_DIR / "chat.db"
+# local cache of geocoding / road-distance lookups (app/geo_cache.py)
+GEO_CACHE_DB_PATH = DATA_DIR / "geo_cache.db"
+# donor store (app/donor_db.py): donors.csv and registered donors, indexed
+DONOR_DB_PATH = DATA_DIR / "donors.db"
+# saved, memory-mapped donor snapshots (app/shared_snapshot.py): cold start, and shared by workers
+SHARED_SNAPSHOT_DIR = DATA_DIR / "snapshot"
 
 
 # JWT settings – for project/demo this is fine; later move to .env
 SECRET_KEY = "super-secret-key-change-this-later-1234567890"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # token expiry in minutes
+
+# 🔹 MATCHING CONFIG 🔹
+
+# Straight-line distance kernel (app/distance.py): "equirectangular"
+# (vectorized, ellipsoidal, within ~0.01% of geodesic up to 200 km),
+# "haversine" (vectorized sphere, up to ~0.5% off) or "geodesic" (exact,
+# geopy, one call per donor). Compare with: python -m app.distance
+DISTANCE_MODE = "equirectangular"
+# Grid cell size (degrees) of the in-memory donor spatial index
+SPATIAL_CELL_DEG = 0.25
+# Only donors within this radius of the request are scored. Matches the
+# 200 km cutoff of distance_score; falls back to the full roster when the
+# radius holds fewer than top_n compatible donors.
+MATCH_RADIUS_KM = 200.0
+# Score requests from indexed queries on the donor store (only the rows near
+# the request, memory flat in the roster size) instead of the in-memory
+# snapshot of the whole table. Batch matching, allocation and standing lists
+# always use the snapshot.
+MATCH_FROM_DB = False
+# Donor-store versions kept in its change log; an in-memory snapshot further
+# behind than this is rebuilt instead of patched
+DONOR_CHANGE_LOG_VERSIONS = 10_000
+# Fraction of deleted-donor tombstones past which a new snapshot version is
+# compacted to its live rows
+DONOR_SNAPSHOT_MAX_TOMBSTONES = 0.25
+# Workers map one read-only copy of the donor snapshot (arrays and records,
+# written once per donor-store version under SHARED_SNAPSHOT_DIR) instead of
+# each holding its own; for deployments with several uvicorn workers
+SHARED_SNAPSHOT = False
+# snapshot generations kept on disk; workers still mapping an older one keep it until they move on
+SHARED_SNAPSHOT_KEEP = 3
+# Only the best ORS_REFINE_FACTOR * top_n geodesic-ranked donors are sent to
+# ORS for road distances
+ORS_REFINE_FACTOR = 3
+# Seconds /api/match may wait on geocoding + ORS before answering with
+# geodesic estimates; high/critical urgency requests get the shorter budget
+MATCH_LATENCY_BUDGET_S = 3.0
+MATCH_URGENT_LATENCY_BUDGET_S = 1.0
+# ORS matrix requests in one-to-many mode: destinations per request and
+# concurrent requests per call
+ORS_MATRIX_CHUNK_SIZE = 50
+ORS_MATRIX_MAX_WORKERS = 4
+# many-to-many requests: max origins x destinations per ORS request
+ORS_MATRIX_MAX_ELEMENTS = 2500
+# Scored match snapshots kept for cursor paging (/api/match/next)
+MATCH_SNAPSHOT_TTL_S = 600
+MATCH_SNAPSHOT_ENTRIES = 256
+# ... and at most this much memory in their per-candidate arrays (~50 bytes per donor)
+MATCH_SNAPSHOT_MAX_BYTES = 256 * 1024 * 1024
+# Cached match results (invalidated by donor table / model version, not by time)
+MATCH_RESULT_CACHE_ENTRIES = 512
+# ... except results whose ORS stage only partly succeeded, which expire after this
+MATCH_RESULT_PARTIAL_TTL_S = 30
+# Standing per-hospital lists (app/standing_lists.py): background refresh on/off,
+# how often the donor table / model / hospitals are checked for changes, and
+# how many of each list's best donors get ORS road distances
+STANDING_LISTS_ENABLED = True
+STANDING_LIST_POLL_S = 5.0
+STANDING_LIST_ROAD_K = 90
+# Seconds before lists whose ORS lookup failed are refreshed again
+STANDING_LIST_RETRY_S = 60.0
+
+# 🔹 ALLOCATION (/api/match/allocate) 🔹
+# A contested donor goes to the request with the higher urgency-weighted score
+ALLOCATION_URGENCY_WEIGHTS = {"critical": 4.0, "high": 3.0, "medium": 2.0, "low": 1.0}
+# Best compatible donors per needed unit that enter the assignment problem
+ALLOCATION_CANDIDATES_PER_UNIT = 5
+# Units per request that enter the assignment (a larger units_needed is
+# reported unfilled beyond it)
+ALLOCATION_MAX_UNITS = 20
+# Unit slots x donors above which the greedy allocator is used instead of
+# the optimal assignment. Measured: the optimal one is as fast or faster up
+# to ~10M cells (square worst case 9M: 1.7 s vs 1.9 s greedy), slower above
+ALLOCATION_MAX_CELLS = 10_000_000
+
+# 🔹 OUTBOUND HTTP (OpenRouteService) 🔹
+HTTP_CONNECT_TIMEOUT_S = 5.0
+HTTP_READ_TIMEOUT_S = 20.0     # default; individual calls may pass their own
+HTTP_POOL_MAXSIZE = 20         # kept-alive connections per host
+HTTP_RETRIES = 2               # retries on connection errors, 429 and 5xx
+HTTP_BACKOFF_S = 0.3           # backoff base: 0.3s, 0.6s, ...
+
+# 🔹 GEOCODE CACHE 🔹
+GEOCODE_TTL_S = 30 * 24 * 3600        # resolved addresses
+GEOCODE_NEGATIVE_TTL_S = 3600         # addresses ORS could not resolve
+GEOCODE_MEMORY_ENTRIES = 2048         # in-memory LRU tier size
+
+# 🔹 ROAD DISTANCE CACHE 🔹
+DISTANCE_CACHE_PRECISION = 3          # decimals of lat/lon per grid cell (~110 m)
+DISTANCE_CACHE_MAX_AGE_S = 7 * 24 * 3600
+DISTANCE_MEMORY_ENTRIES = 200_000
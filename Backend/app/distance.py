@@ -0,0 +1,149 @@
+# app/distance.py
+"""
+Straight-line distance kernels used for matching.
+
+DISTANCE_MODE (app/config.py) picks the kernel:
+  "haversine"       - great circle on the mean Earth sphere, vectorized
+  "equirectangular" - flat projection on the ellipsoid around the mid
+                      latitude, vectorized (default); within ~0.01% of
+                      geodesic up to 200 km, degrades over long distances
+  "geodesic"        - geopy's ellipsoidal solver, one call per point (exact, slow)
+
+The distance score is clipped at 200 km, where haversine is off by up to
+~0.5% (the sphere ignores the Earth's flattening). Check the kernels on the
+current data with:
+    python -m app.distance [--mode haversine|equirectangular]
+"""
+from typing import Optional
+import argparse
+import math
+
+import numpy as np
+from geopy.distance import geodesic
+
+from app.config import DISTANCE_MODE
+
+# mean Earth radius (IUGG)
+EARTH_RADIUS_M = 6371008.8
+EARTH_RADIUS_KM = EARTH_RADIUS_M / 1000.0
+# WGS84 semi-major axis and first eccentricity squared
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+
+def haversine_m(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    lat0_r, lon0_r = math.radians(lat0), math.radians(lon0)
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    a = (
+        np.sin((lat_r - lat0_r) / 2.0) ** 2
+        + math.cos(lat0_r) * np.cos(lat_r) * np.sin((lon_r - lon0_r) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def equirectangular_m(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    # flat projection on the WGS84 ellipsoid at the mid latitude: meridional
+    # (M) and prime-vertical (N) radii of curvature instead of one sphere radius
+    lat_r = np.radians(lat)
+    lat_m = (lat_r + math.radians(lat0)) / 2.0
+    w = 1.0 - WGS84_E2 * np.sin(lat_m) ** 2
+    m = WGS84_A * (1.0 - WGS84_E2) / w ** 1.5
+    n = WGS84_A / np.sqrt(w)
+    dlon = (np.asarray(lon) - lon0 + 180.0) % 360.0 - 180.0  # across the antimeridian
+    x = n * np.cos(lat_m) * np.radians(dlon)
+    y = m * (lat_r - math.radians(lat0))
+    return np.hypot(x, y)
+
+
+def geodesic_m(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    out = np.full(len(lat), np.nan)
+    for i in np.flatnonzero(~(np.isnan(lat) | np.isnan(lon))):
+        try:
+            out[i] = geodesic((lat0, lon0), (lat[i], lon[i])).meters
+        except Exception:
+            pass
+    return out
+
+
+_KERNELS = {
+    "haversine": haversine_m,
+    "equirectangular": equirectangular_m,
+    "geodesic": geodesic_m,
+}
+
+
+def distances_m(lat0: float, lon0: float, lat, lon, mode: str = None) -> np.ndarray:
+    """Meters from (lat0, lon0) to every (lat[i], lon[i]); NaN where a coordinate is missing."""
+    kernel = _KERNELS.get(mode or DISTANCE_MODE)
+    if kernel is None:
+        raise ValueError(f"Unknown distance mode: {mode or DISTANCE_MODE}")
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if len(lat) == 0:
+        return np.empty(0)
+    return kernel(float(lat0), float(lon0), lat, lon)
+
+
+def distance_m(coord1, coord2, mode: str = None) -> Optional[float]:
+    """Scalar distances_m(); None if either coordinate is unusable."""
+    try:
+        d = distances_m(coord1[0], coord1[1], [coord2[0]], [coord2[1]], mode)[0]
+    except Exception:
+        return None
+    return None if np.isnan(d) else float(d)
+
+
+def accuracy_report(mode: str = "haversine", max_km: float = 200.0) -> dict:
+    """
+    Compare `mode` against geodesic for every (hospital or request location,
+    donor) pair in the current data, restricted to pairs within max_km.
+    """
+    # imported here so the kernels stay free of data-loading dependencies
+    from app.store import load_donors, load_requests, hospital_index
+    from app.match_engine import _coord_arrays, _distance_scores
+
+    donors = load_donors()
+    lat, lon = _coord_arrays(donors)
+    origins = {h.coord for h in hospital_index().values() if h.coord is not None}
+    requests_df = load_requests()
+    if requests_df is not None and not requests_df.empty and {"lat", "lon"} <= set(requests_df.columns):
+        r_lat, r_lon = _coord_arrays(requests_df)
+        origins |= {(a, b) for a, b in zip(r_lat, r_lon) if not (np.isnan(a) or np.isnan(b))}
+
+    approx_all, exact_all = [], []
+    for lat0, lon0 in origins:
+        exact = geodesic_m(lat0, lon0, lat, lon)
+        approx = distances_m(lat0, lon0, lat, lon, mode)
+        ok = ~np.isnan(exact) & (exact <= max_km * 1000.0)
+        approx_all.append(approx[ok])
+        exact_all.append(exact[ok])
+    approx = np.concatenate(approx_all) if approx_all else np.empty(0)
+    exact = np.concatenate(exact_all) if exact_all else np.empty(0)
+    if len(exact) == 0:
+        return {"mode": mode, "pairs": 0}
+
+    abs_err = np.abs(approx - exact)
+    rel_err = abs_err / np.maximum(exact, 1.0)
+    score_err = np.abs(_distance_scores(approx) - _distance_scores(exact))
+    return {
+        "mode": mode,
+        "origins": len(origins),
+        "pairs": int(len(exact)),
+        "max_abs_error_m": round(float(abs_err.max()), 3),
+        "mean_abs_error_m": round(float(abs_err.mean()), 3),
+        "p95_rel_error_pct": round(float(np.percentile(rel_err, 95)) * 100.0, 6),
+        "max_rel_error_pct": round(float(rel_err.max()) * 100.0, 6),
+        "max_distance_score_error": round(float(score_err.max()), 6),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy of the fast distance kernels against geodesic")
+    parser.add_argument("--mode", choices=["haversine", "equirectangular"], default=None,
+                        help="kernel to check (default: both)")
+    parser.add_argument("--max-km", type=float, default=200.0)
+    args = parser.parse_args()
+
+    for m in [args.mode] if args.mode else ["haversine", "equirectangular"]:
+        report = accuracy_report(m, args.max_km)
+        print(", ".join(f"{k}={v}" for k, v in report.items()))
@@ -5,6 +5,7 @@ from typing import Optional, List
 import sqlite3
 from app.config import DB_PATH
 from app.auth import get_current_user  # reuse auth's current_user
+from app.store import save_registered_donor
 
 router = APIRouter(prefix="/api/donations", tags=["donations"])
 
@@ -192,6 +193,21 @@ def register_donor(
     conn.commit()
     conn.close()
 
+    # one-row write to the donor store matching reads from (this also
+    # invalidates cached match results)
+    save_registered_donor(
+        {
+            "donor_id": donor_id,
+            "name": full_name,
+            "blood_group": user_bg,
+            "phone": phone,
+            "lat": data.lat,
+            "lon": data.lon,
+            "availability": data.availability,
+            "last_donation_date": data.last_donation_date,
+        }
+    )
+
     row = get_donor_for_user(user_id)
     return row_to_profile(row)
 
@@ -0,0 +1,575 @@
+# app/donor_db.py
+"""
+SQLite donor store (data/donors.db): the one place donor rows live.
+
+donors.csv and the user_donors table of users.db are imported into it
+(import_donors_csv(), import_user_donors()); after that, registering or
+deleting a donor is a single indexed row write instead of a CSV rewrite
+and a full reload.
+
+Next to the original columns every row carries derived, indexed columns:
+  bg_code              antigen code (app.blood_groups)    -> (bg_code, available)
+  available            0/1 from the availability column   -> (available, cell_lat, cell_lon)
+  cell_lat, cell_lon   SPATIAL_CELL_DEG grid cell, the same key as app.spatial
+
+query_candidates() uses them to pull only the rows a match needs. The meta
+table holds a version number that every write bumps; it tags the
+in-memory snapshot and cached match results built from the store.
+
+Every write also records the rows it touched in the `changes` log, so a
+snapshot that is a few versions behind catches up with
+donor_changes_since() instead of reloading the table. Re-importing
+donors.csv diffs it by donor_id and logs only the rows that changed.
+
+Deleting a donors.csv donor leaves donors.csv as it is and records its
+donor_id in `deleted_donors`; re-imports skip those ids, so the donor does
+not come back when the file changes. Importing an uploaded file
+(restore_deleted=True) clears the list: the upload is the new roster.
+"""
+from typing import Dict, Any, List, Optional, Iterable
+from pathlib import Path
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from app.config import DONOR_DB_PATH, DB_PATH, DONORS_CSV, SPATIAL_CELL_DEG, DONOR_CHANGE_LOG_VERSIONS
+from app.blood_groups import encode_blood_group
+from app.donor_snapshot import as_float, is_available
+from app.distance import haversine_m
+from app.coherence import file_signature, read_stamp, write_stamp
+
+# columns of donors.csv that get their own column in the store; any other
+# CSV column is kept in `extra` (JSON) and comes back unchanged
+DONOR_COLUMNS = ["donor_id", "name", "blood_group", "phone", "lat", "lon", "availability", "last_donation_date"]
+
+# row source: CSV rows sort before registered donors, like the merged table they replace
+SOURCE_CSV = 0
+SOURCE_USER = 1
+
+_write_lock = threading.Lock()
+# store version as of the last read of the meta table, and the stamp
+# (data/donors.stamp, app/coherence.py) seen at that read
+_version: Optional[int] = None
+_stamp_seen: Optional[str] = None
+_STAMP = "donors"
+# donors.csv signature last found imported, and whether legacy registrations are in
+_csv_seen: Optional[str] = None
+_store_id: Optional[str] = None
+_user_donors_done = False
+
+
+def _connect():
+    DONOR_DB_PATH.parent.mkdir(exist_ok=True)
+    return sqlite3.connect(DONOR_DB_PATH, timeout=10)
+
+
+def init_donor_db():
+    conn = _connect()
+    conn.execute("PRAGMA journal_mode=WAL")
+    # value columns are declared without a type so ints, floats and text
+    # round-trip as they were imported (e.g. phone numbers stay ints)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS donors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source INTEGER NOT NULL,
+            donor_id,
+            name,
+            blood_group,
+            phone,
+            lat REAL,
+            lon REAL,
+            availability,
+            last_donation_date,
+            extra TEXT,
+            bg_code INTEGER NOT NULL,
+            available INTEGER NOT NULL,
+            cell_lat INTEGER,
+            cell_lon INTEGER
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_donor_id ON donors (donor_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_blood ON donors (bg_code, available)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_donors_cell ON donors (available, cell_lat, cell_lon)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+    # identifies this store: versions of a recreated donors.db start over
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)", (uuid.uuid4().hex,))
+    # change log: which rows each version wrote (donor_row NULL = bulk change);
+    # versions up to log_floor are no longer covered
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            version INTEGER NOT NULL,
+            donor_row INTEGER
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_version ON changes (version)")
+    # donors.csv donor_ids deleted through the API (as text), skipped by re-imports
+    conn.execute("CREATE TABLE IF NOT EXISTS deleted_donors (donor_id TEXT PRIMARY KEY)")
+    conn.execute(
+        "INSERT OR IGNORE INTO meta (key, value) SELECT 'log_floor', value FROM meta WHERE key = 'version'"
+    )
+    conn.commit()
+
+    # derived cells follow SPATIAL_CELL_DEG; recompute them if it changed
+    if _get_meta(conn, "cell_deg") != repr(SPATIAL_CELL_DEG):
+        rows = conn.execute("SELECT id, lat, lon FROM donors").fetchall()
+        conn.executemany(
+            "UPDATE donors SET cell_lat = ?, cell_lon = ? WHERE id = ?",
+            [(*_cell(lat, lon), rid) for rid, lat, lon in rows],
+        )
+        _set_meta(conn, "cell_deg", repr(SPATIAL_CELL_DEG))
+        conn.commit()
+    global _store_id
+    _store_id = _get_meta(conn, "store_id")
+    conn.close()
+    if read_stamp(_STAMP) is None:
+        write_stamp(_STAMP, "0")
+
+
+# ---------- helpers ----------
+
+def _get_meta(conn, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _begin(conn):
+    # take the write lock before reading what the write depends on, so
+    # concurrent writers (other threads or worker processes) serialize
+    conn.execute("BEGIN IMMEDIATE")
+
+
+def _commit(conn, version: Optional[int] = None):
+    conn.commit()
+    if version is not None:
+        # after the commit, so a worker that notices the stamp finds the rows;
+        # unique per write, so a late stamp from an older write still reads as a change
+        write_stamp(_STAMP, f"{version}:{os.getpid()}:{time.time_ns()}")
+
+
+def _set_meta(conn, key: str, value: str):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def _bump_version(conn, changed: Optional[Iterable[int]] = None) -> int:
+    """
+    New version for a write, logging the donors.id values it touched (None:
+    too many to list, readers reload). Called inside the writing
+    transaction, so readers never see new rows with an old version.
+    """
+    conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+    version = int(_get_meta(conn, "version"))
+    if changed is None:
+        conn.execute("INSERT INTO changes (version, donor_row) VALUES (?, NULL)", (version,))
+    else:
+        conn.executemany(
+            "INSERT INTO changes (version, donor_row) VALUES (?, ?)", [(version, int(r)) for r in changed]
+        )
+    floor = version - DONOR_CHANGE_LOG_VERSIONS
+    if floor > int(_get_meta(conn, "log_floor") or 0):
+        conn.execute("DELETE FROM changes WHERE version <= ?", (floor,))
+        _set_meta(conn, "log_floor", str(floor))
+    return version
+
+
+def _sql_value(value):
+    """Python/NumPy/pandas scalar -> something sqlite3 can bind (NaN -> NULL)."""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (str, int, float)):
+        return value
+    if pd.isna(value):
+        return None
+    return str(value)
+
+
+def _cell(lat, lon) -> tuple:
+    lat, lon = as_float(lat), as_float(lon)
+    if lat is None or lon is None:
+        return None, None
+    return math.floor(lat / SPATIAL_CELL_DEG), math.floor(lon / SPATIAL_CELL_DEG)
+
+
+def _row_params(source: int, record: Dict[str, Any]) -> tuple:
+    values = {c: _sql_value(record.get(c)) for c in DONOR_COLUMNS}
+    extra = {k: _sql_value(v) for k, v in record.items() if k not in DONOR_COLUMNS}
+    cell_lat, cell_lon = _cell(values["lat"], values["lon"])
+    return (
+        source,
+        *[values[c] for c in DONOR_COLUMNS],
+        json.dumps(extra) if extra else None,
+        encode_blood_group(values["blood_group"]),
+        # a donor without the column counts as available, like the in-memory filter
+        int(is_available(values["availability"])) if "availability" in record else 1,
+        cell_lat,
+        cell_lon,
+    )
+
+
+# everything _row_params() produces after `source`, in order
+_VALUE_COLUMNS = [*DONOR_COLUMNS, "extra", "bg_code", "available", "cell_lat", "cell_lon"]
+
+_INSERT_SQL = f"""
+    INSERT INTO donors (source, {", ".join(_VALUE_COLUMNS)})
+    VALUES ({", ".join("?" * (len(_VALUE_COLUMNS) + 1))})
+"""
+
+_UPDATE_SQL = f"UPDATE donors SET {', '.join(f'{c} = ?' for c in _VALUE_COLUMNS)} WHERE id = ?"
+
+
+def _record(r: sqlite3.Row) -> Dict[str, Any]:
+    rec = {c: r[c] for c in DONOR_COLUMNS}
+    if r["extra"]:
+        rec.update(json.loads(r["extra"]))
+    return rec
+
+
+def _frame(rows: List[sqlite3.Row], columns: List[str], index: Iterable = None) -> pd.DataFrame:
+    records = [_record(r) for r in rows]
+    # extra CSV columns are kept; core columns the CSV did not have are not
+    for rec in records:
+        for c in rec:
+            if c not in columns and c not in DONOR_COLUMNS:
+                columns.append(c)
+    # object columns, like SQLite's own typing: values keep their type, missing ones stay None
+    return pd.DataFrame(records, columns=columns, index=index, dtype=object)
+
+
+def _columns(conn) -> List[str]:
+    # column order of the imported CSV, so the table reads back the way it was loaded
+    stored = _get_meta(conn, "csv_columns")
+    return json.loads(stored) if stored else list(DONOR_COLUMNS)
+
+
+# ---------- import ----------
+
+def import_donors_csv(path: Path, force: bool = False, restore_deleted: bool = False) -> Optional[int]:
+    """
+    Replace the CSV-sourced rows with the contents of `path` (donors.csv
+    format) in one transaction, leaving out donors deleted since (unless
+    restore_deleted, which forgets those deletions). Skipped (None) when the
+    file has not changed since the last import, unless force. Returns the
+    number of rows imported.
+    """
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    global _csv_seen
+    signature = ":".join(map(str, signature))
+    if not force and signature == _csv_seen:
+        return None
+    with _write_lock:
+        conn = _connect()
+        try:
+            _begin(conn)
+            if not force and _get_meta(conn, "csv_signature") == signature:
+                # imported already (possibly by another worker)
+                conn.rollback()
+                _csv_seen = signature
+                return None
+            df = pd.read_csv(path)
+            columns = json.dumps([str(c) for c in df.columns])
+            if restore_deleted:
+                conn.execute("DELETE FROM deleted_donors")
+            deleted = {r[0] for r in conn.execute("SELECT donor_id FROM deleted_donors")}
+            records = df.to_dict(orient="records")
+            if deleted:
+                records = [r for r in records if str(r.get("donor_id")) not in deleted]
+            params = [_row_params(SOURCE_CSV, r) for r in records]
+            changed = None
+            if _get_meta(conn, "csv_columns") == columns:
+                changed = _diff_csv_rows(conn, params)
+            if changed is None:
+                # new layout or no usable key: replace every CSV row
+                conn.execute("DELETE FROM donors WHERE source = ?", (SOURCE_CSV,))
+                conn.executemany(_INSERT_SQL, params)
+            _set_meta(conn, "csv_signature", signature)
+            _set_meta(conn, "csv_columns", columns)
+            version = None
+            if changed is None or changed:
+                version = _bump_version(conn, changed)
+            _commit(conn, version)
+            _csv_seen = signature
+            return len(params)
+        finally:
+            conn.close()
+
+
+def _diff_csv_rows(conn, params: List[tuple]) -> Optional[List[int]]:
+    """
+    Bring the CSV rows in line with `params` (from _row_params) by donor_id:
+    changed rows are updated in place, new ones appended, missing ones
+    deleted. Returns the touched donors.id values, or None when donor_id is
+    not a unique key on either side.
+    """
+    new_ids = [p[1] for p in params]
+    if any(i is None for i in new_ids) or len(set(new_ids)) != len(new_ids):
+        return None
+    existing = {}
+    for row in conn.execute(f"SELECT id, {', '.join(_VALUE_COLUMNS)} FROM donors WHERE source = ?", (SOURCE_CSV,)):
+        if row[1] in existing:
+            return None
+        existing[row[1]] = (row[0], tuple(row[1:]))
+
+    changed = []
+    for p in params:
+        hit = existing.pop(p[1], None)
+        if hit is None:
+            changed.append(conn.execute(_INSERT_SQL, p).lastrowid)
+        elif hit[1] != p[1:]:
+            conn.execute(_UPDATE_SQL, (*p[1:], hit[0]))
+            changed.append(hit[0])
+    gone = [rid for rid, _ in existing.values()]
+    conn.executemany("DELETE FROM donors WHERE id = ?", [(rid,) for rid in gone])
+    return changed + gone
+
+
+def _user_donor_record(r: sqlite3.Row) -> Dict[str, Any]:
+    # user_donors (app/donations.py) -> donors.csv columns
+    return {
+        "donor_id": r["donor_id"],
+        "name": r["full_name"],
+        "blood_group": r["blood_group"],
+        "phone": r["phone"],
+        "lat": r["lat"],
+        "lon": r["lon"],
+        "availability": r["availability"],
+        "last_donation_date": r["last_donation_date"],
+    }
+
+
+def import_user_donors() -> Optional[int]:
+    """One-time copy of the donors registered before this store existed."""
+    global _user_donors_done
+    if _user_donors_done:
+        return None
+    with _write_lock:
+        conn = _connect()
+        try:
+            _begin(conn)
+            if _get_meta(conn, "user_donors_imported"):
+                conn.rollback()
+                _user_donors_done = True
+                return None
+            try:
+                users = sqlite3.connect(DB_PATH)
+                users.row_factory = sqlite3.Row
+                rows = users.execute("SELECT * FROM user_donors ORDER BY id").fetchall()
+                users.close()
+            except sqlite3.Error:
+                rows = []
+            changed = [_upsert(conn, _user_donor_record(r), SOURCE_USER) for r in rows]
+            _set_meta(conn, "user_donors_imported", "1")
+            version = _bump_version(conn, changed) if changed else None
+            _commit(conn, version)
+            _user_donors_done = True
+            return len(rows)
+        finally:
+            conn.close()
+
+
+def sync_donor_db() -> Optional[int]:
+    """Pick up a changed donors.csv (e.g. after an upload) and legacy registrations."""
+    import_user_donors()
+    import_donors_csv(DONORS_CSV)
+    return donor_db_version()
+
+
+# ---------- writes ----------
+
+def _upsert(conn, record: Dict[str, Any], source: int) -> int:
+    params = _row_params(source, record)
+    existing = conn.execute(
+        "SELECT id FROM donors WHERE donor_id = ? AND source = ?", (params[1], source)
+    ).fetchone()
+    if existing:
+        # update in place: keeps the donor's position in the table
+        conn.execute(_UPDATE_SQL, (*params[1:], existing[0]))
+        return existing[0]
+    return conn.execute(_INSERT_SQL, params).lastrowid
+
+
+def upsert_donor(record: Dict[str, Any], source: int = SOURCE_USER) -> int:
+    """Insert or update one donor (matched on donor_id within its source). Returns the new version."""
+    with _write_lock:
+        conn = _connect()
+        try:
+            _begin(conn)
+            version = _bump_version(conn, [_upsert(conn, record, source)])
+            _commit(conn, version)
+            return version
+        finally:
+            conn.close()
+
+
+def delete_donor(donor_id, source: Optional[int] = SOURCE_CSV) -> int:
+    """
+    Delete the rows with donor_id (of one source, or any when None). Returns
+    how many. A deleted donors.csv donor stays deleted across re-imports.
+    """
+    with _write_lock:
+        conn = _connect()
+        try:
+            # ids are compared as text, like the CSV they came from; numeric ids may be stored as ints
+            ids = [str(donor_id)]
+            if ids[0].lstrip("-").isdigit():
+                ids.append(int(ids[0]))
+            sql = f"SELECT id FROM donors WHERE donor_id IN ({', '.join('?' * len(ids))})"
+            if source is not None:
+                sql += " AND source = ?"
+                ids.append(source)
+            _begin(conn)
+            rows = [r[0] for r in conn.execute(sql, ids)]
+            version = None
+            if rows:
+                conn.executemany("DELETE FROM donors WHERE id = ?", [(r,) for r in rows])
+                if source in (SOURCE_CSV, None):
+                    conn.execute("INSERT OR IGNORE INTO deleted_donors (donor_id) VALUES (?)", (str(donor_id),))
+                version = _bump_version(conn, rows)
+            _commit(conn, version)
+            return len(rows)
+        finally:
+            conn.close()
+
+
+# ---------- reads ----------
+
+def donor_db_version() -> int:
+    """
+    Current store version, including writes made by other worker processes:
+    one small file read per call, the meta table only when the stamp changed.
+    """
+    global _version, _stamp_seen
+    stamp = read_stamp(_STAMP)
+    if _version is None or stamp is None or stamp != _stamp_seen:
+        # stamp first: a write landing in between changes it again
+        _stamp_seen = stamp
+        conn = _connect()
+        try:
+            _version = int(_get_meta(conn, "version") or 0)
+        except sqlite3.Error:
+            _version = _version or 0
+        finally:
+            conn.close()
+    return _version
+
+
+def donor_db_id() -> str:
+    """Random id of this store, fixed when donors.db was created."""
+    return _store_id
+
+
+def donor_changes_since(version: int) -> Optional[List[tuple]]:
+    """
+    (donors.id, current record or None if deleted) for every row written
+    after `version`, in table order. None when the log cannot say (a bulk
+    change, or versions already pruned) and the whole table must be reloaded.
+    """
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        if version < int(_get_meta(conn, "log_floor") or 0):
+            return None
+        changed = [r[0] for r in conn.execute(
+            "SELECT DISTINCT donor_row FROM changes WHERE version > ?", (version,)
+        )]
+        if any(r is None for r in changed):
+            return None
+        current = {}
+        for i in range(0, len(changed), 500):
+            chunk = changed[i:i + 500]
+            for r in conn.execute(f"SELECT * FROM donors WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                current[r["id"]] = r
+    finally:
+        conn.close()
+
+    def _key(rid):
+        r = current.get(rid)
+        return (r["source"], rid) if r is not None else (-1, rid)
+
+    return [(rid, _record(current[rid]) if rid in current else None) for rid in sorted(changed, key=_key)]
+
+
+def load_donor_table() -> pd.DataFrame:
+    """Every donor, CSV rows first then registered donors, indexed by donors.id."""
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("SELECT * FROM donors ORDER BY source, id").fetchall()
+        columns = _columns(conn)
+    finally:
+        conn.close()
+    if not rows:
+        return pd.DataFrame()
+    return _frame(rows, columns, index=[r["id"] for r in rows])
+
+
+def query_candidates(center: Optional[tuple] = None, radius_km: Optional[float] = None,
+                     blood_codes: Optional[Iterable[int]] = None,
+                     available_only: bool = True) -> pd.DataFrame:
+    """
+    Donor rows matching the filters, in table order and indexed by their
+    store id (stable across queries of the same version):
+      center + radius_km  donors within radius_km (grid cells, then exact)
+      blood_codes         only these antigen codes
+      available_only      skip donors marked unavailable
+    """
+    where, params = [], []
+    if available_only:
+        where.append("available = 1")
+    if blood_codes is not None:
+        codes = [int(c) for c in blood_codes]
+        if not codes:
+            return pd.DataFrame(columns=DONOR_COLUMNS)
+        where.append(f"bg_code IN ({', '.join('?' * len(codes))})")
+        params += codes
+    if center is not None and radius_km:
+        # same search box as DonorGridIndex.query_radius
+        lat0, lon0 = center
+        dlat = radius_km / 111.0
+        cos_lat = max(math.cos(math.radians(min(abs(lat0) + dlat, 89.9))), 1e-6)
+        dlon = min(radius_km / (111.320 * cos_lat), 180.0)
+        where.append("cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?")
+        params += [
+            math.floor((lat0 - dlat) / SPATIAL_CELL_DEG), math.floor((lat0 + dlat) / SPATIAL_CELL_DEG),
+            math.floor((lon0 - dlon) / SPATIAL_CELL_DEG), math.floor((lon0 + dlon) / SPATIAL_CELL_DEG),
+        ]
+
+    sql = "SELECT * FROM donors"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(sql + " ORDER BY source, id", params).fetchall()
+        columns = _columns(conn)
+    finally:
+        conn.close()
+
+    if center is not None and radius_km and rows:
+        lat = np.array([as_float(r["lat"]) for r in rows], dtype=float)
+        lon = np.array([as_float(r["lon"]) for r in rows], dtype=float)
+        # same slack as the in-memory index
+        keep = haversine_m(center[0], center[1], lat, lon) / 1000.0 <= radius_km * 1.005
+        rows = [r for r, k in zip(rows, keep) if k]
+    return _frame(rows, columns, index=[r["id"] for r in rows])
+
+
+# run table creation at import
+init_donor_db()
@@ -0,0 +1,423 @@
+# app/geo_cache.py
+"""
+Local caches in front of OpenRouteService lookups.
+
+Geocoding: normalized address -> (lat, lon), kept in a bounded in-memory LRU
+backed by a SQLite table so entries survive restarts. Addresses that fail to
+resolve are cached too (negative entries) with a shorter TTL.
+
+Road distances: both endpoints are snapped to a grid of
+DISTANCE_CACHE_PRECISION decimal degrees and (origin cell, destination cell)
+-> (distance_m, duration_s) is cached the same way, with a maximum age.
+Only the misses are sent to ORS.
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple, Any, List, Dict
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from app.config import (
+    GEO_CACHE_DB_PATH,
+    GEOCODE_TTL_S,
+    GEOCODE_NEGATIVE_TTL_S,
+    GEOCODE_MEMORY_ENTRIES,
+    DISTANCE_CACHE_PRECISION,
+    DISTANCE_CACHE_MAX_AGE_S,
+    DISTANCE_MEMORY_ENTRIES,
+)
+from app.google_maps import (
+    geocode_address,
+    async_geocode_address,
+    distance_matrix,
+    distance_matrix_many_to_many,
+    async_distance_matrix,
+)
+
+_MISSING = object()
+
+
+def normalize_address(address: str) -> str:
+    """ "  Bannerghatta Rd., Bengaluru " -> "bannerghatta rd bengaluru" """
+    text = unicodedata.normalize("NFKC", str(address)).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU of key -> (value, expires_at). With max_bytes, entries
+    put() with their size are also evicted to keep the total under it.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data: "OrderedDict[Any, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires_at, nbytes = item
+            if expires_at <= now:
+                del self._data[key]
+                self.nbytes -= nbytes
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at: float, nbytes: int = 0):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._data[key] = (value, expires_at, nbytes)
+            self.nbytes += nbytes
+            while len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self.nbytes > self.max_bytes and len(self._data) > 1):
+                self.nbytes -= self._data.popitem(last=False)[1][2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Counters:
+    def __init__(self):
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        total = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / total, 4) if total else None,
+        }
+
+
+def _connect():
+    GEO_CACHE_DB_PATH.parent.mkdir(exist_ok=True)
+    return sqlite3.connect(GEO_CACHE_DB_PATH, timeout=5)
+
+
+def init_geo_cache_db():
+    conn = _connect()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS road_distance_cache (
+            precision INTEGER NOT NULL,
+            o_lat INTEGER NOT NULL,
+            o_lon INTEGER NOT NULL,
+            d_lat INTEGER NOT NULL,
+            d_lon INTEGER NOT NULL,
+            distance_m REAL NOT NULL,
+            duration_s REAL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (precision, o_lat, o_lon, d_lat, d_lon)
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+class GeocodeCache:
+    def __init__(self, max_entries: int = GEOCODE_MEMORY_ENTRIES,
+                 ttl_s: float = GEOCODE_TTL_S, negative_ttl_s: float = GEOCODE_NEGATIVE_TTL_S):
+        self.memory = LRUCache(max_entries)
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self.stats = _Counters()
+
+    def get(self, key: str):
+        """(lat, lon), None for a cached failure, or _MISSING."""
+        value = self.memory.get(key)
+        if value is not _MISSING:
+            self.stats.memory_hits += 1
+            return value
+
+        now = time.time()
+        try:
+            conn = _connect()
+            row = conn.execute(
+                "SELECT lat, lon, expires_at FROM geocode_cache WHERE address_key = ?", (key,)
+            ).fetchone()
+            conn.close()
+        except sqlite3.Error:
+            row = None
+        if row is None or row[2] <= now:
+            self.stats.misses += 1
+            return _MISSING
+
+        value = None if row[0] is None else (row[0], row[1])
+        self.memory.put(key, value, row[2])
+        self.stats.db_hits += 1
+        return value
+
+    def put(self, key: str, coords: Optional[Tuple[float, float]]):
+        expires_at = time.time() + (self.ttl_s if coords is not None else self.negative_ttl_s)
+        self.memory.put(key, coords, expires_at)
+        lat, lon = coords if coords is not None else (None, None)
+        try:
+            conn = _connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (address_key, lat, lon, expires_at) VALUES (?, ?, ?, ?)",
+                (key, lat, lon, expires_at),
+            )
+            # opportunistic cleanup of expired rows
+            conn.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+Cell = Tuple[int, int]
+
+
+def snap(lat: float, lon: float, precision: int = DISTANCE_CACHE_PRECISION) -> Cell:
+    """Grid cell of a coordinate: lat/lon rounded to `precision` decimals, as ints."""
+    scale = 10 ** precision
+    return (int(round(float(lat) * scale)), int(round(float(lon) * scale)))
+
+
+class DistanceCache:
+    """(origin cell, destination cell) -> (distance_m, duration_s)."""
+
+    def __init__(self, precision: int = DISTANCE_CACHE_PRECISION,
+                 max_age_s: float = DISTANCE_CACHE_MAX_AGE_S,
+                 max_entries: int = DISTANCE_MEMORY_ENTRIES):
+        self.precision = precision
+        self.max_age_s = max_age_s
+        self.memory = LRUCache(max_entries)
+        self.stats = _Counters()
+
+    def get_many(self, origin: Cell, dests: List[Cell]) -> List[Any]:
+        """Cached (distance_m, duration_s) per destination cell, _MISSING where absent."""
+        out = [self.memory.get((origin, d)) for d in dests]
+        pending = [i for i, v in enumerate(out) if v is _MISSING]
+        self.stats.memory_hits += len(dests) - len(pending)
+        if not pending:
+            return out
+
+        now = time.time()
+        try:
+            # one query for everything cached from this origin cell
+            conn = _connect()
+            rows = conn.execute(
+                """
+                SELECT d_lat, d_lon, distance_m, duration_s, fetched_at FROM road_distance_cache
+                WHERE precision = ? AND o_lat = ? AND o_lon = ? AND fetched_at > ?
+                """,
+                (self.precision, origin[0], origin[1], now - self.max_age_s),
+            ).fetchall()
+            conn.close()
+        except sqlite3.Error:
+            rows = []
+        stored = {(r[0], r[1]): ((r[2], r[3]), r[4]) for r in rows}
+
+        for i in pending:
+            item = stored.get(dests[i])
+            if item is None:
+                self.stats.misses += 1
+                continue
+            value, fetched_at = item
+            self.memory.put((origin, dests[i]), value, fetched_at + self.max_age_s)
+            out[i] = value
+            self.stats.db_hits += 1
+        return out
+
+    def put_many(self, origin: Cell, items: Dict[Cell, Tuple[float, Optional[float]]]):
+        now = time.time()
+        for d, value in items.items():
+            self.memory.put((origin, d), value, now + self.max_age_s)
+        try:
+            conn = _connect()
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO road_distance_cache
+                    (precision, o_lat, o_lon, d_lat, d_lon, distance_m, duration_s, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (self.precision, origin[0], origin[1], d[0], d[1], v[0], v[1], now)
+                    for d, v in items.items()
+                ],
+            )
+            conn.commit()
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# run table creation at import
+init_geo_cache_db()
+geocode_cache = GeocodeCache()
+distance_cache = DistanceCache()
+
+
+def geocode_address_cached(address: str):
+    """geocode_address() behind the cache. Network errors are raised, not cached."""
+    key = normalize_address(address)
+    if not key:
+        return None
+    coords = geocode_cache.get(key)
+    if coords is not _MISSING:
+        return coords
+    coords = geocode_address(address)
+    geocode_cache.put(key, tuple(coords) if coords is not None else None)
+    return coords
+
+
+async def async_geocode_address_cached(address: str):
+    key = normalize_address(address)
+    if not key:
+        return None
+    coords = geocode_cache.get(key)
+    if coords is not _MISSING:
+        return coords
+    coords = await async_geocode_address(address)
+    geocode_cache.put(key, tuple(coords) if coords is not None else None)
+    return coords
+
+
+def _lookup_road_distances(origin: tuple, destinations: List[tuple]):
+    """Cache lookup; returns (origin cell, dest cells, cached values, miss cells -> first index)."""
+    o_cell = snap(*origin, precision=distance_cache.precision)
+    d_cells = [snap(lat, lon, precision=distance_cache.precision) for lat, lon in destinations]
+    cached = distance_cache.get_many(o_cell, d_cells)
+    misses: Dict[Cell, int] = {}
+    for i, v in enumerate(cached):
+        if v is _MISSING and d_cells[i] not in misses:
+            misses[d_cells[i]] = i
+    return o_cell, d_cells, cached, misses
+
+
+def _merge_road_distances(o_cell, d_cells, cached, misses, ors_raw) -> dict:
+    fetched: Dict[Cell, Tuple[float, Optional[float]]] = {}
+    if ors_raw is not None:
+        dist_row = ors_raw["distances"][0]
+        dur_row = (ors_raw.get("durations") or [[None] * len(dist_row)])[0]
+        for j, cell in enumerate(misses):
+            # ORS row: index 0 is origin->origin, destinations from index 1
+            if dist_row[j + 1] is not None:
+                fetched[cell] = (dist_row[j + 1], dur_row[j + 1])
+        if fetched:
+            distance_cache.put_many(o_cell, fetched)
+
+    distances, durations = [0.0], [0.0]
+    for cell, v in zip(d_cells, cached):
+        if v is _MISSING:
+            v = fetched.get(cell, (None, None))
+        distances.append(v[0])
+        durations.append(v[1])
+    return {
+        "distances": [distances],
+        "durations": [durations],
+        "metadata": {"cache_hits": len(d_cells) - sum(v is _MISSING for v in cached), "ors_requested": len(misses)},
+    }
+
+
+def _coord_str(coord: tuple) -> str:
+    return f"{coord[0]},{coord[1]}"
+
+
+def cached_road_distances(origin: tuple, destinations: List[tuple]) -> dict:
+    """
+    One-to-many road distances (origin/destinations as (lat, lon)) with the
+    same shape as distance_matrix(..., one_to_many=True); only cache misses
+    (deduplicated by grid cell) go to ORS.
+    """
+    o_cell, d_cells, cached, misses = _lookup_road_distances(origin, destinations)
+    ors_raw = None
+    if misses:
+        miss_strs = [_coord_str(destinations[i]) for i in misses.values()]
+        ors_raw = distance_matrix([_coord_str(origin)], miss_strs, mode="driving", one_to_many=True)
+    return _merge_road_distances(o_cell, d_cells, cached, misses, ors_raw)
+
+
+async def async_cached_road_distances(origin: tuple, destinations: List[tuple]) -> dict:
+    o_cell, d_cells, cached, misses = _lookup_road_distances(origin, destinations)
+    ors_raw = None
+    if misses:
+        miss_strs = [_coord_str(destinations[i]) for i in misses.values()]
+        ors_raw = await async_distance_matrix([_coord_str(origin)], miss_strs, mode="driving", one_to_many=True)
+    return _merge_road_distances(o_cell, d_cells, cached, misses, ors_raw)
+
+
+def cached_road_distances_many(origins: List[tuple], destinations: List[List[tuple]]) -> List[dict]:
+    """
+    Batch form of cached_road_distances(): destinations[i] belongs to
+    origins[i]. Cache misses of all origins are resolved with a single
+    many-to-many ORS computation (origins and destination cells deduplicated).
+    Returns one one-to-many style dict per origin.
+    """
+    lookups = [_lookup_road_distances(o, ds) for o, ds in zip(origins, destinations)]
+
+    # unique origins (by cell) and destination cells that have misses
+    miss_origins: Dict[Cell, tuple] = {}
+    miss_dests: Dict[Cell, tuple] = {}
+    for origin, ds, (o_cell, _, _, misses) in zip(origins, destinations, lookups):
+        if misses:
+            miss_origins.setdefault(o_cell, origin)
+            for cell, i in misses.items():
+                miss_dests.setdefault(cell, ds[i])
+
+    matrix = None
+    if miss_origins:
+        matrix = distance_matrix_many_to_many(
+            [_coord_str(o) for o in miss_origins.values()],
+            [_coord_str(d) for d in miss_dests.values()],
+        )
+    row_of = {cell: r for r, cell in enumerate(miss_origins)}
+    col_of = {cell: c for c, cell in enumerate(miss_dests)}
+
+    out = []
+    for o_cell, d_cells, cached, misses in lookups:
+        ors_raw = None
+        if misses and matrix is not None:
+            r = row_of[o_cell]
+            cols = [col_of[cell] for cell in misses]
+            # reshape into the one-to-many row layout (index 0 = origin)
+            ors_raw = {
+                "distances": [[0.0] + [matrix["distances"][r][c] for c in cols]],
+                "durations": [[0.0] + [matrix["durations"][r][c] for c in cols]],
+            }
+        out.append(_merge_road_distances(o_cell, d_cells, cached, misses, ors_raw))
+    return out
+
+
+def cache_stats() -> dict:
+    return {
+        "geocode": {**geocode_cache.stats.as_dict(), "memory_entries": len(geocode_cache.memory)},
+        "road_distance": {
+            **distance_cache.stats.as_dict(),
+            "memory_entries": len(distance_cache.memory),
+            "precision": distance_cache.precision,
+            "max_age_s": distance_cache.max_age_s,
+        },
+    }
@@ -1,33 +1,30 @@
 # app/google_maps.py
 import os
-import requests
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 from dotenv import load_dotenv
+from app.config import ORS_MATRIX_CHUNK_SIZE, ORS_MATRIX_MAX_WORKERS, ORS_MATRIX_MAX_ELEMENTS
+from app.http_client import request, async_request  # pooled keep-alive clients
 load_dotenv()
 
 # 🔐 Your OpenRouteService basic key
 ORS_KEY = "eyJvcmciOiI1YjNjZTM1OTc4NTExMTAwMDFjZjYyNDgiLCJpZCI6IjQ5OTI0ZDVkYTM2NzQzYmQ4NWJmMjZjYzU2OGI3NjI1IiwiaCI6Im11cm11cjY0In0="
 
 DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
-def distance_matrix(origins: list, destinations: list, mode: str = "driving"):
-    """
-    Compatible wrapper for existing main.py code.
-
-    main.py passes:
-        origins:      ["lat,lon"]
-        destinations: ["lat,lon", "lat,lon", ...]
+MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
 
-    This function:
-    - parses those strings
-    - calls OpenRouteService Matrix API
-    - returns ORS JSON
-    """
 
-    url = "https://api.openrouteservice.org/v2/matrix/driving-car"
+def _headers() -> dict:
+    return {
+        "Authorization": ORS_KEY,
+        "Content-Type": "application/json"
+    }
 
-    # origins + destinations come as strings "lat,lon"
-    coord_strings = origins + destinations
 
+def _parse_coord_strings(coord_strings: list) -> list:
+    """ "lat,lon" strings -> ORS [lon, lat] pairs ([0, 0] placeholder if invalid)."""
     coords = []
     for s in coord_strings:
         if not s:
@@ -43,20 +40,175 @@ def distance_matrix(origins: list, destinations: list, mode: str = "driving"):
         except Exception:
             # fallback if parsing fails
             coords.append([0.0, 0.0])
+    return coords
 
-    payload = {
-        "locations": coords,
+
+def _post_matrix(payload: dict) -> dict:
+    return request("POST", MATRIX_URL, json=payload, headers=_headers()).json()
+
+
+async def _async_post_matrix(payload: dict) -> dict:
+    resp = await async_request("POST", MATRIX_URL, json=payload, headers=_headers())
+    return resp.json()
+
+
+def _matrix_payload(origins: list, destinations: list) -> dict:
+    # origins + destinations come as strings "lat,lon"
+    return {
+        "locations": _parse_coord_strings(origins + destinations),
         "metrics": ["distance", "duration"]
     }
 
-    headers = {
-        "Authorization": ORS_KEY,
-        "Content-Type": "application/json"
+
+def _one_to_many_payloads(origin: str, destinations: list, chunk_size: int):
+    """Split destinations into ORS sources=[0] requests; returns (chunks, payloads)."""
+    origin_coord = _parse_coord_strings([origin])[0]
+    chunks = [destinations[i:i + chunk_size] for i in range(0, len(destinations), chunk_size)]
+    payloads = [
+        {
+            "locations": [origin_coord] + _parse_coord_strings(chunk),
+            "sources": [0],
+            "destinations": list(range(1, len(chunk) + 1)),
+            "metrics": ["distance", "duration"],
+        }
+        for chunk in chunks
+    ]
+    return chunks, payloads
+
+
+def _merge_one_to_many(chunks: list, results: list) -> dict:
+    """results[i] is the ORS JSON for chunks[i], or the exception it raised."""
+    distances, durations, errors = [0.0], [0.0], []
+    for chunk, data in zip(chunks, results):
+        if isinstance(data, Exception):
+            # a failed chunk leaves its destinations unknown (None)
+            errors.append(data)
+            distances.extend([None] * len(chunk))
+            durations.extend([None] * len(chunk))
+        else:
+            distances.extend(data["distances"][0])
+            durations.extend(data["durations"][0])
+    if chunks and len(errors) == len(chunks):
+        raise errors[0]
+    return {
+        "distances": [distances],
+        "durations": [durations],
+        "metadata": {"chunks": len(chunks), "failed_chunks": len(errors)},
     }
 
-    resp = requests.post(url, json=payload, headers=headers, timeout=20)
-    resp.raise_for_status()
-    return resp.json()
+
+def distance_matrix(origins: list, destinations: list, mode: str = "driving", one_to_many: bool = False):
+    """
+    Compatible wrapper for existing main.py code.
+
+    main.py passes:
+        origins:      ["lat,lon"]
+        destinations: ["lat,lon", "lat,lon", ...]
+
+    This function:
+    - parses those strings
+    - calls OpenRouteService Matrix API
+    - returns ORS JSON
+
+    one_to_many=True (single origin): destinations are split into chunks of
+    ORS_MATRIX_CHUNK_SIZE, fetched concurrently, and merged into one
+    origin -> destinations row. "distances"/"durations" keep the usual shape
+    (row 0, index 0 is origin->origin, destinations from index 1).
+    """
+    if one_to_many and len(origins) == 1:
+        return _distance_matrix_one_to_many(origins[0], destinations)
+    return _post_matrix(_matrix_payload(origins, destinations))
+
+
+def _distance_matrix_one_to_many(origin: str, destinations: list,
+                                 chunk_size: int = ORS_MATRIX_CHUNK_SIZE,
+                                 max_workers: int = ORS_MATRIX_MAX_WORKERS) -> dict:
+    chunks, payloads = _one_to_many_payloads(origin, destinations, chunk_size)
+    results = []
+    if payloads:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(payloads)))) as pool:
+            futures = [pool.submit(_post_matrix, payload) for payload in payloads]
+            for fut in futures:
+                try:
+                    results.append(fut.result())
+                except Exception as e:
+                    results.append(e)
+    return _merge_one_to_many(chunks, results)
+
+
+def distance_matrix_many_to_many(origins: list, destinations: list,
+                                 max_elements: int = ORS_MATRIX_MAX_ELEMENTS,
+                                 max_workers: int = ORS_MATRIX_MAX_WORKERS) -> dict:
+    """
+    Every origin to every destination ("lat,lon" strings). Destinations are
+    chunked so each ORS request stays within max_elements (origins x chunk)
+    and chunks are fetched concurrently.
+
+    Returns {"distances": [[...]], "durations": [[...]]} with one row per
+    origin and one column per destination (no origin columns); entries of
+    failed chunks are None.
+    """
+    if not origins or not destinations:
+        return {"distances": [[] for _ in origins], "durations": [[] for _ in origins]}
+    origin_coords = _parse_coord_strings(origins)
+    chunk_size = max(1, max_elements // len(origins))
+    chunks = [destinations[i:i + chunk_size] for i in range(0, len(destinations), chunk_size)]
+    payloads = [
+        {
+            "locations": origin_coords + _parse_coord_strings(chunk),
+            "sources": list(range(len(origins))),
+            "destinations": list(range(len(origins), len(origins) + len(chunk))),
+            "metrics": ["distance", "duration"],
+        }
+        for chunk in chunks
+    ]
+
+    distances = [[] for _ in origins]
+    durations = [[] for _ in origins]
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(payloads)))) as pool:
+        futures = [pool.submit(_post_matrix, payload) for payload in payloads]
+        for chunk, fut in zip(chunks, futures):
+            try:
+                data = fut.result()
+                d_rows, t_rows = data["distances"], data["durations"]
+            except Exception as e:
+                errors.append(e)
+                d_rows = t_rows = [[None] * len(chunk) for _ in origins]
+            for r in range(len(origins)):
+                distances[r].extend(d_rows[r])
+                durations[r].extend(t_rows[r])
+    if len(errors) == len(chunks):
+        raise errors[0]
+    return {
+        "distances": distances,
+        "durations": durations,
+        "metadata": {"chunks": len(chunks), "failed_chunks": len(errors)},
+    }
+
+
+async def async_distance_matrix(origins: list, destinations: list, mode: str = "driving",
+                                one_to_many: bool = False):
+    """Async distance_matrix(); chunks are awaited concurrently, at most ORS_MATRIX_MAX_WORKERS at a time."""
+    if not (one_to_many and len(origins) == 1):
+        return await _async_post_matrix(_matrix_payload(origins, destinations))
+
+    chunks, payloads = _one_to_many_payloads(origins[0], destinations, ORS_MATRIX_CHUNK_SIZE)
+    sem = asyncio.Semaphore(ORS_MATRIX_MAX_WORKERS)
+
+    async def fetch(payload):
+        async with sem:
+            return await _async_post_matrix(payload)
+
+    results = await asyncio.gather(*(fetch(p) for p in payloads), return_exceptions=True)
+    return _merge_one_to_many(chunks, list(results))
+
+
+def _parse_geocode(data: dict):
+    if "features" in data and data["features"]:
+        coords = data["features"][0]["geometry"]["coordinates"]  # [lon, lat]
+        return (coords[1], coords[0])  # return (lat, lon)
+    return None
 
 
 def geocode_address(address: str):
@@ -64,27 +216,23 @@ def geocode_address(address: str):
     Free geocoding using OpenRouteService.
     Converts address -> (lat, lon)
     """
-    url = "https://api.openrouteservice.org/geocode/search"
     params = {
         "api_key": ORS_KEY,
         "text": address
     }
-    resp = requests.get(url, params=params, timeout=10)
-    resp.raise_for_status()
-    data = resp.json()
+    return _parse_geocode(request("GET", GEOCODE_URL, params=params).json())
 
-    if "features" in data and data["features"]:
-        coords = data["features"][0]["geometry"]["coordinates"]  # [lon, lat]
-        return (coords[1], coords[0])  # return (lat, lon)
 
-    return None
+async def async_geocode_address(address: str):
+    params = {
+        "api_key": ORS_KEY,
+        "text": address
+    }
+    resp = await async_request("GET", GEOCODE_URL, params=params)
+    return _parse_geocode(resp.json())
 
-def directions_route(origin: tuple, destination: tuple, extra: dict = None):
-    """
-    origin: (lat, lon)
-    destination: (lat, lon)
-    returns: dict with keys: geometry (list of [lat, lon]), distance_m, duration_s, raw (full JSON)
-    """
+
+def _directions_payload(origin: tuple, destination: tuple, extra: dict = None) -> dict:
     if not ORS_KEY:
         raise Exception("ORS API key not set on server (ORS_KEY).")
 
@@ -97,16 +245,10 @@ def directions_route(origin: tuple, destination: tuple, extra: dict = None):
     }
     if extra:
         payload.update(extra)
+    return payload
 
-    headers = {
-        "Authorization": ORS_KEY,
-        "Content-Type": "application/json"
-    }
-
-    resp = requests.post(DIRECTIONS_URL, json=payload, headers=headers, timeout=20)
-    resp.raise_for_status()
-    data = resp.json()
 
+def _parse_directions(data: dict) -> dict:
     # Parse geometry: ORS returns geometry in "features"[0]["geometry"]["coordinates"] as [lon,lat] pairs
     coords_list = []
     try:
@@ -131,3 +273,15 @@ def directions_route(origin: tuple, destination: tuple, extra: dict = None):
         "duration_s": duration_s,
         "raw": data
     }
+
+
+def directions_route(origin: tuple, destination: tuple, extra: dict = None):
+    """
+    origin: (lat, lon)
+    destination: (lat, lon)
+    returns: dict with keys: geometry (list of [lat, lon]), distance_m, duration_s, raw (full JSON)
+    """
+    payload = _directions_payload(origin, destination, extra)
+    resp = request("POST", DIRECTIONS_URL, json=payload, headers=_headers())
+    return _parse_directions(resp.json())
+
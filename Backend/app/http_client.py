@@ -0,0 +1,133 @@
+# app/http_client.py
+"""
+Shared, pooled HTTP clients for outbound API calls (OpenRouteService).
+
+One requests.Session (sync code, thread pools) and one httpx.AsyncClient
+(async handlers) are reused process-wide, so connections stay alive across
+matches instead of paying a TCP + TLS handshake per call. Both retry
+transient failures (connection errors, 429 and 5xx) with exponential backoff.
+A read timeout is not retried: the server got the request and is slow, so a
+retry would only multiply the wait (worst case stays about one read timeout).
+"""
+from typing import Optional
+import asyncio
+import logging
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.config import (
+    HTTP_CONNECT_TIMEOUT_S,
+    HTTP_READ_TIMEOUT_S,
+    HTTP_POOL_MAXSIZE,
+    HTTP_RETRIES,
+    HTTP_BACKOFF_S,
+)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+_async_client: Optional[httpx.AsyncClient] = None
+_async_loop = None
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=HTTP_RETRIES,
+                    read=0,  # errors after the request was sent (read timeouts) are not retried
+                    backoff_factor=HTTP_BACKOFF_S,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(["GET", "POST"]),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                # pool_maxsize is the number of kept-alive connections per host
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def request(method: str, url: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    """requests.request() through the pooled session; raises for HTTP errors."""
+    read_timeout = timeout if timeout is not None else HTTP_READ_TIMEOUT_S
+    resp = get_session().request(method, url, timeout=(HTTP_CONNECT_TIMEOUT_S, read_timeout), **kwargs)
+    resp.raise_for_status()
+    return resp
+
+
+async def _close_stale(client: httpx.AsyncClient, loop):
+    """Close the client of an event loop this process has moved away from."""
+    if loop is not None and loop.is_running():
+        # still serving another thread: close it there
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        return
+    try:
+        await client.aclose()
+    except Exception as e:
+        # connections tied to a closed loop; their sockets go with the client
+        logger.info(f"closing stale HTTP client failed: {e}")
+
+
+async def get_async_client() -> httpx.AsyncClient:
+    """AsyncClient bound to the running event loop (recreated, and the old one closed, if the loop changes)."""
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop or _async_client.is_closed:
+        stale, stale_loop = _async_client, _async_loop
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT_S, connect=HTTP_CONNECT_TIMEOUT_S),
+        )
+        _async_loop = loop
+        if stale is not None and not stale.is_closed:
+            await _close_stale(stale, stale_loop)
+    return _async_client
+
+
+async def async_request(method: str, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+    """Async counterpart of request(), with the same retry/backoff policy."""
+    client = await get_async_client()
+    read_timeout = timeout if timeout is not None else HTTP_READ_TIMEOUT_S
+    timeouts = httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT_S)
+    for attempt in range(HTTP_RETRIES + 1):
+        last = attempt == HTTP_RETRIES
+        try:
+            resp = await client.request(method, url, timeout=timeouts, **kwargs)
+        except httpx.ReadTimeout:
+            raise
+        except httpx.TransportError:
+            if last:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or last:
+                resp.raise_for_status()
+                return resp
+        await asyncio.sleep(HTTP_BACKOFF_S * (2 ** attempt))
+
+
+async def aclose():
+    """Close pooled connections (app shutdown)."""
+    global _session, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
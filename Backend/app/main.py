@@ -1,30 +1,59 @@
 # app/main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from app.chat import router as chat_router
 from app.store import (
     save_uploaded_file,
-    load_donors,
+    load_donor_snapshot,
+    load_uploaded_donors,
+    donors_sample as sample_donor_rows,
     load_requests,
     load_hospitals,
+    hospital_coord,
     DONORS_CSV,
     REQUESTS_CSV,
     HOSPITALS_CSV,
 )
-from app.match_engine import rank_donors_for_request
-from pydantic import BaseModel
-from typing import Optional
+from app.match_engine import (
+    score_and_refine_async,
+    score_donors,
+    open_cursor,
+    next_page,
+    refine_progressively,
+    refine_count,
+)
+from pydantic import BaseModel, Field
+from typing import Optional, List
 from pathlib import Path
-import joblib
-from app.config import MATCH_MODEL_PATH
 import os
+import time
+import json
+import asyncio
 from fastapi import APIRouter, Depends
-from app.google_maps import distance_matrix, geocode_address, directions_route # 🔹 include geocode_address
+from app.google_maps import distance_matrix, directions_route
+from app.http_client import aclose as close_http_clients
+from app.coherence import write_atomic
+from app.geo_cache import (
+    async_geocode_address_cached,
+    cached_road_distances,
+    cache_stats,
+)
+from app.config import (
+    MATCH_LATENCY_BUDGET_S,
+    MATCH_URGENT_LATENCY_BUDGET_S,
+    STANDING_LISTS_ENABLED,
+)
 
 from app.auth import router as auth_router, get_current_user,  require_hospital # 🔒 add get_current_user
 from app.donations import router as donations_router
 from app.alerts import trigger_match_alert
+from app.batch_match import match_batch, match_open_requests
+from app.allocation import allocate_donors, allocate_open_requests
+from app.result_cache import match_result_cache
+from app.standing_lists import standing_lists_loop, standing_lists_status
+from app.model_registry import store_model_version, activate_version, model_status
 # app/main.py
 
 app = FastAPI(title="PulseNet - Blood Matching Backend (CSV-based)")
@@ -53,7 +82,41 @@ class MatchRequest(BaseModel):
     lon: Optional[float] = None
     units_needed: Optional[int] = 1
     urgency_level: Optional[str] = None
-    top_n: Optional[int] = 10
+    # None = every match; 0 / negative is rejected (422)
+    top_n: Optional[int] = Field(10, ge=1)
+
+
+class BatchMatchRequest(BaseModel):
+    requests: Optional[List[MatchRequest]] = None
+    use_open_requests: bool = False  # match every row of requests.csv instead
+    top_n: Optional[int] = Field(10, ge=1)
+    road_distances: bool = True
+
+
+class AllocationRequest(BaseModel):
+    requests: Optional[List[MatchRequest]] = None
+    use_open_requests: bool = False  # allocate across every row of requests.csv
+    road_distances: bool = False
+    method: str = "auto"  # auto | optimal | greedy
+
+
+# ---------- Startup: standing per-hospital match lists ----------
+_standing_task = None
+
+
+@app.on_event("startup")
+async def start_standing_lists():
+    global _standing_task
+    if STANDING_LISTS_ENABLED:
+        _standing_task = asyncio.create_task(standing_lists_loop())
+
+
+# ---------- Shutdown: release pooled ORS connections ----------
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    if _standing_task is not None:
+        _standing_task.cancel()
+    await close_http_clients()
 
 
 # ---------- Health ----------
@@ -69,9 +132,9 @@ async def upload_donors(
 ):
     content = await file.read()
     target = Path(DONORS_CSV)
-    target.write_bytes(content)
-    df = load_donors(force=True)
-    return {"status": "ok", "rows": len(df)}
+    write_atomic(target, content)
+    snapshot = load_uploaded_donors()
+    return {"status": "ok", "rows": int(snapshot.live.sum())}
 
 
 @app.post("/api/upload/requests")
@@ -81,7 +144,7 @@ async def upload_requests(
 ):
     content = await file.read()
     target = Path(REQUESTS_CSV)
-    target.write_bytes(content)
+    write_atomic(target, content)
     df = load_requests(force=True)
     return {"status": "ok", "rows": len(df)}
 
@@ -93,25 +156,25 @@ async def upload_hospitals(
 ):
     content = await file.read()
     target = Path(HOSPITALS_CSV)
-    target.write_bytes(content)
+    write_atomic(target, content)
     df = load_hospitals(force=True)
     return {"status": "ok", "rows": len(df)}
 
 
 # ---------- Info endpoints ----------
+# donor endpoints read the snapshot's records and columns, never the whole DataFrame
 @app.get("/api/donors/sample")
 def donors_sample(n: int = 5):
-    df = load_donors()
-    if df.empty:
+    if not load_donor_snapshot().live.any():
         return {"status": "no_data", "sample": []}
-    return {"status": "ok", "sample": df.head(n).to_dict(orient="records")}
+    return {"status": "ok", "sample": sample_donor_rows(n)}
 
 @app.get("/api/donors/cols")
 def donors_cols():
-    df = load_donors()
-    if df.empty:
+    snapshot = load_donor_snapshot()
+    if not snapshot.live.any():
         return {"status": "no_data"}
-    return {"status": "ok", "columns": df.columns.tolist()}
+    return {"status": "ok", "columns": snapshot.columns}
 
 @app.get("/api/requests/cols")
 def requests_cols():
@@ -127,16 +190,27 @@ def hospitals_cols():
         return {"status": "no_data"}
     return {"status": "ok", "columns": df.columns.tolist()}
 
-@app.post("/api/match")
-def match_handler(
-    req: MatchRequest,
-    current_user = Depends(get_current_user)
-):
-    reqd = req.dict()
+def _latency_budget(reqd: dict) -> float:
+    """Seconds a match may spend waiting on ORS; urgent requests get less."""
+    urgency = str(reqd.get("urgency_level") or "").lower()
+    if urgency in ["high", "critical"]:
+        return MATCH_URGENT_LATENCY_BUDGET_S
+    return MATCH_LATENCY_BUDGET_S
+
 
+async def _resolve_match_location(reqd: dict, budget_s: float):
     # 🔹 1) If lat/lon missing but address is given -> geocode it
     if (reqd.get("lat") is None or reqd.get("lon") is None) and reqd.get("address"):
-        coords = geocode_address(reqd["address"])
+        try:
+            coords = await asyncio.wait_for(async_geocode_address_cached(reqd["address"]), timeout=budget_s)
+        except asyncio.TimeoutError:
+            # a known hospital_id still gives the origin: match from the hospital
+            if hospital_coord(reqd.get("hospital_id")) is not None:
+                return
+            raise HTTPException(
+                status_code=504,
+                detail=f"Geocoding timed out for address: {reqd['address']}",
+            )
         if coords is None:
             # Could not convert address to coordinates
             raise HTTPException(
@@ -147,56 +221,207 @@ def match_handler(
 
     # 🔹 2) If still no lat/lon and no hospital_id -> error
     if reqd.get("lat") is None or reqd.get("lon") is None:
-        # You could also fallback to hospital_id logic (already in rank_donors_for_request)
-        # but here we explicitly enforce some location.
+        # a known hospital_id is enough: matching uses the hospital's location
+        # (and its standing list, see app/standing_lists.py)
+        if hospital_coord(reqd.get("hospital_id")) is not None:
+            return
         raise HTTPException(
             status_code=400,
             detail="You must provide either lat/lon or a valid address or hospital_id.",
         )
 
-    ranked = rank_donors_for_request(reqd, top_n=req.top_n)
+
+@app.post("/api/match")
+async def match_handler(
+    req: MatchRequest,
+    paginate: bool = False,  # keep the ranking for /api/match/next
+    current_user = Depends(get_current_user)
+):
+    reqd = req.dict()
+    budget_s = _latency_budget(reqd)
+    started = time.perf_counter()
+
+    await _resolve_match_location(reqd, budget_s)
+
+    # ORS gets whatever is left of the budget; past it we answer with
+    # geodesic distances (matches flagged distance_estimated=True)
+    remaining = max(0.0, budget_s - (time.perf_counter() - started))
+    scored, road_status = await score_and_refine_async(reqd, top_n=req.top_n, budget_s=remaining)
+    ranked = scored.top(req.top_n) if scored is not None else []
     alert = trigger_match_alert(reqd, ranked)
 
     return {
         "status": "ok",
         "matches": ranked,
-        "alert": alert,
+        "alert": alert,  # can be None or alert dict
+        "road_distances": road_status,  # ok | partial | timeout | error | skipped | cached | standing
+        # with ?paginate=true: pass to /api/match/next for the following page
+        # (None = no more donors, or paging not requested)
+        "next_cursor": open_cursor(scored, len(ranked), reqd) if paginate else None,
     }
 
 
+@app.get("/api/match/next")
+def match_next_page(
+    cursor: str,
+    limit: int = 10,
+    current_user = Depends(get_current_user),
+):
+    """Next page of a previous /api/match?paginate=true ranking, served from its scored snapshot (no rescoring)."""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    page = next_page(cursor, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Cursor expired or unknown; run the match again")
+    matches, next_cursor = page
+    return {"status": "ok", "matches": matches, "next_cursor": next_cursor}
+
+
+@app.post("/api/match/batch")
+async def match_batch_handler(
+    req: BatchMatchRequest,
+    current_user = Depends(get_current_user),
+):
+    """
+    Match many requests against one donor snapshot. Distances are computed
+    once per distinct location and road distances for all shortlists come
+    from a single ORS matrix.
+    """
+    if req.use_open_requests:
+        return await asyncio.to_thread(match_open_requests, req.top_n, req.road_distances)
+    if not req.requests:
+        raise HTTPException(status_code=400, detail="Provide requests or set use_open_requests")
+    reqs = [r.dict() for r in req.requests]
+    return await asyncio.to_thread(match_batch, reqs, req.top_n, None, req.road_distances)
+
+
+@app.post("/api/match/allocate")
+async def match_allocate_handler(
+    req: AllocationRequest,
+    current_user = Depends(get_current_user),
+):
+    """
+    Assign donors across all given requests at once: every donor is used at
+    most once and each request gets up to units_needed donors, contested
+    donors going to the more urgent / better matching request.
+    """
+    if req.method not in ["auto", "optimal", "greedy"]:
+        raise HTTPException(status_code=400, detail="method must be auto, optimal or greedy")
+    if req.use_open_requests:
+        return await asyncio.to_thread(allocate_open_requests, req.road_distances, req.method)
+    if not req.requests:
+        raise HTTPException(status_code=400, detail="Provide requests or set use_open_requests")
+    reqs = [r.dict() for r in req.requests]
+    return await asyncio.to_thread(allocate_donors, reqs, None, req.road_distances, req.method)
+
+
+def _stream_event(name: str, payload: dict, sse: bool) -> str:
+    data = json.dumps(jsonable_encoder({"event": name, **payload}), default=str)
+    if sse:
+        return f"event: {name}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.post("/api/match/stream")
+async def match_stream_handler(
+    req: MatchRequest,
+    format: str = "ndjson",  # "ndjson" or "sse"
+    paginate: bool = False,  # final event carries a /api/match/next cursor
+    current_user = Depends(get_current_user),
+):
+    """
+    Progressive /api/match. Events, in order:
+      geodesic - top_n ranked with straight-line distances (milliseconds)
+      update   - re-ranked top_n each time a batch of ORS road distances lands
+      final    - final top_n, the trigger_match_alert() result, road_distances status
+                 and, with ?paginate=true, the /api/match/next cursor
+    """
+    reqd = req.dict()
+    sse = format == "sse"
+    await _resolve_match_location(reqd, _latency_budget(reqd))
+    scored = await asyncio.to_thread(score_donors, reqd, req.top_n)
+
+    async def events():
+        if scored is None:
+            yield _stream_event("final", {"matches": [], "alert": trigger_match_alert(reqd, []),
+                                          "road_distances": "skipped"}, sse)
+            return
+
+        yield _stream_event("geodesic", {"matches": scored.top(req.top_n)}, sse)
+
+        refined, batches = 0, 0
+        async for n in refine_progressively(scored, refine_count(req.top_n)):
+            batches += 1
+            refined += n
+            if n:
+                yield _stream_event("update", {"refined": refined, "matches": scored.top(req.top_n)}, sse)
+
+        ranked = scored.top(req.top_n)
+        road_status = "skipped" if batches == 0 else ("ok" if refined else "error")
+        yield _stream_event("final", {"matches": ranked, "alert": trigger_match_alert(reqd, ranked),
+                                      "road_distances": road_status,
+                                      "next_cursor": open_cursor(scored, len(ranked), reqd) if paginate else None}, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+
+@app.get("/api/cache/stats")
+def cache_stats_endpoint():
     return {
         "status": "ok",
-        "matches": ranked,
-        "alert": alert,  # can be None or alert dict
+        **cache_stats(),
+        "match_results": match_result_cache.stats(),
+        "standing_lists": standing_lists_status(),
     }
 
 
-
 # ---------- Model upload (optional) ----------
 @app.post("/api/model/upload")
-async def upload_model(file: UploadFile = File(...)):
+async def upload_model(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     content = await file.read()
-    Path(MATCH_MODEL_PATH).write_bytes(content)
-    # quick load
-    try:
-        _ = joblib.load(MATCH_MODEL_PATH)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Model load failed: {e}")
-    return {"status": "ok", "message": "model uploaded and validated"}
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty model file")
+    # stored as a new version; validation, warm-up and the swap run after the response
+    version = store_model_version(content)
+    background_tasks.add_task(activate_version, version)
+    return {
+        "status": "accepted",
+        "version": version,
+        "message": "model stored; it becomes active once validated (see /api/model/status)",
+    }
+
+@app.post("/api/model/activate/{version}")
+def activate_model(version: str, background_tasks: BackgroundTasks):
+    """Re-activate a previously uploaded version (e.g. roll back)."""
+    if version not in model_status()["versions"]:
+        raise HTTPException(status_code=404, detail="Unknown model version")
+    background_tasks.add_task(activate_version, version)
+    return {"status": "accepted", "version": version}
 
 @app.get("/api/model/status")
-def model_status():
-    if Path(MATCH_MODEL_PATH).exists():
-        return {"status": "ok", "path": str(MATCH_MODEL_PATH)}
-    return {"status": "no_model"}
+def model_status_endpoint():
+    return model_status()
 
 # ---------- Distance API (using ORS or your wrapper) ----------
+def _with_hospital_coord(point: dict) -> dict:
+    """{"hospital_id": "H001"} -> the same dict with the hospital's lat/lon filled in."""
+    if isinstance(point, dict) and ("lat" not in point or "lon" not in point) and point.get("hospital_id"):
+        coord = hospital_coord(point["hospital_id"])
+        if coord is None:
+            raise HTTPException(status_code=404, detail=f"Unknown hospital_id: {point['hospital_id']}")
+        point = {**point, "lat": coord[0], "lon": coord[1]}
+    return point
+
+
 @app.post("/api/google/distance")
 def google_distance(origin: dict, destinations: list,  current_user = Depends(get_current_user)):
     """
-    origin: { "lat": 12.97, "lon": 77.59 } or { "address": "..." }
+    origin: { "lat": 12.97, "lon": 77.59 } or { "address": "..." } or { "hospital_id": "H001" }
     destinations: [ { "lat": x, "lon": y }, ... ]
     """
+    origin = _with_hospital_coord(origin)
+    destinations = [_with_hospital_coord(d) for d in destinations]
     # build origin string
     if "lat" in origin and "lon" in origin:
         orig_str = f"{origin['lat']},{origin['lon']}"
@@ -214,9 +439,17 @@ def google_distance(origin: dict, destinations: list,  current_user = Depends(ge
         else:
             dest_strs.append("")  # keep placeholder
 
-    # call distance_matrix from app.google_maps (now ORS-based)
+    # call distance_matrix from app.google_maps (now ORS-based); plain
+    # coordinates go through the road-distance cache so only misses hit ORS
     try:
-        res = distance_matrix([orig_str], dest_strs)
+        coord_points = [origin] + list(destinations)
+        if all("lat" in p and "lon" in p for p in coord_points):
+            res = cached_road_distances(
+                (float(origin["lat"]), float(origin["lon"])),
+                [(float(d["lat"]), float(d["lon"])) for d in destinations],
+            )
+        else:
+            res = distance_matrix([orig_str], dest_strs, one_to_many=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -232,11 +465,12 @@ def google_distance(origin: dict, destinations: list,  current_user = Depends(ge
             distance_m = dists[0][i]
             parsed.append(
                 {
-                    "destination": dest_strs[i],
+                    "destination": dest_strs[i - 1],
                     "distance_m": distance_m,
-                    "distance_text": f"{distance_m/1000:.1f} km",
+                    # None when ORS could not route this destination
+                    "distance_text": f"{distance_m/1000:.1f} km" if distance_m is not None else None,
                     "duration_s": duration_s,
-                    "duration_text": f"{duration_s/60:.0f} mins",
+                    "duration_text": f"{duration_s/60:.0f} mins" if duration_s is not None else None,
                 }
             )
 
@@ -246,11 +480,13 @@ def google_distance(origin: dict, destinations: list,  current_user = Depends(ge
 def route_endpoint(payload: dict):
     """
     POST body: { "origin": {"lat":12.97,"lon":77.59}, "destination": {"lat":12.96,"lon":77.60} }
+    Either point may also be given as {"hospital_id": "H001"}.
     """
     origin = payload.get("origin")
     dest = payload.get("destination")
     if not origin or not dest:
         raise HTTPException(status_code=400, detail="origin and destination required")
+    origin, dest = _with_hospital_coord(origin), _with_hospital_coord(dest)
 
     try:
         o = (float(origin["lat"]), float(origin["lon"]))
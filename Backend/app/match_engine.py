@@ -1,79 +1,563 @@
 # app/match_engine.py
-from typing import Dict, Any, List, Optional
-from app.store import load_donors, load_hospitals
-from geopy.distance import geodesic
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+from app.store import load_donor_snapshot, donor_table_version, hospital_coord
+from app.donor_snapshot import DonorSnapshot, build_donor_snapshot, parse_coords
+from app.donor_db import query_candidates, sync_donor_db
+from app.blood_groups import encode_blood_group, compatible_mask
+from app.model_registry import get_active_model, predict_batch, record_inference
+from app.distance import distances_m
 import pandas as pd
-from pathlib import Path
-from app.config import MATCH_MODEL_PATH
-import joblib
-import requests, os
-from app.google_maps import distance_matrix  # ORS-based wrapper
-
-
-# ABO donor->recipient compatibility
-ABO_COMPAT = {
-    "O": ["O","A","B","AB"],
-    "A": ["A","AB"],
-    "B": ["B","AB"],
-    "AB": ["AB"]
-}
-
-def normalize_abo(bg: str) -> str:
-    if not bg:
-        return ""
-    bg = str(bg).upper().strip()
-    # remove Rh factor (+ / -)
-    bg = bg.replace("+", "").replace("-", "")
-    return bg  # returns "O", "A", "B" or "AB"
-
-def abo_compatible(donor_bg: str, recipient_bg: str) -> bool:
-    if pd.isna(donor_bg) or pd.isna(recipient_bg):
-        return False
-    d = normalize_abo(donor_bg)
-    r = normalize_abo(recipient_bg)
-    return r in ABO_COMPAT.get(d, [])
-
-
-def distance_meters(coord1, coord2) -> Optional[float]:
-    try:
-        return geodesic(coord1, coord2).meters
-    except Exception:
+import numpy as np
+from app.config import (
+    MATCH_RADIUS_KM,
+    MATCH_FROM_DB,
+    ORS_REFINE_FACTOR,
+    ORS_MATRIX_CHUNK_SIZE,
+    MATCH_SNAPSHOT_TTL_S,
+    MATCH_SNAPSHOT_ENTRIES,
+    MATCH_SNAPSHOT_MAX_BYTES,
+    MATCH_RESULT_PARTIAL_TTL_S,
+)
+import requests, time
+import asyncio
+import logging
+import secrets
+from app.geo_cache import cached_road_distances, async_cached_road_distances  # ORS matrix behind the distance cache
+from app.geo_cache import LRUCache, snap
+from app.result_cache import match_result_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _coord_arrays(donors_df: pd.DataFrame):
+    """lat/lon as float arrays, NaN where missing or unparseable."""
+    return parse_coords(donors_df)
+
+
+def _distances_from(target_coord, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Distance in meters from target_coord to every (lat, lon); NaN if unknown."""
+    # one vectorized kernel call over the whole column (app/distance.py)
+    return distances_m(target_coord[0], target_coord[1], lat, lon)
+
+
+def _distance_scores(dist_m: np.ndarray) -> np.ndarray:
+    # within 200km => score 1..0, unknown distance => 0
+    scores = np.clip(1.0 - (dist_m / 1000.0) / 200.0, 0.0, None)
+    return np.nan_to_num(scores, nan=0.0)
+
+
+def _ml_scores(snapshot: DonorSnapshot, rows: np.ndarray, donor_codes: np.ndarray, recipient_code: int,
+               req: Dict[str,Any]) -> np.ndarray:
+    scores = np.zeros(len(rows))
+    # one state per request, so a concurrent model swap never mixes versions
+    state = get_active_model()
+    if state is None or len(rows) == 0:
+        return scores
+
+    t0 = time.perf_counter()
+    recipient_bg = req.get("required_blood_group")
+    # donor rows become a DataFrame only when the model itself has to run
+    if state.lut is None or recipient_code < 0:
+        scores = predict_batch(state.model, snapshot.frame_rows(rows), recipient_bg)
+    else:
+        known = donor_codes >= 0
+        scores[known] = np.nan_to_num(state.lut[donor_codes[known], recipient_code], nan=0.0)
+        if not known.all():
+            # unparseable donor blood groups go through the model as raw strings
+            scores[~known] = predict_batch(state.model, snapshot.frame_rows(rows[~known]), recipient_bg)
+    record_inference(len(rows), (time.perf_counter() - t0) * 1000.0)
+    return scores
+
+
+def _resolve_target_coord(req: Dict[str,Any]) -> Optional[tuple]:
+    """Prefer lat/lon from the request, else look up the hospital."""
+    if req.get("lat") is not None and req.get("lon") is not None:
+        try:
+            return (float(req["lat"]), float(req["lon"]))
+        except:
+            return None
+    if req.get("hospital_id"):
+        return hospital_coord(req["hospital_id"])
+    return None
+
+
+def _build_result(donor: Dict[str,Any], score: float, s_blood: float, dist_m, s_dist: float, s_ml: float,
+                  estimated: bool = True) -> Dict[str,Any]:
+    return {
+        "donor_id": donor.get("donor_id"),
+        "name": donor.get("name"),
+        "blood_group": donor.get("blood_group"),
+        "phone": donor.get("phone"),
+        "lat": donor.get("lat"),
+        "lon": donor.get("lon"),
+        "availability": donor.get("availability"),
+        "last_donation_date": donor.get("last_donation_date"),
+        "score": float(score),
+        "blood_score": float(s_blood),
+        "distance_m": dist_m,
+        "distance_score": float(s_dist),
+        "ml_score": float(s_ml),
+        # True when distance_m is a straight-line estimate, not an ORS road distance
+        "distance_estimated": bool(estimated),
+    }
+
+
+def top_positions(scores: np.ndarray, k: int, offset: int = 0) -> np.ndarray:
+    """
+    Positions holding ranks [offset, offset + k) of scores in descending
+    order, ties broken by position exactly like a stable full sort, but only
+    the first offset + k entries are ever sorted (argpartition selects them).
+    """
+    n = len(scores)
+    end = min(n, offset + k)
+    if end <= offset:
+        return np.empty(0, dtype=np.int64)
+    keys = -np.asarray(scores, dtype=float)
+    if end < n:
+        kth = np.partition(keys, end - 1)[end - 1]
+        # everything up to the end-th key, including all ties with it
+        picked = np.flatnonzero(keys <= kth)
+    else:
+        picked = np.arange(n)
+    picked = picked[np.argsort(keys[picked], kind="stable")]
+    return picked[offset:end]
+
+
+class ScoredDonors:
+    """
+    Column-wise scores of one request's candidate donors.
+
+    Distances start as geodesic estimates; refine() swaps in road distances
+    for a shortlist and the ranking is recomputed from the arrays, so no
+    stage has to rescore or rebuild per-donor dicts.
+    """
+
+    def __init__(self, snapshot: DonorSnapshot, rows: np.ndarray, s_blood: np.ndarray, dist_m: np.ndarray,
+                 s_ml: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                 weights: Dict[str,float], target_coord: Optional[tuple]):
+        # candidate i is position rows[i] of the donor snapshot
+        self.snapshot = snapshot
+        self.rows = rows
+        self.s_blood = s_blood
+        self.dist_m = dist_m
+        self.s_ml = s_ml
+        self.lat = lat
+        self.lon = lon
+        self.weights = weights
+        self.target_coord = target_coord
+        # True where dist_m is an ORS road distance rather than a geodesic estimate
+        self.road = np.zeros(len(rows), dtype=bool)
+        # True when only donors within the match radius were scored
+        self.radius_limited = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the per-candidate arrays (the donor snapshot is shared)."""
+        return sum(a.nbytes for a in [self.rows, self.s_blood, self.dist_m, self.s_ml, self.lat, self.lon, self.road])
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Donor-store row id of each candidate (stable across snapshots)."""
+        return self.snapshot.ids[self.rows]
+
+    def distance_scores(self) -> np.ndarray:
+        return _distance_scores(self.dist_m)
+
+    def scores(self) -> np.ndarray:
+        w = self.weights
+        return (
+            w["blood"] * self.s_blood +
+            w["distance"] * self.distance_scores() +
+            w.get("ml", 0.0) * self.s_ml
+        )
+
+    def order(self) -> np.ndarray:
+        # descending by score, stable like sorted(reverse=True)
+        return np.argsort(-self.scores(), kind="stable")
+
+    def shortlist(self, k: int) -> np.ndarray:
+        """Positions of the k best-ranked candidates that still have a geodesic-only distance."""
+        refinable = np.flatnonzero(~np.isnan(self.dist_m) & ~self.road)
+        return refinable[top_positions(self.scores()[refinable], k)]
+
+    def refine(self, positions: np.ndarray, road_m) -> int:
+        """
+        Overwrite distances at positions with road distances (None/NaN
+        entries are kept as estimates). Returns how many were overwritten.
+        """
+        road_m = np.asarray(road_m, dtype=float)
+        ok = ~np.isnan(road_m)
+        if not ok.any():
+            return 0
+        self.dist_m = self.dist_m.copy()
+        self.dist_m[positions[ok]] = road_m[ok]
+        self.road = self.road.copy()
+        self.road[positions[ok]] = True
+        return int(ok.sum())
+
+    def destination_coords(self, positions: np.ndarray) -> List[tuple]:
+        return [(float(self.lat[i]), float(self.lon[i])) for i in positions]
+
+    def top(self, n: Optional[int]) -> List[Dict[str,Any]]:
+        """The n best matches; every match when n is None."""
+        return self.page(0, len(self) if n is None else n)
+
+    def page(self, offset: int, limit: int) -> List[Dict[str,Any]]:
+        """Ranks offset .. offset+limit-1; only these rows become result dicts."""
+        return self.results(top_positions(self.scores(), limit, offset))
+
+    def results(self, positions) -> List[Dict[str,Any]]:
+        """Result dicts for the given candidate positions, in that order."""
+        scores = self.scores()
+        s_dist = self.distance_scores()
+        results = []
+        for i in positions:
+            donor = self.snapshot.record(self.rows[i])
+            d_m = None if np.isnan(self.dist_m[i]) else float(self.dist_m[i])
+            results.append(_build_result(
+                donor, scores[i], self.s_blood[i], d_m, s_dist[i], self.s_ml[i],
+                estimated=d_m is not None and not self.road[i],
+            ))
+        return results
+
+
+DEFAULT_WEIGHTS = {"blood":0.7, "distance":0.3, "ml":0.0}
+# page size when the caller does not give top_n
+DEFAULT_TOP_N = 10
+
+
+def _score_snapshot_rows(req: Dict[str,Any], snapshot: DonorSnapshot, rows: np.ndarray,
+                         weights: Dict[str,float], target_coord: Optional[tuple],
+                         dist_m: np.ndarray = None) -> ScoredDonors:
+    """Blood, distance and ML columns for the candidates at snapshot positions
+    rows; codes and coordinates come pre-parsed from the snapshot (only the
+    recipient is parsed here). dist_m may be passed in when the caller has
+    it (batch matching)."""
+    recipient_code = encode_blood_group(req.get("required_blood_group"))
+    cand_codes = snapshot.bg_codes[rows]
+    lat, lon = snapshot.lat[rows], snapshot.lon[rows]
+
+    # ----- blood compatibility (ABO + Rh antigen masks) -----
+    s_blood = compatible_mask(cand_codes, recipient_code).astype(float)
+
+    # ----- distance (initial: geodesic fallback) -----
+    if dist_m is None:
+        if target_coord is not None:
+            dist_m = _distances_from(target_coord, lat, lon)
+        else:
+            dist_m = np.full(len(rows), np.nan)
+
+    # ----- ML score (optional) -----
+    s_ml = _ml_scores(snapshot, rows, cand_codes, recipient_code, req)
+
+    return ScoredDonors(snapshot, rows, s_blood, dist_m, s_ml, lat, lon, weights, target_coord)
+
+
+def _db_candidates(target_coord: Optional[tuple], radius_km: Optional[float],
+                   recipient_code: int, top_n: Optional[int]) -> Tuple[DonorSnapshot, bool]:
+    """
+    MATCH_FROM_DB: a snapshot of only the available donors the request needs,
+    queried from the donor store. Same radius rule as the in-memory path.
+    """
+    # imports a new donors.csv first (a stat() when nothing changed)
+    version = sync_donor_db()
+    if target_coord is not None and radius_km and top_n is not None:
+        near = build_donor_snapshot(query_candidates(center=target_coord, radius_km=radius_km), version)
+        if compatible_mask(near.bg_codes, recipient_code).sum() >= top_n:
+            return near, True
+    return build_donor_snapshot(query_candidates(), version), False
+
+
+def score_donors(req: Dict[str,Any], top_n: Optional[int] = 10, weights:Dict[str,float] = None,
+                 radius_km: Optional[float] = MATCH_RADIUS_KM) -> Optional[ScoredDonors]:
+    """
+    Stage one of matching: availability, blood compatibility, geodesic
+    distance and ML scores for the candidate donors. None if nobody is available.
+    top_n=None (every match wanted) scores the whole roster.
+    """
+    if weights is None:
+        # blood rules high weight, distance secondary
+        weights = DEFAULT_WEIGHTS
+
+    target_coord = _resolve_target_coord(req)
+    recipient_code = encode_blood_group(req.get("required_blood_group"))
+
+    if MATCH_FROM_DB:
+        # ----- candidate retrieval: indexed query on the donor store -----
+        snapshot, limited = _db_candidates(target_coord, radius_km, recipient_code, top_n)
+        if snapshot.size == 0:
+            return None
+        scored = _score_snapshot_rows(req, snapshot, np.arange(snapshot.size), weights, target_coord)
+        scored.radius_limited = limited
+        return scored
+
+    # one snapshot for the whole request, even if the table is reloaded meanwhile
+    snapshot = load_donor_snapshot()
+    if snapshot is None or snapshot.size == 0:
         return None
 
-# Optional ML model (if you upload a model later)
-_model = None
-def load_model():
-    global _model
-    if _model is None:
-        if Path(MATCH_MODEL_PATH).exists():
-            _model = joblib.load(MATCH_MODEL_PATH)
-    return _model
-
-def ml_score(donor_row: Dict[str,Any], request: Dict[str,Any]) -> Optional[float]:
-    model = load_model()
-    if model is None:
+    # ----- candidate retrieval: donors near the target, if the radius suffices -----
+    rows, limited = None, False
+    if target_coord is not None and radius_km and top_n is not None:
+        near = snapshot.index.query_radius(target_coord[0], target_coord[1], radius_km)
+        near = near[snapshot.available[near]]
+        # donors outside the radius can still outrank nearby incompatible ones,
+        # so only trust the radius when it yields a full page of compatible donors
+        if compatible_mask(snapshot.bg_codes[near], recipient_code).sum() >= top_n:
+            rows, limited = near, True
+
+    if rows is None:
+        # ----- availability filter over the whole roster -----
+        rows = np.flatnonzero(snapshot.available)
+    if len(rows) == 0:
         return None
-    # prepare minimal features, ensure names match training pipeline
-    df = pd.DataFrame([{
-        "donor_blood_group": donor_row.get("blood_group"),
-        "recipient_blood_group": request.get("required_blood_group"),
-        # add more features if your model expects them
-    }])
+
+    scored = _score_snapshot_rows(req, snapshot, rows, weights, target_coord)
+    scored.radius_limited = limited
+    return scored
+
+
+def _apply_road_distances(scored: ScoredDonors, positions: np.ndarray, ors_raw: dict) -> int:
+    dist_mat = ors_raw.get("distances")
+    if not dist_mat:
+        return 0
+    # ORS matrix: index 0 is origin->origin, so destinations start from index 1
+    road_m = dist_mat[0][1:len(positions) + 1]
+    if len(road_m) != len(positions):
+        return 0
+    # a failed ORS chunk leaves its donors on geodesic estimates
+    return scored.refine(positions, road_m)
+
+
+def refine_with_road_distances(scored: ScoredDonors, k: int) -> int:
+    """
+    Stage two: send only the k best geodesic-ranked candidates to ORS and
+    swap in their driving distances. Returns how many got one.
+    """
+    if scored.target_coord is None or k <= 0:
+        return 0
+    positions = scored.shortlist(k)
+    if len(positions) == 0:
+        return 0
+    try:
+        # cached per snapped (origin, donor) cell pair; only misses reach ORS
+        ors_raw = cached_road_distances(scored.target_coord, scored.destination_coords(positions))
+        return _apply_road_distances(scored, positions, ors_raw)
+    except Exception:
+        # if ORS fails for some reason, we keep geodesic fallback values
+        return 0
+
+
+async def refine_progressively(scored: ScoredDonors, k: int,
+                               chunk_size: int = ORS_MATRIX_CHUNK_SIZE) -> AsyncIterator[int]:
+    """
+    Async generator over the ORS stage: the shortlist is split into chunks
+    that are looked up concurrently, and as each chunk lands its road
+    distances are applied to `scored`. Yields how many donors that chunk
+    refined (0 if it failed), in completion order.
+    """
+    if scored.target_coord is None or k <= 0:
+        return
+    positions = scored.shortlist(k)
+    chunks = [positions[i:i + chunk_size] for i in range(0, len(positions), chunk_size)]
+
+    async def fetch(chunk):
+        return chunk, await async_cached_road_distances(scored.target_coord, scored.destination_coords(chunk))
+
+    tasks = [asyncio.ensure_future(fetch(chunk)) for chunk in chunks]
     try:
-        prob = model.predict_proba(df)[0]
-        # prefer class 1 probability
-        if len(prob) == 2:
-            return float(prob[1])
-        return float(prob[0])
+        for fut in asyncio.as_completed(tasks):
+            try:
+                chunk, ors_raw = await fut
+            except Exception:
+                yield 0
+                continue
+            yield _apply_road_distances(scored, chunk, ors_raw)
+    finally:
+        # consumer went away (e.g. client disconnected): stop outstanding lookups
+        for task in tasks:
+            task.cancel()
+
+
+def _log_orphan_error(task: "asyncio.Task"):
+    if not task.cancelled() and task.exception() is not None:
+        logger.info(f"late road-distance lookup failed: {task.exception()}")
+
+
+async def refine_with_road_distances_async(scored: ScoredDonors, k: int,
+                                           budget_s: Optional[float]) -> str:
+    """
+    Async stage two with a time budget. Returns "ok", "partial" (some ORS
+    chunks failed), "timeout", "error" or "skipped". On timeout the ORS call
+    keeps running in the background so its answer still lands in the
+    distance cache for the next request.
+    """
+    if scored.target_coord is None or k <= 0:
+        return "skipped"
+    positions = scored.shortlist(k)
+    if len(positions) == 0:
+        return "skipped"
+
+    task = asyncio.ensure_future(
+        async_cached_road_distances(scored.target_coord, scored.destination_coords(positions))
+    )
+    try:
+        ors_raw = await asyncio.wait_for(asyncio.shield(task), timeout=budget_s)
+    except asyncio.TimeoutError:
+        task.add_done_callback(_log_orphan_error)
+        return "timeout"
     except Exception:
+        return "error"
+    return _refine_status(len(positions), _apply_road_distances(scored, positions, ors_raw))
+
+
+def _refine_status(pending: int, refined: int) -> str:
+    if not pending:
+        return "skipped"
+    if not refined:
+        return "error"
+    return "ok" if refined == pending else "partial"
+
+
+# ---------- scored snapshots for cursor paging ----------
+# bounded by entries and by the memory of their candidate arrays; callers
+# only open a cursor when the client asked to page
+_snapshots = LRUCache(MATCH_SNAPSHOT_ENTRIES, max_bytes=MATCH_SNAPSHOT_MAX_BYTES)
+
+
+def open_cursor(scored: Optional[ScoredDonors], offset: int, req: Dict[str,Any] = None) -> Optional[str]:
+    """
+    Keep `scored` for paging and return the cursor of the page starting at
+    offset, or None when there is nothing past it. req is needed to widen a
+    radius-limited snapshot once paging runs past its compatible donors.
+    """
+    if scored is None or offset >= len(scored):
+        return None
+    snapshot_id = secrets.token_urlsafe(12)
+    _snapshots.put(snapshot_id, (scored, req), time.time() + MATCH_SNAPSHOT_TTL_S, scored.nbytes)
+    return f"{snapshot_id}.{offset}"
+
+
+def _widen(scored: ScoredDonors, req: Dict[str,Any]) -> ScoredDonors:
+    """Rescore over the whole roster, keeping the road distances already fetched."""
+    wide = score_donors(req, weights=scored.weights, radius_km=None)
+    if wide is None:
+        return scored
+    pos = pd.Index(wide.ids).get_indexer(scored.ids[scored.road])
+    ok = pos >= 0
+    wide.refine(pos[ok], scored.dist_m[scored.road][ok])
+    return wide
+
+
+def next_page(cursor: str, limit: int = 10) -> Optional[Tuple[List[Dict[str,Any]], Optional[str]]]:
+    """
+    (matches, next cursor) for a cursor from open_cursor(), read from the
+    stored snapshot without rescoring. None if the cursor is unknown or expired.
+
+    A snapshot that only covers donors within the match radius is rescored
+    over the whole roster once, when a page reaches past its compatible
+    donors (beyond that point donors outside the radius rank higher).
+    """
+    snapshot_id, _, offset = str(cursor).rpartition(".")
+    if not snapshot_id or not offset.isdigit():
+        return None
+    entry = _snapshots.get(snapshot_id)
+    if not isinstance(entry, tuple):
+        return None
+    scored, req = entry
+    offset = int(offset)
+
+    if scored.radius_limited and req is not None and offset + limit > int((scored.s_blood > 0).sum()):
+        scored = _widen(scored, req)
+        _snapshots.put(snapshot_id, (scored, req), time.time() + MATCH_SNAPSHOT_TTL_S, scored.nbytes)
+
+    matches = scored.page(offset, limit)
+    end = offset + len(matches)
+    return matches, (f"{snapshot_id}.{end}" if end < len(scored) else None)
+
+
+# ---------- result cache ----------
+def _result_key(req: Dict[str,Any], top_n: int, weights: Optional[Dict[str,float]],
+                radius_km: Optional[float], refine_k: Optional[int]) -> Optional[tuple]:
+    """(blood group, snapped origin, top_n, weights, radius, refine_k, model version); None if uncacheable."""
+    target_coord = _resolve_target_coord(req)
+    if target_coord is None:
+        return None
+    state = get_active_model()
+    return (
+        encode_blood_group(req.get("required_blood_group")),
+        snap(*target_coord),
+        top_n,
+        tuple(sorted((weights or DEFAULT_WEIGHTS).items())),
+        radius_km,
+        refine_k,
+        state.version if state is not None else None,
+    )
+
+
+def _standing_list(req: Dict[str,Any], weights: Optional[Dict[str,float]], refine_k: int) -> Optional[ScoredDonors]:
+    """Precomputed hospital list for this request, if one is current (app/standing_lists.py)."""
+    if not req.get("hospital_id"):
         return None
+    from app.standing_lists import standing_snapshot  # imports this module
+    return standing_snapshot(req, _resolve_target_coord(req), weights, refine_k)
+
+
+def _cache_result(key: Optional[tuple], version: int, scored: ScoredDonors, status: str):
+    # a timed-out / failed ORS stage is not cached, so the next request retries
+    # it; a partial one only briefly, to absorb a burst without pinning the
+    # geodesic estimates of its failed chunks
+    if key is None or status not in ["ok", "skipped", "partial"]:
+        return
+    ttl_s = MATCH_RESULT_PARTIAL_TTL_S if status == "partial" else None
+    match_result_cache.put(key, version, scored, ttl_s=ttl_s)
+
+
+def refine_count(top_n: Optional[int]) -> int:
+    """
+    How many geodesic-ranked donors get ORS road distances for top_n
+    matches. top_n=None (every match) refines as many as a default page, so
+    the ORS call stays bounded whatever the roster size.
+    """
+    return ORS_REFINE_FACTOR * (DEFAULT_TOP_N if top_n is None else top_n)
+
 
-def rank_donors_for_request(req: Dict[str,Any], top_n:int = 10, weights:Dict[str,float] = None) -> List[Dict[str,Any]]:
+def _lookup_or_score(req: Dict[str,Any], top_n: Optional[int], weights: Optional[Dict[str,float]],
+                     radius_km: Optional[float], refine_k: int):
+    """
+    (scored, status, result-cache key, donor version): the standing list
+    ("standing") or cached result ("cached") when one is current, else a
+    fresh score_donors() with status None.
+    """
+    scored = _standing_list(req, weights, refine_k)
+    if scored is not None:
+        return scored, "standing", None, None
+    key = _result_key(req, top_n, weights, radius_km, refine_k)
+    version = donor_table_version()
+    if key is not None:
+        scored = match_result_cache.get(key, version)
+        if scored is not None:
+            return scored, "cached", key, version
+    return score_donors(req, top_n=top_n, weights=weights, radius_km=radius_km), None, key, version
+
+
+def rank_donors_for_request(req: Dict[str,Any], top_n: Optional[int] = DEFAULT_TOP_N, weights:Dict[str,float] = None,
+                            radius_km: Optional[float] = MATCH_RADIUS_KM,
+                            refine_k: Optional[int] = None) -> List[Dict[str,Any]]:
     """
     req keys: required_blood_group, hospital_id (optional), lat/lon (optional), urgency_level, units_needed
 
+    When a target coordinate is known, only donors within radius_km (spatial
+    index lookup) are scored, as long as that yields at least top_n blood
+    compatible donors; otherwise the whole roster is scored. radius_km=None
+    always scores the whole roster, and so does top_n=None, which returns
+    every match.
+
     Scoring:
-      - blood_score: 0 or 1 based on ABO rules
+      - blood_score: 0 or 1 based on ABO and Rh antigen compatibility
       - distance_score: 0..1 (closer => higher), based on ORS driving distance when available,
                         falling back to geodesic distance otherwise
       - ml_score: optional ML probability (0..1) if model uploaded
@@ -81,138 +565,52 @@ def rank_donors_for_request(req: Dict[str,Any], top_n:int = 10, weights:Dict[str
       total_score = weights["blood"]*blood_score
                   + weights["distance"]*distance_score
                   + weights.get("ml",0.0)*ml_score
-    """
-    donors_df = load_donors()
-    if donors_df is None or donors_df.empty:
-        return []
-
-    if weights is None:
-        # blood rules high weight, distance secondary
-        weights = {"blood":0.7, "distance":0.3, "ml":0.0}
-
-    # Resolve target coordinate from request: prefer lat/lon, else hospital lookup
-    target_coord = None
-    if req.get("lat") is not None and req.get("lon") is not None:
-        try:
-            target_coord = (float(req["lat"]), float(req["lon"]))
-        except:
-            target_coord = None
-    elif req.get("hospital_id"):
-        hospitals = load_hospitals()
-        if hospitals is not None and not hospitals.empty:
-            key_col = "hospital_id" if "hospital_id" in hospitals.columns else hospitals.columns[0]
-            row = hospitals[hospitals[key_col] == req["hospital_id"]]
-            if not row.empty:
-                r0 = row.iloc[0]
-                if "lat" in r0.index and "lon" in r0.index:
-                    try:
-                        target_coord = (float(r0["lat"]), float(r0["lon"]))
-                    except:
-                        target_coord = None
-
-    results = []
-
-    # we will later overwrite distance_m & distance_score using ORS when possible
-    ors_dest_coords = []    # list of (lat, lon)
-    ors_result_indices = [] # index into results list
-
-    for _, d in donors_df.iterrows():
-        donor = d.to_dict()
-
-        avail_raw = str(donor.get("availability", "")).strip().lower()
-        if avail_raw in ["no", "not available", "0", "false"]:
-            continue
-
-        # ----- blood compatibility -----
-        s_blood = 1.0 if abo_compatible(donor.get("blood_group"), req.get("required_blood_group")) else 0.0
-
-        # ----- distance (initial: geodesic fallback) -----
-        s_dist = 0.0
-        dist_m = None
-
-        if target_coord is not None and not pd.isna(donor.get("lat")) and not pd.isna(donor.get("lon")):
-            try:
-                donor_coord = (float(donor["lat"]), float(donor["lon"]))
-                # straight-line distance as fallback
-                dist_m = distance_meters(target_coord, donor_coord)
-                if dist_m is not None:
-                    km = dist_m / 1000.0
-                    s_dist = max(0.0, 1.0 - (km / 200.0))  # within 200km => score 1..0
-
-                    # collect for ORS driving distance refinement
-                    ors_dest_coords.append((donor_coord[0], donor_coord[1]))  # (lat, lon)
-            except Exception:
-                dist_m = None
-                s_dist = 0.0
-
-        # ----- ML score (optional) -----
-        s_ml = ml_score(donor, req) or 0.0
 
-        # initial combined score (will recompute after ORS if available)
-        score = (
-            weights["blood"] * s_blood +
-            weights["distance"] * s_dist +
-            weights.get("ml", 0.0) * s_ml
-        )
+    Ranking is two-stage: everyone is ranked with geodesic distance, then
+    only the refine_k best (default refine_count(top_n)) get ORS road
+    distances before the final re-rank, so the ORS call stays fixed-size.
 
-        result_entry = {
-            "donor_id": donor.get("donor_id"),
-            "name": donor.get("name"),
-            "blood_group": donor.get("blood_group"),
-            "phone": donor.get("phone"),
-            "lat": donor.get("lat"),
-            "lon": donor.get("lon"),
-            "availability": donor.get("availability"),
-            "last_donation_date": donor.get("last_donation_date"),
-            "score": float(score),
-            "blood_score": float(s_blood),
-            "distance_m": dist_m if dist_m is not None else None,
-            "distance_score": float(s_dist),
-            "ml_score": float(s_ml),
-        }
-
-        results.append(result_entry)
-
-        # track which result index corresponds to this ORS candidate
-        if target_coord is not None and dist_m is not None:
-            ors_result_indices.append(len(results) - 1)
-
-    # ----- refine distance using ORS driving distance if possible -----
-    if target_coord is not None and ors_dest_coords:
-        try:
-            origin_str = f"{target_coord[0]},{target_coord[1]}"
-            dest_strs = [f"{lat},{lon}" for (lat, lon) in ors_dest_coords]
-
-            ors_raw = distance_matrix([origin_str], dest_strs, mode="driving")
-            dist_mat = ors_raw.get("distances")
-
-            if dist_mat and len(dist_mat) > 0:
-                dist_row = dist_mat[0]  # from origin to all points (origin + destinations)
-
-                for i, res_idx in enumerate(ors_result_indices):
-                    # ORS matrix: index 0 is origin->origin, so destinations start from index 1
-                    d_m = dist_row[i + 1]
-                    km = d_m / 1000.0
-                    s_dist = max(0.0, 1.0 - (km / 200.0))
-
-                    # update result entry
-                    results[res_idx]["distance_m"] = d_m
-                    results[res_idx]["distance_score"] = float(s_dist)
-                    # recompute final blended score
-                    b = results[res_idx]["blood_score"]
-                    m = results[res_idx]["ml_score"]
-                    results[res_idx]["score"] = (
-                        weights["blood"] * b +
-                        weights["distance"] * s_dist +
-                        weights.get("ml", 0.0) * m
-                    )
-        except Exception:
-            # if ORS fails for some reason, we keep geodesic fallback values
-            pass
-
-    # sort descending by score and clip to top_n
-    results_sorted = sorted(results, key=lambda x: x["score"], reverse=True)
-    return results_sorted[:top_n]
+    Requests from a hospital's own location with default weights are served
+    from its precomputed standing list when that list is current.
+    """
+    if refine_k is None:
+        refine_k = refine_count(top_n)
+    scored, status, key, version = _lookup_or_score(req, top_n, weights, radius_km, refine_k)
+    if scored is None:
+        return []
+    if status is not None:
+        return scored.top(top_n)
+    pending = len(scored.shortlist(refine_k)) if scored.target_coord is not None and refine_k > 0 else 0
+    refined = refine_with_road_distances(scored, refine_k)
+    _cache_result(key, version, scored, _refine_status(pending, refined))
+    return scored.top(top_n)
+
+
+async def score_and_refine_async(req: Dict[str,Any], top_n: Optional[int] = DEFAULT_TOP_N, weights:Dict[str,float] = None,
+                                 radius_km: Optional[float] = MATCH_RADIUS_KM,
+                                 refine_k: Optional[int] = None,
+                                 budget_s: Optional[float] = None) -> Tuple[Optional[ScoredDonors], str]:
+    """
+    rank_donors_for_request() for async handlers, returning the scored
+    snapshot (callers take its top matches and page through it) and the
+    road-distance status. Scoring runs in a worker thread; ORS refinement gets
+    at most budget_s seconds, after which the geodesic ranking stands
+    (matches carry distance_estimated=True). Served from the hospital's
+    standing list or the result cache when either is current for the donor
+    table and model.
+    """
+    if refine_k is None:
+        refine_k = refine_count(top_n)
+    # the lookups read files and SQLite, so they run off the event loop too
+    scored, status, key, version = await asyncio.to_thread(
+        _lookup_or_score, req, top_n, weights, radius_km, refine_k)
+    if scored is None:
+        return None, "skipped"
+    if status is not None:
+        return scored, status
+    status = await refine_with_road_distances_async(scored, refine_k, budget_s)
+    _cache_result(key, version, scored, status)
+    return scored, status
 
 
 def compute_travel_info(server_url: str, origin: tuple, donors_coords: list):
@@ -221,4 +619,4 @@ def compute_travel_info(server_url: str, origin: tuple, donors_coords: list):
     dests = [{"lat": lat, "lon": lon} for lat, lon in donors_coords]
     r = requests.post(url, json={"origin": origin_payload, "destinations": dests}, timeout=20)
     r.raise_for_status()
-    return r.json()["parsed"]  # list with distance_m, duration_s, ...
\ No newline at end of file
+    return r.json()["parsed"]  # list with distance_m, duration_s, ...
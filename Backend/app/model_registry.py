@@ -0,0 +1,311 @@
+# app/model_registry.py
+"""
+Versioned storage and hot-swap for the optional match model.
+
+Uploaded models are written to MODEL_VERSIONS_DIR/<version>.joblib and never
+overwritten. Activation (load + validation + warm-up) happens off the request
+path; the in-memory model is then replaced with a single reference swap, so
+a request always scores with one consistent (model, lookup table) pair.
+
+The activated version is recorded in ACTIVE_MODEL_POINTER. Every worker
+process compares the pointer's file signature (app/coherence.py) on each
+get_active_model(); when another worker activated a version, it is loaded on
+a background thread while requests keep scoring with the current model, and
+swapped in once it is ready.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, Optional
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.config import MATCH_MODEL_PATH, MODEL_VERSIONS_DIR, ACTIVE_MODEL_POINTER
+from app.blood_groups import CODE_LABELS
+from app.coherence import file_signature, write_atomic
+from app.store import load_donor_snapshot
+
+logger = logging.getLogger(__name__)
+
+# features the ML score has always been given
+BLOOD_GROUP_FEATURES = ["donor_blood_group", "recipient_blood_group"]
+
+# version name used for the model train.py writes to MATCH_MODEL_PATH
+BASE_VERSION = "base"
+
+
+def positive_proba(probs) -> np.ndarray:
+    probs = np.asarray(probs, dtype=float)
+    # prefer class 1 probability
+    if probs.shape[1] == 2:
+        return probs[:, 1]
+    return probs[:, 0]
+
+
+def build_ml_lookup(model) -> Optional[np.ndarray]:
+    """
+    Evaluate the model once for every (donor, recipient) blood-group pair.
+    Returns None if the model needs features other than the blood groups.
+    """
+    features = list(getattr(model, "feature_names_in_", BLOOD_GROUP_FEATURES))
+    if not set(features) <= set(BLOOD_GROUP_FEATURES):
+        return None
+    codes = sorted(CODE_LABELS)
+    pairs = pd.DataFrame(
+        [
+            {"donor_blood_group": CODE_LABELS[d], "recipient_blood_group": CODE_LABELS[r]}
+            for d in codes for r in codes
+        ]
+    )
+    try:
+        probs = positive_proba(model.predict_proba(pairs[features]))
+    except Exception:
+        return None
+    lut = np.full((len(codes), len(codes)), np.nan)
+    lut[np.repeat(codes, len(codes)), np.tile(codes, len(codes))] = probs
+    return lut
+
+
+def _feature_frame(model, candidates: pd.DataFrame, recipient_bg) -> pd.DataFrame:
+    frame = candidates.reset_index(drop=True).copy()
+    frame["donor_blood_group"] = frame["blood_group"] if "blood_group" in frame.columns else None
+    frame["recipient_blood_group"] = recipient_bg
+    features = getattr(model, "feature_names_in_", None)
+    return frame[list(features)] if features is not None else frame
+
+
+def predict_batch(model, candidates: pd.DataFrame, recipient_bg) -> np.ndarray:
+    """One predict_proba call over all candidates; donor columns are passed through
+    so models trained on extra donor features can pick them up."""
+    try:
+        frame = _feature_frame(model, candidates, recipient_bg)
+        return np.nan_to_num(positive_proba(model.predict_proba(frame)), nan=0.0)
+    except Exception:
+        return np.zeros(len(candidates))
+
+
+@dataclass(frozen=True)
+class ModelState:
+    version: str
+    path: str
+    model: Any
+    # [donor_code, recipient_code] -> probability, or None (see build_ml_lookup)
+    lut: Optional[np.ndarray]
+    activated_at: str
+    load_ms: float
+    warmup_ms: float
+
+
+@dataclass
+class _InferenceStats:
+    calls: int = 0
+    rows: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    last_ms: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+_active: Optional[ModelState] = None
+_initialized = False
+# file_signature() of ACTIVE_MODEL_POINTER when _active was last checked against it
+_pointer_sig = None
+_swap_lock = threading.Lock()
+_inference = _InferenceStats()
+# version -> {"status": pending|active|failed|superseded, ...}
+_versions: Dict[str, Dict[str, Any]] = {}
+# pointer signature a background load is running for (see _swap_to_pointer)
+_loading = None
+
+
+def _version_path(version: str):
+    return MODEL_VERSIONS_DIR / f"{version}.joblib"
+
+
+def _load_state(version: str, path) -> ModelState:
+    """Load, validate and warm up a model file. Raises on invalid models."""
+    t0 = time.perf_counter()
+    model = joblib.load(path)
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    if not hasattr(model, "predict_proba"):
+        raise ValueError("model has no predict_proba()")
+
+    t0 = time.perf_counter()
+    lut = build_ml_lookup(model)
+    if lut is None:
+        # not a blood-group-only model: make sure it can score real donor rows
+        snapshot = load_donor_snapshot()
+        sample = snapshot.frame_rows(np.flatnonzero(snapshot.live)[:32])
+        if sample.empty:
+            sample = pd.DataFrame([{"blood_group": "O+"}])
+        probs = positive_proba(model.predict_proba(_feature_frame(model, sample, "O+")))
+        if len(probs) != len(sample):
+            raise ValueError("predict_proba returned the wrong number of rows")
+    warmup_ms = (time.perf_counter() - t0) * 1000.0
+
+    return ModelState(
+        version=version,
+        path=str(path),
+        model=model,
+        lut=lut,
+        activated_at=datetime.utcnow().isoformat(),
+        load_ms=round(load_ms, 3),
+        warmup_ms=round(warmup_ms, 3),
+    )
+
+
+def _pointer_state(current: Optional[ModelState]) -> Optional[ModelState]:
+    """
+    The version ACTIVE_MODEL_POINTER names, loaded (current if it already is
+    that version). None if there is no pointer or the version fails to load.
+    """
+    try:
+        version = ACTIVE_MODEL_POINTER.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if current is not None and current.version == version:
+        return current
+    path = _version_path(version)
+    if version and path.exists():
+        try:
+            return _load_state(version, path)
+        except Exception as e:
+            logger.warning(f"Active model {version} failed to load: {e}")
+    return None
+
+
+def _initial_state() -> Optional[ModelState]:
+    """Model to use at process start: the active pointer, else train.py's output."""
+    state = _pointer_state(None)
+    if state is not None:
+        return state
+    if MATCH_MODEL_PATH.exists():
+        try:
+            return _load_state(BASE_VERSION, MATCH_MODEL_PATH)
+        except Exception as e:
+            logger.warning(f"Base model failed to load: {e}")
+    return None
+
+
+def _swap_to_pointer(sig):
+    """Background thread: load the version the pointer names and swap it in."""
+    global _active, _pointer_sig, _loading
+    state = _pointer_state(_active)
+    with _swap_lock:
+        _loading = None
+        if file_signature(ACTIVE_MODEL_POINTER) != sig:
+            # the pointer moved on meanwhile; the next get_active_model() starts over
+            return
+        if state is not None:
+            _active = state
+        # a version that fails to load leaves the current model active
+        _pointer_sig = sig
+
+
+def get_active_model() -> Optional[ModelState]:
+    global _active, _initialized, _pointer_sig, _loading
+    sig = file_signature(ACTIVE_MODEL_POINTER)
+    if _initialized and sig == _pointer_sig:
+        return _active
+    with _swap_lock:
+        if not _initialized:
+            # first use in this process: nothing to serve meanwhile
+            _active = _initial_state()
+            _initialized = True
+            _pointer_sig = sig
+        elif sig != _pointer_sig and _loading != sig:
+            # another worker activated a version: load it off the request path
+            _loading = sig
+            threading.Thread(target=_swap_to_pointer, args=(sig,), name="model-swap", daemon=True).start()
+    return _active
+
+
+def store_model_version(content: bytes) -> str:
+    """Persist uploaded model bytes under a new, immutable version name."""
+    MODEL_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{digest}"
+    write_atomic(_version_path(version), content)
+    _versions[version] = {"status": "pending", "uploaded_at": datetime.utcnow().isoformat()}
+    return version
+
+
+def activate_version(version: str) -> bool:
+    """
+    Load + warm up a stored version and swap it in. Meant to run in the
+    background; a failing model leaves the current one active.
+    """
+    global _active, _initialized, _pointer_sig
+    if not re.fullmatch(r"[0-9A-Za-z_-]+", version or ""):
+        return False
+    info = _versions.setdefault(version, {})
+    path = _version_path(version)
+    if not path.exists():
+        info.update(status="failed", error="unknown version")
+        return False
+
+    info["status"] = "validating"
+    try:
+        state = _load_state(version, path)
+    except Exception as e:
+        info.update(status="failed", error=str(e))
+        logger.warning(f"Model {version} rejected: {e}")
+        return False
+
+    with _swap_lock:
+        previous = _active
+        _active = state
+        _initialized = True
+        write_atomic(ACTIVE_MODEL_POINTER, version.encode("utf-8"))
+        # this worker is current; the others pick the change up from the pointer
+        _pointer_sig = file_signature(ACTIVE_MODEL_POINTER)
+    if previous is not None and previous.version in _versions:
+        _versions[previous.version]["status"] = "superseded"
+    info.update(status="active", error=None, load_ms=state.load_ms, warmup_ms=state.warmup_ms)
+    logger.info(f"Model {version} active (load {state.load_ms} ms, warm-up {state.warmup_ms} ms)")
+    return True
+
+
+def record_inference(rows: int, elapsed_ms: float):
+    s = _inference
+    with s.lock:
+        s.calls += 1
+        s.rows += rows
+        s.total_ms += elapsed_ms
+        s.last_ms = elapsed_ms
+        s.max_ms = max(s.max_ms, elapsed_ms)
+
+
+def model_status() -> Dict[str, Any]:
+    state = get_active_model()
+    s = _inference
+    with s.lock:
+        inference = {
+            "calls": s.calls,
+            "rows": s.rows,
+            "avg_ms": round(s.total_ms / s.calls, 3) if s.calls else None,
+            "max_ms": round(s.max_ms, 3),
+            "last_ms": round(s.last_ms, 3),
+        }
+    stored = sorted(p.stem for p in MODEL_VERSIONS_DIR.glob("*.joblib")) if MODEL_VERSIONS_DIR.exists() else []
+    return {
+        "status": "ok" if state is not None else "no_model",
+        "active_version": state.version if state else None,
+        "path": state.path if state else None,
+        "activated_at": state.activated_at if state else None,
+        "load_ms": state.load_ms if state else None,
+        "warmup_ms": state.warmup_ms if state else None,
+        "lookup_table": bool(state is not None and state.lut is not None),
+        "inference": inference,
+        # _versions only knows what this worker did; the active version is shared
+        "versions": {
+            v: _versions.get(v, {"status": "active" if state is not None and v == state.version else "stored"})
+            for v in stored
+        },
+    }
@@ -0,0 +1,63 @@
+# app/result_cache.py
+"""
+In-memory cache of scored match snapshots.
+
+Identical queries (same blood group, hospital / snapped location, top_n,
+weights and model version) arrive in bursts during an emergency. Each entry
+is tagged with the donor-table version it was computed from
+(store.donor_table_version()); an entry from an older version is treated as
+a miss and overwritten, so answers are never stale. Only results whose
+road distances came back incomplete are put() with a TTL, so a later
+request retries ORS for the donors still on geodesic estimates.
+"""
+from typing import Any, Hashable, Optional
+import threading
+import time
+
+from app.config import MATCH_RESULT_CACHE_ENTRIES
+from app.geo_cache import LRUCache
+
+_NEVER = float("inf")
+
+
+class MatchResultCache:
+    def __init__(self, max_entries: int = MATCH_RESULT_CACHE_ENTRIES):
+        self._lru = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key: Hashable, donor_version: int) -> Optional[Any]:
+        entry = self._lru.get(key)
+        with self._lock:
+            if not isinstance(entry, tuple):
+                self.misses += 1
+                return None
+            version, value = entry
+            if version != donor_version:
+                self.misses += 1
+                self.invalidated += 1
+                return None
+            self.hits += 1
+        return value
+
+    def put(self, key: Hashable, donor_version: int, value: Any, ttl_s: Optional[float] = None):
+        expires_at = _NEVER if ttl_s is None else time.time() + ttl_s
+        self._lru.put(key, (donor_version, value), expires_at)
+
+    def clear(self):
+        self._lru.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+match_result_cache = MatchResultCache()
@@ -0,0 +1,445 @@
+# app/shared_snapshot.py
+"""
+Donor snapshots saved as memory-mapped files: shared by worker processes,
+and the starting point of every process instead of the whole donor table.
+
+Each saved donor-store version is a generation directory:
+
+  SHARED_SNAPSHOT_DIR/gen-<store id>-<version>/
+      meta.json              version, columns, size, cell_deg
+      <array>.npy            one per typed array (ids, lat, lon, ...)
+      records.bin            the row records, JSON, back to back
+      record_offsets.npy     byte offset of each record (size + 1 entries)
+      column-<k>.npy         record column k (meta "typed_columns") as a typed
+      column-<k>-null.npy    array, and where it is None
+      cell_*.npy             the spatial index (DonorGridIndex.to_arrays())
+
+Cold start (restore_donor_snapshot()) maps the newest generation and
+applies the change log since: no SQL scan, no CSV or DataFrame, no index
+build. A generation is only written again when it is behind, and after a
+full rebuild.
+
+Without SHARED_SNAPSHOT every uvicorn worker then keeps its own copy and
+patches it into each new version, so memory grows with the worker count;
+the records are decoded from records.bin once, at the restore. With it one
+worker writes each donor-store version once as a generation and every
+worker maps it read-only (np.load(mmap_mode="r")): the pages sit once in
+the OS page cache, whatever the number of workers. Single records (match
+results) are decoded from records.bin when read; whole columns (model
+features, DonorSnapshot.values(), frame) come from the typed column files.
+Columns that are all text (up to TYPED_COLUMN_MAX_CHARS), all ints or all
+floats, None aside, get one; others are read from records.bin.
+
+A new version is a new generation, built by applying the change log to the
+previous one and published with one directory rename; workers move to it
+on their next read. Older generations are removed after
+SHARED_SNAPSHOT_KEEP newer ones exist; a worker still mapping one keeps
+its pages until it lets go of the snapshot.
+"""
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import mmap
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from app.config import SHARED_SNAPSHOT_DIR, SHARED_SNAPSHOT_KEEP, SPATIAL_CELL_DEG
+from app.donor_db import donor_db_id, donor_changes_since, load_donor_table
+from app.donor_snapshot import ARRAY_NAMES, DonorSnapshot, RecordPages, build_donor_snapshot
+from app.spatial import DonorGridIndex
+
+INDEX_NAMES = ["cell_i", "cell_j", "cell_start", "cell_pos"]
+# longer text stays in records.bin only (a typed column pads every row to the longest)
+TYPED_COLUMN_MAX_CHARS = 64
+
+try:
+    import fcntl
+except ImportError:  # Windows: no build lock, concurrent builders just race the rename
+    fcntl = None
+
+_build_lock = threading.Lock()
+
+
+def _encode_column(values: List[Any]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(typed array, None mask) of a record column, or None if it does not fit one."""
+    null = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    present = [v for v in values if v is not None]
+    kinds = {type(v) for v in present}
+    try:
+        if kinds <= {str}:
+            # numpy text arrays drop trailing NULs
+            if any(len(v) > TYPED_COLUMN_MAX_CHARS or v.endswith("\x00") for v in present):
+                return None
+            return np.array(["" if v is None else v for v in values], dtype=str), null
+        if kinds == {int}:
+            return np.array([0 if v is None else v for v in values], dtype=np.int64), null
+        if kinds == {float}:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64), null
+    except OverflowError:
+        # ints past int64
+        pass
+    return None
+
+
+def _decode_column(column: Tuple[np.ndarray, np.ndarray], positions) -> List[Any]:
+    arr, null = column
+    out = arr[positions].tolist()
+    for j in np.flatnonzero(null[positions]).tolist():
+        out[j] = None
+    return out
+
+
+class MappedRecords:
+    """
+    Row records of a generation, decoded from records.bin on access; whole
+    columns are read from the typed column files where there are some.
+    """
+
+    def __init__(self, path: Path, offsets: np.ndarray,
+                 columns: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None):
+        self.offsets = offsets
+        # column name -> (typed array, None mask); typed: whether the generation has column files
+        self.columns = columns or {}
+        self.typed = columns is not None
+        self.data = b""
+        if offsets[-1] > 0:
+            with open(path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        return json.loads(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def take(self, positions) -> List[Dict[str, Any]]:
+        """The records at positions, decoded in one json.loads call."""
+        offsets = self.offsets
+        positions = np.asarray(positions, dtype=np.int64).tolist()
+        if not positions:
+            return []
+        return json.loads(b"[" + b",".join([self.data[offsets[i]:offsets[i + 1]] for i in positions]) + b"]")
+
+    def values(self, column: str, positions) -> List[Any]:
+        positions = np.asarray(positions, dtype=np.int64)
+        if column in self.columns:
+            return _decode_column(self.columns[column], positions)
+        return [record.get(column) for record in self.take(positions)]
+
+    def copy(self) -> "PatchedRecords":
+        """Records a new version can patch (DonorSnapshot.apply_changes); this file is never written."""
+        return PatchedRecords(self)
+
+
+class PatchedRecords:
+    """
+    Records of a generation being built from the previous one: the mapped
+    records plus the ones apply_changes() wrote. Publishing copies the
+    unchanged records' bytes and encodes only the patched ones.
+    """
+
+    def __init__(self, base: MappedRecords):
+        self.base = base
+        self.patched: Dict[int, Dict[str, Any]] = {}
+        self._n = len(base)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i: int):
+        return self.patched[i] if i in self.patched else self.base[i]
+
+    def __setitem__(self, i: int, record: Dict[str, Any]):
+        self.patched[i] = record
+
+    def append(self, record: Dict[str, Any]):
+        self.patched[self._n] = record
+        self._n += 1
+
+    def take(self, positions) -> List[Dict[str, Any]]:
+        positions = np.asarray(positions, dtype=np.int64)
+        out = self.base.take(np.minimum(positions, len(self.base) - 1)) if len(self.base) else [None] * len(positions)
+        for j, i in enumerate(positions.tolist()):
+            if i in self.patched:
+                out[j] = self.patched[i]
+        return out
+
+    def values(self, column: str, positions) -> List[Any]:
+        positions = np.asarray(positions, dtype=np.int64)
+        # appended positions are all patched; read their base stand-ins, then overwrite
+        out = self.base.values(column, np.minimum(positions, len(self.base) - 1)) if len(self.base) \
+            else [None] * len(positions)
+        for j, i in enumerate(positions.tolist()):
+            if i in self.patched:
+                out[j] = self.patched[i].get(column)
+        return out
+
+    def copy(self) -> "PatchedRecords":
+        other = PatchedRecords(self.base)
+        other.patched = dict(self.patched)
+        other._n = self._n
+        return other
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, default=str).encode("utf-8")
+
+
+def _encode_records(records: Sequence[Dict[str, Any]]):
+    """records.bin content and its offsets."""
+    if not isinstance(records, PatchedRecords):
+        encoded = [_encode(r) for r in records.take(np.arange(len(records)))]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return b"".join(encoded), offsets
+    base, m = records.base, len(records.base)
+    lengths = np.zeros(len(records), dtype=np.int64)
+    lengths[:m] = np.diff(base.offsets)
+    pieces, start = [], 0
+    for i in sorted(records.patched):
+        # unchanged records up to i, as they are
+        if start < min(i, m):
+            pieces.append(base.data[base.offsets[start]:base.offsets[min(i, m)]])
+        encoded = _encode(records.patched[i])
+        pieces.append(encoded)
+        lengths[i] = len(encoded)
+        start = i + 1
+    if start < m:
+        pieces.append(base.data[base.offsets[start]:base.offsets[m]])
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return b"".join(pieces), offsets
+
+
+def _patch_column(records: PatchedRecords, name: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """The base generation's typed column with the patched records written in, or None."""
+    arr, null = records.base.columns[name]
+    at = np.array(sorted(records.patched), dtype=np.int64)
+    fresh = _encode_column([records.patched[i].get(name) for i in at.tolist()])
+    if fresh is None:
+        return None
+    if fresh[1].all():
+        # only None values: they fit any column
+        fresh = (np.zeros(len(at), dtype=arr.dtype), fresh[1])
+    if fresh[0].dtype.kind != arr.dtype.kind:
+        return None
+    values = np.empty(len(records), dtype=np.promote_types(arr.dtype, fresh[0].dtype))
+    values[:len(arr)] = arr
+    values[at] = fresh[0]
+    nulls = np.empty(len(records), dtype=bool)
+    nulls[:len(null)] = null
+    nulls[at] = fresh[1]
+    return values, nulls
+
+
+def _typed_columns(snapshot: DonorSnapshot) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """The record columns saved as typed column files (see _encode_column)."""
+    records = snapshot.record_source
+    everything = np.arange(snapshot.size)
+    typed = {}
+    for name in snapshot.columns:
+        if isinstance(records, PatchedRecords) and records.base.typed:
+            if name not in records.base.columns:
+                # did not fit before; checked again at the next full rebuild
+                continue
+            column = _patch_column(records, name)
+            if column is None:
+                column = _encode_column(records.values(name, everything))
+        else:
+            column = _encode_column(records.values(name, everything))
+        if column is not None:
+            typed[name] = column
+    return typed
+
+
+def _generation_dir(version: int) -> Path:
+    return SHARED_SNAPSHOT_DIR / f"gen-{donor_db_id()}-{version}"
+
+
+def _map(path: Path) -> np.ndarray:
+    # plain ndarray view of the mapping: indexing a np.memmap costs extra per call
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+
+def attach_snapshot(version: int) -> Optional[DonorSnapshot]:
+    """Read-only snapshot of a published generation, or None if there is none."""
+    path = _generation_dir(version)
+    try:
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        arrays = {name: _map(path / f"{name}.npy") for name in ARRAY_NAMES}
+        columns = None
+        if "typed_columns" in meta:
+            columns = {
+                name: (_map(path / f"column-{k}.npy"), _map(path / f"column-{k}-null.npy"))
+                for k, name in enumerate(meta["columns"]) if name in meta["typed_columns"]
+            }
+        records = MappedRecords(path / "records.bin", _map(path / "record_offsets.npy"), columns)
+        index = None
+        if meta.get("cell_deg") == SPATIAL_CELL_DEG:
+            cells = {name: _map(path / f"{name}.npy") for name in INDEX_NAMES}
+            index = DonorGridIndex.from_arrays(arrays["lat"], arrays["lon"], cells)
+    except (OSError, ValueError):
+        # not published, or pruned since
+        return None
+    return DonorSnapshot(meta["version"], meta["columns"], records, arrays, copy=False, index=index)
+
+
+def publish_snapshot(snapshot: DonorSnapshot) -> Path:
+    """Write snapshot as the generation of its version (no-op if another worker already did)."""
+    target = _generation_dir(snapshot.version)
+    SHARED_SNAPSHOT_DIR.mkdir(exist_ok=True)
+    tmp = SHARED_SNAPSHOT_DIR / f".tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    try:
+        for name in ARRAY_NAMES:
+            np.save(tmp / f"{name}.npy", getattr(snapshot, name))
+        data, offsets = _encode_records(snapshot.record_source)
+        np.save(tmp / "record_offsets.npy", offsets)
+        (tmp / "records.bin").write_bytes(data)
+        typed = _typed_columns(snapshot)
+        for k, name in enumerate(snapshot.columns):
+            if name in typed:
+                np.save(tmp / f"column-{k}.npy", typed[name][0])
+                np.save(tmp / f"column-{k}-null.npy", typed[name][1])
+        for name, arr in snapshot.index.to_arrays().items():
+            np.save(tmp / f"{name}.npy", arr)
+        meta = {
+            "version": snapshot.version,
+            "columns": snapshot.columns,
+            "size": snapshot.size,
+            "cell_deg": snapshot.index.cell_deg,
+            "typed_columns": [name for name in snapshot.columns if name in typed],
+        }
+        (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        # readers see the whole generation or none of it
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not target.exists():
+            raise
+    return target
+
+
+def _saved_versions() -> List[Tuple[int, Path]]:
+    """(version, directory) of this store's generations, oldest first."""
+    prefix = f"gen-{donor_db_id()}-"
+    saved = []
+    for path in SHARED_SNAPSHOT_DIR.glob(prefix + "*"):
+        if path.name[len(prefix):].isdigit():
+            saved.append((int(path.name[len(prefix):]), path))
+    return sorted(saved)
+
+
+def _newest_snapshot(version: int) -> Optional[DonorSnapshot]:
+    """The newest generation at or before `version`, mapped."""
+    for v, _ in reversed(_saved_versions()):
+        if v <= version:
+            snapshot = attach_snapshot(v)
+            if snapshot is not None:
+                return snapshot
+    return None
+
+
+def _prune(version: int):
+    prefix = f"gen-{donor_db_id()}-"
+    for path in SHARED_SNAPSHOT_DIR.glob("gen-*"):
+        if not path.name.startswith(prefix):
+            # generation of an earlier donors.db
+            shutil.rmtree(path, ignore_errors=True)
+    for v, path in _saved_versions()[:-max(SHARED_SNAPSHOT_KEEP, 1)]:
+        if v < version:
+            shutil.rmtree(path, ignore_errors=True)
+    if fcntl is not None:
+        # under the build lock, any other temp directory is left over from a crash
+        for path in SHARED_SNAPSHOT_DIR.glob(".tmp-*"):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _publish_lock():
+    # one builder per version, across threads and (where supported) processes
+    with _build_lock:
+        if fcntl is None:
+            yield
+            return
+        SHARED_SNAPSHOT_DIR.mkdir(exist_ok=True)
+        with open(SHARED_SNAPSHOT_DIR / ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _build(version: int, previous: Optional[DonorSnapshot]) -> DonorSnapshot:
+    changes = None
+    if previous is not None and previous.size:
+        changes = donor_changes_since(previous.version)
+    if changes is None:
+        return build_donor_snapshot(load_donor_table(), version)
+    # in-memory copy of the previous generation's arrays with the change log
+    # applied; mapped records are only patched, not copied, the index only per cell
+    return previous.apply_changes(changes, version)
+
+
+def shared_donor_snapshot(version: int, previous: Optional[DonorSnapshot] = None) -> DonorSnapshot:
+    """
+    The shared snapshot of store version `version`: mapped if it is already
+    published, otherwise built from `previous` (the caller's last snapshot)
+    plus the change log, published and then mapped.
+    """
+    snapshot = attach_snapshot(version)
+    if snapshot is not None:
+        return snapshot
+    with _publish_lock():
+        snapshot = attach_snapshot(version)
+        if snapshot is None:
+            if previous is None:
+                previous = _newest_snapshot(version)
+            built = _build(version, previous)
+            publish_snapshot(built)
+            _prune(version)
+            snapshot = attach_snapshot(version)
+            if snapshot is None:
+                # the generation could not be mapped back; serve the private copy
+                snapshot = built
+    return snapshot
+
+
+def _decoded(snapshot: DonorSnapshot) -> DonorSnapshot:
+    """snapshot with its records decoded into memory once, instead of on every read."""
+    records = snapshot.record_source
+    if isinstance(records, RecordPages):
+        return snapshot
+    arrays = {name: getattr(snapshot, name) for name in ARRAY_NAMES}
+    return DonorSnapshot(snapshot.version, snapshot.columns, records.take(np.arange(snapshot.size)), arrays,
+                         copy=False, index=snapshot.index)
+
+
+def restore_donor_snapshot(version: int) -> DonorSnapshot:
+    """
+    In-memory snapshot of store version `version` for a process without one:
+    the newest saved generation plus the change log since it, or a full build
+    when there is none or the log does not reach back. Saved when the
+    generation on disk was behind. The records are decoded here, once; the
+    arrays stay mapped until the first change copies them.
+    """
+    with _publish_lock():
+        previous = _newest_snapshot(version)
+        snapshot = _build(version, previous)
+        if previous is None or previous.version != version:
+            publish_snapshot(snapshot)
+            _prune(version)
+    return _decoded(snapshot)
+
+
+def save_donor_snapshot(snapshot: DonorSnapshot):
+    """Save a freshly built snapshot, so the next start does not rebuild it."""
+    with _publish_lock():
+        publish_snapshot(snapshot)
+        _prune(snapshot.version)
@@ -0,0 +1,141 @@
+# app/spatial.py
+from typing import Dict, Optional, Tuple
+import math
+import numpy as np
+
+from app.config import SPATIAL_CELL_DEG
+from app.distance import haversine_m
+
+
+def _haversine_km(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    return haversine_m(lat0, lon0, lat, lon) / 1000.0
+
+
+class DonorGridIndex:
+    """
+    Uniform lat/lon grid over donor coordinates.
+
+    Each cell (cell_deg x cell_deg degrees) maps to the row positions of the
+    donors inside it, so a radius query only touches the cells overlapping the
+    search circle instead of the whole roster. Positions refer to rows of the
+    DataFrame the index was built from (iloc order).
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_deg: float = SPATIAL_CELL_DEG,
+                 cells: Optional[Dict[Tuple[int, int], np.ndarray]] = None):
+        self.cell_deg = float(cell_deg)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.size = len(self.lat)
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if cells is not None:
+            # cells of an existing index over these coordinates (copy(), from_arrays())
+            self.cells = cells
+            return
+
+        located = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        if len(located) == 0:
+            return
+        ci = np.floor(self.lat[located] / self.cell_deg).astype(np.int64)
+        cj = np.floor(self.lon[located] / self.cell_deg).astype(np.int64)
+        order = np.lexsort((cj, ci))
+        ci, cj, located = ci[order], cj[order], located[order]
+        # boundaries where the (ci, cj) key changes
+        breaks = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+        for chunk_i, chunk_j, chunk in zip(
+            np.split(ci, breaks), np.split(cj, breaks), np.split(located, breaks)
+        ):
+            self.cells[(int(chunk_i[0]), int(chunk_j[0]))] = np.sort(chunk)
+
+    def copy(self) -> "DonorGridIndex":
+        """Index over the same cells that add()/remove() can change independently."""
+        # cell arrays are replaced, never modified, so the copies can share them
+        return DonorGridIndex(self.lat, self.lon, self.cell_deg, cells=dict(self.cells))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """The cells as flat arrays, for saving next to the coordinates (see from_arrays)."""
+        keys = sorted(self.cells)
+        start = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(self.cells[k]) for k in keys], out=start[1:])
+        return {
+            "cell_i": np.array([k[0] for k in keys], dtype=np.int64),
+            "cell_j": np.array([k[1] for k in keys], dtype=np.int64),
+            "cell_start": start,
+            "cell_pos": np.concatenate([self.cells[k] for k in keys]) if keys else np.empty(0, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, lat: np.ndarray, lon: np.ndarray, arrays: Dict[str, np.ndarray],
+                    cell_deg: float = SPATIAL_CELL_DEG) -> "DonorGridIndex":
+        """Index from to_arrays() output; cells are slices of arrays["cell_pos"], nothing is copied."""
+        # a plain view (np.asarray) even of a memmap: cheaper to slice, still no copy
+        pos, start = np.asarray(arrays["cell_pos"]), arrays["cell_start"].tolist()
+        cells = {
+            (ci, cj): pos[start[k]:start[k + 1]]
+            for k, (ci, cj) in enumerate(zip(arrays["cell_i"].tolist(), arrays["cell_j"].tolist()))
+        }
+        return cls(lat, lon, cell_deg, cells=cells)
+
+    def _cell_of(self, pos: int) -> Optional[Tuple[int, int]]:
+        lat, lon = self.lat[pos], self.lon[pos]
+        if np.isnan(lat) or np.isnan(lon):
+            return None
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    # add()/remove() keep the index in step with changes to the coordinate
+    # arrays (DonorSnapshot.apply_changes, on the new version's copy()); each
+    # replaces one cell's array, so copies sharing the others are unaffected
+
+    def add(self, pos: int):
+        """Index position pos at its current coordinates."""
+        key = self._cell_of(pos)
+        if key is None:
+            return
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = np.array([pos], dtype=np.int64)
+        else:
+            self.cells[key] = np.insert(cell, np.searchsorted(cell, pos), pos)
+
+    def remove(self, pos: int):
+        """Drop position pos (call before its coordinates change)."""
+        key = self._cell_of(pos)
+        cell = self.cells.get(key) if key is not None else None
+        if cell is None:
+            return
+        cell = cell[cell != pos]
+        if len(cell):
+            self.cells[key] = cell
+        else:
+            del self.cells[key]
+
+    def query_radius(self, lat0: float, lon0: float, radius_km: float) -> np.ndarray:
+        """Sorted row positions of donors within radius_km of (lat0, lon0)."""
+        dlat = radius_km / 111.0
+        cos_lat = max(math.cos(math.radians(min(abs(lat0) + dlat, 89.9))), 1e-6)
+        dlon = min(radius_km / (111.320 * cos_lat), 180.0)
+
+        i0, i1 = math.floor((lat0 - dlat) / self.cell_deg), math.floor((lat0 + dlat) / self.cell_deg)
+        j0, j1 = math.floor((lon0 - dlon) / self.cell_deg), math.floor((lon0 + dlon) / self.cell_deg)
+
+        hits = []
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            # search box covers more cells than exist: walk the populated ones
+            for (ci, cj), pos in self.cells.items():
+                if i0 <= ci <= i1 and j0 <= cj <= j1:
+                    hits.append(pos)
+        else:
+            for ci in range(i0, i1 + 1):
+                for cj in range(j0, j1 + 1):
+                    pos = self.cells.get((ci, cj))
+                    if pos is not None:
+                        hits.append(pos)
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+
+        pos = np.concatenate(hits)
+        # small slack so the spherical filter never drops a donor that the
+        # ellipsoidal distance used for scoring would place inside the radius
+        km = _haversine_km(lat0, lon0, self.lat[pos], self.lon[pos])
+        return np.sort(pos[km <= radius_km * 1.005])
+
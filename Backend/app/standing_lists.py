@@ -0,0 +1,287 @@
+# app/standing_lists.py
+"""
+Standing match lists: for every hospital in hospitals.csv and every
+recipient blood group, a ranked snapshot of the available donors (default
+weights) whose best STANDING_LIST_ROAD_K entries carry ORS road distances.
+
+A background task polls the donor-table version, the active model and the
+hospitals table. Lists are keyed by donor-store id (snapshot.ids). On a new
+donor version only the rows the store's change log lists are dropped and,
+if still available, scored again and merged back in; everyone else keeps
+their distances and scores. Only shortlisted donors without a road distance
+go to ORS. A model change, a compacted snapshot or a change the log cannot
+describe rebuilds the lists (road distances of unmoved donors are kept).
+
+rank_donors_for_request() serves hospital-origin matches from here when the
+list is current (see standing_snapshot()).
+"""
+from typing import Dict, Any, Optional
+import asyncio
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.config import STANDING_LIST_POLL_S, STANDING_LIST_ROAD_K, STANDING_LIST_RETRY_S
+from app.store import load_donor_snapshot, hospital_index, donor_table_version
+from app.donor_db import donor_changes_since
+from app.blood_groups import CODE_LABELS, compatible_mask, encode_blood_group
+from app.model_registry import get_active_model
+from app.geo_cache import cached_road_distances
+from app.match_engine import (
+    DEFAULT_WEIGHTS,
+    ScoredDonors,
+    _distances_from,
+    _ml_scores,
+    top_positions,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _missing_road(scored: ScoredDonors) -> np.ndarray:
+    """Positions among the list's best STANDING_LIST_ROAD_K that still lack a road distance."""
+    top = top_positions(scored.scores(), STANDING_LIST_ROAD_K)
+    return top[~scored.road[top] & ~np.isnan(scored.dist_m[top])]
+
+
+def _changed_ids(old, new) -> Optional[np.ndarray]:
+    """
+    Store ids of the donors that changed between two snapshot versions, or
+    None when the lists have to be rebuilt: positions moved (compaction, full
+    reload) or the change log does not cover the gap.
+    """
+    if new.version == old.version:
+        return np.empty(0, dtype=np.int64)
+    if new.size < old.size or not np.array_equal(new.ids[:old.size], old.ids):
+        return None
+    changes = donor_changes_since(old.version)
+    if changes is None:
+        return None
+    # rows written after `new` was taken are re-read from `new`, which is harmless
+    return np.unique(np.array([sid for sid, _ in changes], dtype=np.int64))
+
+
+class HospitalStandingList:
+    def __init__(self, hospital_id: str, coord: tuple):
+        self.hospital_id = hospital_id
+        self.coord = coord
+        # the snapshot the lists were built from; rows are positions in it
+        self.snapshot = None
+        # one entry per listed (available) donor, in snapshot position order
+        self.ids = np.empty(0, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self.codes = np.empty(0, dtype=np.int8)
+        # road distance where road is True, else geodesic
+        self.dist_m = np.empty(0)
+        self.road = np.empty(0, dtype=bool)
+        # recipient blood-group code -> (blood score, ML score) per entry
+        self.columns: Dict[int, tuple] = {}
+        # recipient blood-group code -> ranked snapshot
+        self.by_code: Dict[int, ScoredDonors] = {}
+        self.donor_version: Optional[int] = None
+        self.model_version: Optional[str] = None
+        self.updated_at: Optional[float] = None
+        self.last_refresh: Dict[str, Any] = {}
+        # False when the last ORS lookup failed; retried after STANDING_LIST_RETRY_S
+        self.road_complete = True
+
+    def is_stale(self, donor_version: int, model_version: Optional[str]) -> bool:
+        if self.donor_version != donor_version or self.model_version != model_version:
+            return True
+        return not self.road_complete and time.time() - self.updated_at >= STANDING_LIST_RETRY_S
+
+    def _entries(self, snapshot, rows: np.ndarray) -> Dict[str, Any]:
+        """Entry columns for snapshot rows; road distances carry over for donors that did not move."""
+        ids, lat, lon = snapshot.ids[rows], snapshot.lat[rows], snapshot.lon[rows]
+        dist_m = _distances_from(self.coord, lat, lon)
+        road = np.zeros(len(rows), dtype=bool)
+        if len(self.ids) and len(rows):
+            order = np.argsort(self.ids, kind="stable")
+            at = order[np.minimum(np.searchsorted(self.ids, ids, sorter=order), len(order) - 1)]
+            same = self.road[at] & (self.ids[at] == ids) & (self.lat[at] == lat) & (self.lon[at] == lon)
+            dist_m[same] = self.dist_m[at[same]]
+            road[same] = True
+        entries = {"ids": ids, "rows": rows, "lat": lat, "lon": lon, "codes": snapshot.bg_codes[rows],
+                   "dist_m": dist_m, "road": road}
+        for code, label in CODE_LABELS.items():
+            s_blood = compatible_mask(entries["codes"], code).astype(float)
+            s_ml = _ml_scores(snapshot, rows, entries["codes"], code, {"required_blood_group": label})
+            entries[code] = (s_blood, s_ml)
+        return entries
+
+    def _set(self, entries: Dict[str, Any]):
+        for name in ["ids", "rows", "lat", "lon", "codes", "dist_m", "road"]:
+            setattr(self, name, entries[name])
+        self.columns = {code: entries[code] for code in CODE_LABELS}
+
+    def _rebuild(self, snapshot):
+        self._set(self._entries(snapshot, np.flatnonzero(snapshot.available)))
+
+    def _apply(self, snapshot, changed: np.ndarray):
+        """Drop the changed donors' entries and merge their current rows (if available) back in."""
+        keep = ~np.isin(self.ids, changed)
+        # ids of deleted rows remain on their tombstones, which are never available
+        rows = np.flatnonzero(np.isin(snapshot.ids, changed) & snapshot.available)
+        added = self._entries(snapshot, rows)
+        # snapshot position order, as a full rebuild would list them (ties rank by position)
+        order = np.argsort(np.concatenate([self.rows[keep], rows]), kind="stable")
+        merged = {}
+        for name in ["ids", "rows", "lat", "lon", "codes", "dist_m", "road"]:
+            merged[name] = np.concatenate([getattr(self, name)[keep], added[name]])[order]
+        for code in CODE_LABELS:
+            merged[code] = tuple(np.concatenate([old[keep], new])[order]
+                                 for old, new in zip(self.columns[code], added[code]))
+        self._set(merged)
+
+    def _scored(self, code: int) -> ScoredDonors:
+        s_blood, s_ml = self.columns[code]
+        scored = ScoredDonors(self.snapshot, self.rows, s_blood, self.dist_m, s_ml, self.lat, self.lon,
+                              DEFAULT_WEIGHTS, self.coord)
+        scored.road = self.road
+        return scored
+
+    def _fetch_road(self) -> int:
+        """Road distances for every list's shortlist, one ORS lookup per hospital."""
+        need = [_missing_road(self._scored(code)) for code in CODE_LABELS]
+        need = np.unique(np.concatenate(need)) if need else np.empty(0, dtype=np.int64)
+        self.road_complete = True
+        if len(need) == 0:
+            return 0
+        try:
+            ors_raw = cached_road_distances(self.coord, [(float(self.lat[i]), float(self.lon[i])) for i in need])
+            road_m = np.asarray(ors_raw["distances"][0][1:len(need) + 1], dtype=float)
+        except Exception as e:
+            # lists keep geodesic estimates until a later refresh gets through
+            self.road_complete = False
+            logger.info(f"Standing list road distances for {self.hospital_id} failed: {e}")
+            return 0
+        if len(road_m) != len(need):
+            return 0
+        ok = ~np.isnan(road_m)
+        # new arrays: lists already handed out keep the ones they were built with
+        self.dist_m, self.road = self.dist_m.copy(), self.road.copy()
+        self.dist_m[need[ok]] = road_m[ok]
+        self.road[need[ok]] = True
+        return int(ok.sum())
+
+    def refresh(self, snapshot, model_version: Optional[str]):
+        t0 = time.perf_counter()
+        changed = None
+        if self.snapshot is not None and self.model_version == model_version:
+            changed = _changed_ids(self.snapshot, snapshot)
+        if changed is None:
+            self._rebuild(snapshot)
+        elif len(changed):
+            self._apply(snapshot, changed)
+        self.snapshot = snapshot
+        fetched = self._fetch_road()
+
+        self.by_code = {code: self._scored(code) for code in CODE_LABELS}
+        self.donor_version = snapshot.version
+        self.model_version = model_version
+        self.updated_at = time.time()
+        self.last_refresh = {
+            "rebuilt": changed is None,
+            "rescored_donors": int(len(self.ids)) if changed is None else int(len(changed)),
+            "road_fetched": fetched,
+            "ms": round((time.perf_counter() - t0) * 1000.0, 3),
+        }
+
+
+_lists: Dict[str, HospitalStandingList] = {}
+_hospitals_seen = None
+_refresh_lock = threading.Lock()
+
+
+def _model_version() -> Optional[str]:
+    state = get_active_model()
+    return state.version if state is not None else None
+
+
+def _hospital_coords(hospitals: Dict[str, Any]) -> Dict[str, tuple]:
+    return {hid: h.coord for hid, h in hospitals.items() if h.coord is not None}
+
+
+def refresh_standing_lists(force: bool = False) -> Dict[str, Any]:
+    """Bring every hospital's lists up to date; returns what was refreshed."""
+    global _hospitals_seen
+    with _refresh_lock:
+        # the snapshot carries its own version, so lists always match what they were built from
+        snapshot = load_donor_snapshot()
+        model_version = _model_version()
+        hospitals = hospital_index()
+        if hospitals is not _hospitals_seen or force:
+            coords = _hospital_coords(hospitals)
+            for hid in list(_lists):
+                if hid not in coords:
+                    del _lists[hid]
+            for hid, coord in coords.items():
+                if hid not in _lists or _lists[hid].coord != coord:
+                    _lists[hid] = HospitalStandingList(hid, coord)
+            _hospitals_seen = hospitals
+
+        refreshed = []
+        if snapshot is None or snapshot.size == 0:
+            return {"refreshed": refreshed}
+        for hid, lst in list(_lists.items()):
+            if force or lst.is_stale(snapshot.version, model_version):
+                lst.refresh(snapshot, model_version)
+                refreshed.append(hid)
+        return {"refreshed": refreshed}
+
+
+async def standing_lists_loop(poll_s: float = STANDING_LIST_POLL_S):
+    """Background task (started with the app): refresh lists whenever their inputs change."""
+    while True:
+        try:
+            result = await asyncio.to_thread(refresh_standing_lists)
+            if result["refreshed"]:
+                logger.info(f"Standing lists refreshed: {result['refreshed']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Standing list refresh failed: {e}")
+        await asyncio.sleep(poll_s)
+
+
+def standing_snapshot(req: Dict[str,Any], target_coord: Optional[tuple], weights: Optional[Dict[str,float]],
+                      refine_k: int) -> Optional[ScoredDonors]:
+    """
+    The current standing list for a hospital-origin request, or None when the
+    request does not match one (other location, custom weights, deeper road
+    refinement than the list holds) or the list is behind the donor table /
+    model. Lists are never refreshed on the request path.
+    """
+    lst = _lists.get(str(req.get("hospital_id")).strip()) if req.get("hospital_id") else None
+    if lst is None or target_coord != lst.coord:
+        return None
+    if weights is not None and weights != DEFAULT_WEIGHTS:
+        return None
+    if refine_k > STANDING_LIST_ROAD_K:
+        return None
+    if lst.donor_version != donor_table_version() or lst.model_version != _model_version():
+        return None
+    return lst.by_code.get(encode_blood_group(req.get("required_blood_group")))
+
+
+def standing_lists_status() -> Dict[str, Any]:
+    version = donor_table_version()
+    return {
+        "hospitals": len(_lists),
+        "lists": {
+            hid: {
+                "current": lst.donor_version == version,
+                "donor_version": lst.donor_version,
+                "model_version": lst.model_version,
+                "updated_at": lst.updated_at,
+                "road_distances": int(lst.road.sum()),
+                "road_complete": lst.road_complete,
+                **lst.last_refresh,
+            }
+            for hid, lst in _lists.items()
+        },
+    }
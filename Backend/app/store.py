@@ -8,18 +8,46 @@ from app.config import (
     UPLOADED_DONORS,
     UPLOADED_REQUESTS,
     UPLOADED_HOSPITALS,
-    DB_PATH,           # 🔹 add this
+    MATCH_FROM_DB,
+    SHARED_SNAPSHOT,
 )
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from dataclasses import dataclass
 import shutil
-import sqlite3          # 🔹 add this
+from app.donor_snapshot import DonorSnapshot, as_float, build_donor_snapshot
+from app.coherence import file_signature, write_atomic
+from app.shared_snapshot import shared_donor_snapshot, restore_donor_snapshot, save_donor_snapshot
+from app.donor_db import (
+    sync_donor_db,
+    import_donors_csv,
+    load_donor_table,
+    donor_db_version,
+    donor_changes_since,
+    upsert_donor,
+    delete_donor,
+)
+import threading
+import numpy as np
 
 
 # In-memory cached DataFrames
 _donors = None
 _requests = None
 _hospitals = None
-
+# file signatures (app/coherence.py) of the CSVs behind _requests / _hospitals;
+# another worker's upload changes them, so every worker reloads on next use
+_requests_sig = None
+_hospitals_sig = None
+# Typed view of the donor table (coordinates, availability, blood-group
+# codes, dates, spatial index, records). Rows live in the donor store
+# (app/donor_db.py); the snapshot is built once and then follows the
+# store's change log, one new snapshot per version (see _current_donor_snapshot). With
+# SHARED_SNAPSHOT it is a read-only generation mapped from files that all
+# worker processes share (app/shared_snapshot.py).
+_donor_snapshot: "DonorSnapshot" = None
+_donor_snapshot_lock = threading.Lock()
+# hospital_id -> Hospital, replaced as a whole whenever hospitals.csv is (re)loaded
+_hospital_index: Dict[str, "Hospital"] = {}
 def _copy_uploaded_if_exists():
     # If the user has uploaded files to /mnt/data, copy them to data/ for the service
     try:
@@ -32,146 +60,190 @@ def _copy_uploaded_if_exists():
     except Exception:
         pass
 
-def _load_user_donors_from_db() -> pd.DataFrame:
+def _current_donor_snapshot(sync: bool = False) -> DonorSnapshot:
     """
-    Load user-registered donors from users.db (user_donors table)
-    and map to same columns as donors.csv:
-    donor_id, name, blood_group, phone, lat, lon, availability, last_donation_date
+    The donor snapshot at the store's current version: restored from the
+    saved snapshot on first use (app/shared_snapshot.py), afterwards brought
+    up to date by applying the rows the change log lists and rebuilt (and
+    saved) only when the log cannot tell. Applying a small change still
+    copies the typed arrays: about 1.3 ms per version at 200k donors.
+    sync=True first re-imports donors.csv if the file changed.
     """
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM user_donors")
-        rows = cur.fetchall()
-        conn.close()
-        if not rows:
-            return pd.DataFrame()
-
-        records = []
-        for r in rows:
-            records.append(
-                {
-                    "donor_id": r["donor_id"],
-                    "name": r["full_name"],
-                    "blood_group": r["blood_group"],
-                    "phone": r["phone"],
-                    "lat": r["lat"],
-                    "lon": r["lon"],
-                    "availability": r["availability"],
-                    "last_donation_date": r["last_donation_date"],
-                }
-            )
-        return pd.DataFrame(records)
-    except Exception:
-        return pd.DataFrame()
+    global _donor_snapshot
+    snapshot = _donor_snapshot
+    if not sync and snapshot is not None and snapshot.version == donor_db_version():
+        return snapshot
+    with _donor_snapshot_lock:
+        if sync or _donor_snapshot is None:
+            sync_donor_db()
+        # version first: a write in between is picked up by the next call
+        version = donor_db_version()
+        snapshot = _donor_snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        if SHARED_SNAPSHOT:
+            _donor_snapshot = shared_donor_snapshot(version, snapshot)
+            return _donor_snapshot
+        changes = None
+        if snapshot is not None and snapshot.size:
+            changes = donor_changes_since(snapshot.version)
+        if snapshot is None:
+            # first use in this process: the saved snapshot plus the change log
+            _donor_snapshot = restore_donor_snapshot(version)
+        elif changes is None:
+            _donor_snapshot = build_donor_snapshot(load_donor_table(), version)
+            save_donor_snapshot(_donor_snapshot)
+        else:
+            _donor_snapshot = snapshot.apply_changes(changes, version)
+        return _donor_snapshot
 
 
 def load_donors(force: bool = False) -> pd.DataFrame:
+    """The whole donor table as a DataFrame (built per version: prefer load_donor_snapshot())."""
     global _donors
+    _donors = load_donor_snapshot(force).frame
+    return _donors
+
+
+def load_donor_snapshot(force: bool = False) -> DonorSnapshot:
+    """Typed, read-only snapshot of the current donor table (app/donor_snapshot.py)."""
     _copy_uploaded_if_exists()
+    # force: pick up a new donors.csv (applied as row changes, not a reload)
+    return _current_donor_snapshot(sync=force)
 
-    if _donors is None or force:
-        # base donors from CSV
-        if DONORS_CSV.exists():
-            base_df = pd.read_csv(DONORS_CSV)
-        else:
-            base_df = pd.DataFrame()
-
-        # additional donors from user_donors table
-        user_df = _load_user_donors_from_db()
-
-        if not user_df.empty:
-            if base_df.empty:
-                _donors = user_df
-            else:
-                # ensure user_df has all columns in base_df
-                missing_cols = [c for c in base_df.columns if c not in user_df.columns]
-                for c in missing_cols:
-                    user_df[c] = None
-                _donors = pd.concat(
-                    [base_df, user_df[base_df.columns]], ignore_index=True
-                )
-        else:
-            _donors = base_df
 
-    return _donors
+def load_uploaded_donors() -> DonorSnapshot:
+    """
+    Snapshot after donors.csv was replaced by an upload: the file is imported
+    as the new roster, donors deleted earlier included if it lists them.
+    """
+    import_donors_csv(DONORS_CSV, force=True, restore_deleted=True)
+    return load_donor_snapshot(force=True)
+
+
+def donor_table_version() -> int:
+    """Version of the donor table returned by load_donors()."""
+    if MATCH_FROM_DB:
+        # matching queries the store directly; no need to load the whole table
+        return donor_db_version()
+    return load_donor_snapshot().version
 
 
 def load_requests(force: bool = False) -> pd.DataFrame:
-    global _requests
+    global _requests, _requests_sig
     _copy_uploaded_if_exists()
-    if _requests is None or force:
-        if REQUESTS_CSV.exists():
+    sig = file_signature(REQUESTS_CSV)
+    if _requests is None or force or sig != _requests_sig:
+        if sig is not None:
             _requests = pd.read_csv(REQUESTS_CSV)
         else:
             _requests = pd.DataFrame()
+        _requests_sig = sig
     return _requests
 
+@dataclass(frozen=True)
+class Hospital:
+    hospital_id: str
+    name: Optional[str]
+    lat: Optional[float]
+    lon: Optional[float]
+    address: Optional[str]
+
+    @property
+    def coord(self) -> Optional[tuple]:
+        if self.lat is None or self.lon is None:
+            return None
+        return (self.lat, self.lon)
+
+
+def _as_text(value) -> Optional[str]:
+    return None if value is None or pd.isna(value) else str(value)
+
+
+def _build_hospital_index(df: pd.DataFrame) -> Dict[str, Hospital]:
+    if df is None or df.empty:
+        return {}
+    key_col = "hospital_id" if "hospital_id" in df.columns else df.columns[0]
+    index = {}
+    for row in df.to_dict(orient="records"):
+        hid = _as_text(row.get(key_col))
+        hid = hid.strip() if hid is not None else None
+        if not hid or hid in index:
+            # first row wins, like the DataFrame lookup it replaces
+            continue
+        index[hid] = Hospital(
+            hospital_id=hid,
+            name=_as_text(row.get("hospital_name", row.get("name"))),
+            lat=as_float(row.get("lat")),
+            lon=as_float(row.get("lon")),
+            address=_as_text(row.get("address")),
+        )
+    return index
+
+
 def load_hospitals(force: bool = False) -> pd.DataFrame:
-    global _hospitals
+    global _hospitals, _hospital_index, _hospitals_sig
     _copy_uploaded_if_exists()
-    if _hospitals is None or force:
-        if HOSPITALS_CSV.exists():
-            _hospitals = pd.read_csv(HOSPITALS_CSV)
+    sig = file_signature(HOSPITALS_CSV)
+    if _hospitals is None or force or sig != _hospitals_sig:
+        if sig is not None:
+            df = pd.read_csv(HOSPITALS_CSV)
         else:
-            _hospitals = pd.DataFrame()
+            df = pd.DataFrame()
+        # build the index first, then publish both
+        index = _build_hospital_index(df)
+        _hospitals, _hospital_index = df, index
+        _hospitals_sig = sig
     return _hospitals
 
+
+def hospital_index() -> Dict[str, Hospital]:
+    """hospital_id -> Hospital for the current hospitals table (do not mutate)."""
+    load_hospitals()
+    return _hospital_index
+
+
+def get_hospital(hospital_id) -> Optional[Hospital]:
+    if hospital_id is None:
+        return None
+    return hospital_index().get(str(hospital_id).strip())
+
+
+def hospital_coord(hospital_id) -> Optional[tuple]:
+    """(lat, lon) of a hospital, or None if unknown or without coordinates."""
+    hospital = get_hospital(hospital_id)
+    return hospital.coord if hospital is not None else None
+
 def save_uploaded_file(file_bytes: bytes, target_path: Path):
-    with open(target_path, "wb") as f:
-        f.write(file_bytes)
+    # atomic, so workers reading the file concurrently never see half of it
+    write_atomic(target_path, file_bytes)
     # force reload next time
-    load_donors(force=True) if target_path == DONORS_CSV else None
+    load_uploaded_donors() if target_path == DONORS_CSV else None
     load_requests(force=True) if target_path == REQUESTS_CSV else None
     load_hospitals(force=True) if target_path == HOSPITALS_CSV else None
     return target_path
 
 def donors_sample(n:int = 5) -> List[Dict[str,Any]]:
-    df = load_donors()
-    if df.empty:
-        return []
-    return df.head(n).to_dict(orient="records")
+    """First n live donor rows, read from the snapshot's records (no DataFrame)."""
+    snapshot = load_donor_snapshot()
+    return snapshot.records(np.flatnonzero(snapshot.live)[:max(n, 0)])
 
 # app/store.py  (add near other load/save helpers)
 
 def delete_donor_by_id(donor_id: str) -> bool:
     """
-    Delete donor row with donor_id from DONORS_CSV.
-    Returns True if deleted, False if not found.
+    Delete the donors.csv donor(s) with donor_id from the donor store; they
+    stay deleted when donors.csv is re-imported (until a new upload lists
+    them). Returns True if deleted, False if not found.
     """
-    global _donors
-    _copy_uploaded_if_exists()
-    if not DONORS_CSV.exists():
+    sync_donor_db()  # make sure donors.csv has been imported
+    if not delete_donor(donor_id):
         return False
-
-    try:
-        df = pd.read_csv(DONORS_CSV, dtype=str)
-    except Exception:
-        # if CSV cannot be read
-        return False
-
-    # find rows that match donor_id
-    if "donor_id" not in df.columns:
-        # try lower-case fallback or different id column names
-        candidates = [c for c in df.columns if c.lower() in ("id", "donorid", "donor_id")]
-        if not candidates:
-            return False
-        id_col = candidates[0]
-    else:
-        id_col = "donor_id"
-
-    mask = df[id_col].astype(str) != str(donor_id)
-    if mask.all():
-        # nothing removed
-        return False
-
-    # write back only remaining rows
-    df_new = df[mask]
-    df_new.to_csv(DONORS_CSV, index=False)
-
-    # clear cache so next load reads new CSV
-    _donors = None
-    load_donors(force=True)
+    # applied to the in-memory snapshot from the change log on the next read
     return True
 
+
+def save_registered_donor(record: Dict[str, Any]):
+    """Insert or update a registered donor (donors.csv columns) in the donor store."""
+    sync_donor_db()
+    upsert_donor(record)
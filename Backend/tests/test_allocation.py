@@ -0,0 +1,64 @@
+# tests/test_allocation.py
+import numpy as np
+
+from app import allocation
+from app.allocation import allocate_donors, _assign_greedy, _assign_optimal
+
+REQS = [
+    {"required_blood_group": "O-", "lat": 12.9352, "lon": 77.6964, "units_needed": 3, "urgency_level": "high"},
+    {"required_blood_group": "O-", "lat": 12.9063, "lon": 77.6016, "units_needed": 2, "urgency_level": "low"},
+    {"required_blood_group": "AB+", "lat": 12.9604, "lon": 77.6485, "units_needed": 4},
+]
+
+
+def _total(result):
+    return sum(d["score"] for a in result["allocations"] for d in a["assigned"])
+
+
+def _donor_ids(result):
+    return [d["donor_id"] for a in result["allocations"] for d in a["assigned"]]
+
+
+def test_auto_picks_optimal_below_the_cell_limit():
+    result = allocate_donors(REQS)
+    assert result["stats"]["method"] == "optimal"
+    ids = _donor_ids(result)
+    assert len(ids) == len(set(ids)) == 9
+
+
+def test_auto_falls_back_to_greedy_above_the_cell_limit(monkeypatch):
+    optimal = allocate_donors(REQS, method="optimal")
+    monkeypatch.setattr(allocation, "ALLOCATION_MAX_CELLS", 1)
+    greedy = allocate_donors(REQS)
+    assert greedy["stats"]["method"] == "greedy"
+    assert len(set(_donor_ids(greedy))) == 9
+    assert _total(optimal) >= _total(greedy) - 1e-9
+
+
+def test_optimal_beats_greedy_on_a_contested_donor():
+    # greedy hands donor 0 to slot 0 (0.9) and leaves slot 1 with nothing
+    values = np.array([[0.9, 0.8], [0.85, 0.0]])
+    candidates = {0: (np.array([0, 1]), values[0]), 1: (np.array([0]), values[1, :1])}
+    assert sorted(_assign_greedy(candidates, {0: 1, 1: 1})) == [(0, 0)]
+    assert sorted(_assign_optimal(values)) == [(0, 1), (1, 0)]
+
+
+def test_units_needed_is_capped(monkeypatch):
+    monkeypatch.setattr(allocation, "ALLOCATION_MAX_UNITS", 2)
+    result = allocate_donors([{**REQS[0], "units_needed": 1_000_000}])
+    alloc = result["allocations"][0]
+    assert result["stats"]["slots"] == 2
+    assert len(alloc["assigned"]) == 2
+    assert alloc["unfilled"] == 1_000_000 - 2
+
+
+def test_greedy_never_builds_the_slot_matrix(monkeypatch):
+    monkeypatch.setattr(allocation, "ALLOCATION_MAX_CELLS", 1)
+
+    def dense(*args, **kwargs):
+        raise AssertionError("dense assignment on the greedy path")
+
+    monkeypatch.setattr(allocation, "_assign_optimal", dense)
+    result = allocate_donors(REQS)
+    assert result["stats"]["method"] == "greedy"
+    assert [len(a["assigned"]) for a in result["allocations"]] == [3, 2, 4]
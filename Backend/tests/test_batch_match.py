@@ -0,0 +1,47 @@
+# tests/test_batch_match.py
+from app import batch_match
+from app.match_engine import rank_donors_for_request
+
+NEAR = {"required_blood_group": "A+", "lat": 12.9352, "lon": 77.6964}
+FAR = {"required_blood_group": "O-", "lat": 13.0827, "lon": 77.5877}
+
+
+def _ids(matches):
+    return [m["donor_id"] for m in matches]
+
+
+def _geocoder(monkeypatch):
+    def geocode(address):
+        if address == "Unreachable Road":
+            raise ConnectionError("ORS is offline")
+        return {"Koramangala": (12.9352, 77.6245)}.get(address)
+
+    monkeypatch.setattr(batch_match, "geocode_address_cached", geocode)
+
+
+def test_batch_matches_like_single_requests():
+    batch = batch_match.match_batch([NEAR, FAR, dict(NEAR)], top_n=5)
+    assert [_ids(r["matches"]) for r in batch["results"]] == [
+        _ids(rank_donors_for_request(req, top_n=5)) for req in [NEAR, FAR, NEAR]]
+    assert batch["stats"]["requests"] == 3 and batch["stats"]["unique_locations"] == 2
+    # ORS is offline in tests: the whole batch falls back to geodesic distances
+    assert batch["stats"]["road_distances"] == "error"
+    assert batch_match.match_batch([NEAR], road_distances=False)["stats"]["road_distances"] == "skipped"
+
+
+def test_one_failing_geocode_does_not_fail_the_batch(client, monkeypatch):
+    _geocoder(monkeypatch)
+    reqs = [
+        NEAR,
+        {"required_blood_group": "B+", "address": "Unreachable Road"},
+        {"required_blood_group": "B+", "address": "Koramangala"},
+        {"required_blood_group": "B+", "address": "Nowhere"},
+    ]
+    res = client.post("/api/match/batch", json={"requests": reqs, "top_n": 3})
+    assert res.status_code == 200
+    results, stats = res.json()["results"], res.json()["stats"]
+
+    assert [r.get("error") for r in results] == [None, "Geocoding failed for address: Unreachable Road", None, None]
+    assert all(m["distance_m"] is not None for r in (results[0], results[2]) for m in r["matches"])
+    assert results[2]["request"]["lat"] == 12.9352
+    assert stats["unresolved_locations"] == 2 and stats["geocode_errors"] == 1
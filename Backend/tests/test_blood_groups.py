@@ -0,0 +1,62 @@
+# tests/test_blood_groups.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.blood_groups import UNKNOWN_CODE, compatible_mask, encode_blood_group, encode_blood_groups
+
+GROUPS = ["O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"]
+
+# donor groups each recipient may receive red cells from
+CAN_RECEIVE = {
+    "O-": {"O-"},
+    "O+": {"O-", "O+"},
+    "A-": {"O-", "A-"},
+    "A+": {"O-", "O+", "A-", "A+"},
+    "B-": {"O-", "B-"},
+    "B+": {"O-", "O+", "B-", "B+"},
+    "AB-": {"O-", "A-", "B-", "AB-"},
+    "AB+": set(GROUPS),
+}
+
+MALFORMED = ["", "C+", "A++", "ABO", "B positive-ish", "X", "+", "unknown", None, float("nan")]
+
+
+@pytest.mark.parametrize("recipient", GROUPS)
+def test_compatibility_matrix(recipient):
+    donors = encode_blood_groups(pd.Series(GROUPS))
+    mask = compatible_mask(donors, encode_blood_group(recipient))
+    assert {g for g, ok in zip(GROUPS, mask) if ok} == CAN_RECEIVE[recipient]
+
+
+@pytest.mark.parametrize("recipient", [g for g in GROUPS if g.endswith("-")])
+def test_rh_negative_recipients_never_get_rh_positive_donors(recipient):
+    donors = encode_blood_groups(pd.Series(GROUPS))
+    mask = compatible_mask(donors, encode_blood_group(recipient))
+    assert not any(ok for g, ok in zip(GROUPS, mask) if g.endswith("+"))
+
+
+@pytest.mark.parametrize("spelling, group", [
+    ("a+", "A+"), (" AB - ", "AB-"), ("0+", "O+"), ("B RH NEG", "B-"),
+    ("A positive", "A+"), ("o negative", "O-"), ("AB", "AB+"),
+])
+def test_spellings(spelling, group):
+    assert encode_blood_group(spelling) == encode_blood_group(group)
+
+
+@pytest.mark.parametrize("value", MALFORMED)
+def test_malformed_groups_are_unknown(value):
+    assert encode_blood_group(value) == UNKNOWN_CODE
+
+
+def test_unknown_groups_match_nothing():
+    donors = encode_blood_groups(pd.Series(GROUPS + MALFORMED))
+    assert (donors[len(GROUPS):] == UNKNOWN_CODE).all()
+    for recipient in GROUPS:
+        assert not compatible_mask(donors, encode_blood_group(recipient))[len(GROUPS):].any()
+    for value in MALFORMED:
+        assert not compatible_mask(donors, encode_blood_group(value)).any()
+
+
+def test_encode_empty():
+    assert encode_blood_groups(pd.Series([], dtype=object)).dtype == np.int8
@@ -0,0 +1,47 @@
+# tests/test_coherence.py
+"""Several uvicorn workers: a write in one process shows up in the others."""
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import BACKEND_DIR
+
+WRITE_DONOR = """
+from app.store import save_registered_donor, load_donor_snapshot
+save_registered_donor({"donor_id": "W1", "name": "Worker", "blood_group": "AB-", "lat": 12.95,
+                       "lon": 77.6, "availability": "yes", "last_donation_date": "2025-01-01"})
+print(load_donor_snapshot().version)
+"""
+
+READ_VERSION = """
+from app.store import load_donor_snapshot
+print(load_donor_snapshot().version)
+"""
+
+
+def _run(code: str) -> int:
+    # same environment, so the same scratch data directory (conftest.py)
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True,
+                         capture_output=True, text=True).stdout
+    return int(out.split()[-1])
+
+
+def test_snapshot_follows_writes_of_other_processes():
+    from app.donor_db import SOURCE_USER, delete_donor
+    from app.store import load_donor_snapshot
+
+    before = load_donor_snapshot()
+    written = _run(WRITE_DONOR)
+    assert written > before.version
+
+    after = load_donor_snapshot()
+    assert after.version == written
+    live = np.flatnonzero(after.live)
+    assert "W1" in after.values("donor_id", live)
+    # the snapshot the process held is untouched
+    assert "W1" not in before.values("donor_id", np.flatnonzero(before.live))
+
+    # and the other way round: a fresh process sees this one's delete
+    assert delete_donor("W1", source=SOURCE_USER) == 1
+    assert _run(READ_VERSION) == load_donor_snapshot().version > written
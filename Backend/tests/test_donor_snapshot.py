@@ -0,0 +1,86 @@
+# tests/test_donor_snapshot.py
+import numpy as np
+import pandas as pd
+
+from app import shared_snapshot
+from app.donor_snapshot import build_donor_snapshot
+
+
+def _snapshot(n=8):
+    df = pd.DataFrame({
+        "donor_id": [f"D{i}" for i in range(n)],
+        "blood_group": ["O+"] * n,
+        "lat": [12.9 + i * 0.01 for i in range(n)],
+        "lon": [77.6] * n,
+        "availability": ["yes"] * n,
+        "last_donation_date": ["2025-01-0%d" % (i % 9 + 1) for i in range(n)],
+    })
+    return build_donor_snapshot(df, 1)
+
+
+def test_apply_changes_leaves_the_old_version_alone():
+    old = _snapshot()
+    record = {**old.record(2), "availability": "no"}
+    new = old.apply_changes([(2, record), (100, {**record, "donor_id": "D100"}), (3, None)], 2)
+    assert (old.version, old.size, old.available.all(), old.live.all()) == (1, 8, True, True)
+    assert old.record(2)["availability"] == "yes"
+    assert new.version == 2 and new.size == 9
+    assert not new.available[2] and not new.live[3]
+    assert new.record(8)["donor_id"] == "D100"
+    assert 3 in old.index.query_radius(12.93, 77.6, 0.5)
+    assert 3 not in new.index.query_radius(12.93, 77.6, 0.5)
+
+
+def test_readers_of_an_older_version_keep_seeing_it():
+    # more rows than one record page, so changes land on shared and unshared pages
+    old = _snapshot(3000)
+    lat, available, frame = old.lat, old.available, old.frame.copy()
+    records = old.records(range(old.size))
+    new = old
+    for v, pos in enumerate([0, 1500, 2999, 1500], start=2):
+        new = new.apply_changes([(pos, {**new.record(pos), "availability": "no", "lat": 1.0}),
+                                 (10_000 + v, {**new.record(0), "donor_id": f"N{v}"}),
+                                 (v, None)], v)
+    assert new.size == 3004 and not new.available[[0, 1500, 2999]].any()
+    assert new.values("donor_id", [3000, 3003]) == ["N2", "N5"]
+    assert old.size == 3000 and old.version == 1
+    assert old.lat is lat and np.array_equal(old.lat, frame["lat"].astype(float))
+    assert old.available is available and available.all() and old.live.all()
+    assert old.records(range(old.size)) == records
+    assert old.frame.equals(frame)
+    assert 1500 in old.index.query_radius(old.lat[1500], 77.6, 0.1)
+    assert 1500 not in new.index.query_radius(old.lat[1500], 77.6, 0.1)
+
+
+def test_tombstones_are_compacted():
+    old = _snapshot()
+    new = old.apply_changes([(0, None)], 2)
+    assert new.size == 8
+    new = new.apply_changes([(1, None), (2, None)], 3)
+    # 3 of 8 positions deleted: past DONOR_SNAPSHOT_MAX_TOMBSTONES
+    assert new.size == 5 and new.live.all()
+    assert list(new.ids) == [3, 4, 5, 6, 7]
+    assert [new.record(i)["donor_id"] for i in range(5)] == ["D3", "D4", "D5", "D6", "D7"]
+    assert sorted(new.index.query_radius(12.95, 77.6, 50)) == [0, 1, 2, 3, 4]
+    assert new.apply_changes([(7, None)], 4).size == 5
+
+
+def test_last_donation_dates_are_datetime64():
+    old = _snapshot()
+    assert old.last_donation.dtype == np.dtype("datetime64[ns]")
+    assert old.last_donation[3] == np.datetime64("2025-01-04")
+    new = old.apply_changes([(3, {**old.record(3), "last_donation_date": "2025-06-30"}),
+                             (4, {**old.record(4), "last_donation_date": "not a date"}),
+                             (9, {**old.record(0), "donor_id": "D9", "last_donation_date": None})], 2)
+    assert new.last_donation[3] == np.datetime64("2025-06-30")
+    assert np.isnat(new.last_donation[4]) and np.isnat(new.last_donation[8])
+    assert old.last_donation[3] == np.datetime64("2025-01-04")
+
+
+def test_last_donation_dates_survive_a_saved_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_snapshot, "SHARED_SNAPSHOT_DIR", tmp_path)
+    snapshot = _snapshot()
+    shared_snapshot.publish_snapshot(snapshot)
+    mapped = shared_snapshot.attach_snapshot(snapshot.version)
+    assert mapped.last_donation.dtype == np.dtype("datetime64[ns]")
+    assert np.array_equal(mapped.last_donation, snapshot.last_donation)
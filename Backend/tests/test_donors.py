@@ -0,0 +1,66 @@
+# tests/test_donors.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.config import DONORS_CSV
+from app.donor_snapshot import DonorSnapshot
+
+
+@pytest.fixture
+def no_frame(monkeypatch):
+    def frame(self):
+        raise AssertionError("built the whole donor DataFrame")
+    monkeypatch.setattr(DonorSnapshot, "frame", property(frame))
+
+
+def test_sample_and_cols_without_the_frame(client, no_frame):
+    csv = pd.read_csv(DONORS_CSV, dtype=str)
+    res = client.get("/api/donors/sample", params={"n": 3}).json()
+    assert res["status"] == "ok"
+    assert [r["donor_id"] for r in res["sample"]] == csv["donor_id"].head(3).tolist()
+    res = client.get("/api/donors/cols").json()
+    assert res["columns"] == csv.columns.tolist()
+
+
+@pytest.fixture
+def donors_csv():
+    """donors.csv as it was, restored (as an upload) afterwards."""
+    from app.coherence import write_atomic
+    from app.store import load_uploaded_donors
+
+    original = DONORS_CSV.read_bytes()
+    yield original
+    write_atomic(DONORS_CSV, original)
+    load_uploaded_donors()
+
+
+def _live_ids():
+    from app.store import load_donor_snapshot
+
+    snapshot = load_donor_snapshot()
+    return set(snapshot.values("donor_id", np.flatnonzero(snapshot.live)))
+
+
+def test_delete_survives_a_csv_reimport(donors_csv):
+    from app.coherence import write_atomic
+    from app.store import delete_donor_by_id, load_donor_snapshot
+
+    assert delete_donor_by_id("D005")
+    assert "D005" not in _live_ids()
+    # the file changes (another row added) and is re-imported; it still lists D005
+    write_atomic(DONORS_CSV, donors_csv + b"D999,New,O-,9000000000,12.95,77.6,2025-01-01,yes\n")
+    load_donor_snapshot(force=True)
+    ids = _live_ids()
+    assert "D999" in ids and "D005" not in ids
+    assert not delete_donor_by_id("D005")
+
+
+def test_upload_restores_deleted_donors(client, donors_csv):
+    from app.store import delete_donor_by_id
+
+    assert delete_donor_by_id("D006")
+    res = client.post("/api/upload/donors", files={"file": ("donors.csv", donors_csv, "text/csv")})
+    assert res.status_code == 200
+    assert res.json()["rows"] == donors_csv.count(b"\n") - 1
+    assert "D006" in _live_ids()
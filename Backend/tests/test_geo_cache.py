@@ -0,0 +1,194 @@
+# tests/test_geo_cache.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import geo_cache
+from app.config import GEOCODE_NEGATIVE_TTL_S, GEOCODE_TTL_S
+
+BENGALURU = (12.9716, 77.5946)
+
+
+@pytest.fixture
+def clock(monkeypatch, tmp_path):
+    """Empty caches on a private SQLite file, with a clock the test moves."""
+    monkeypatch.setattr(geo_cache, "GEO_CACHE_DB_PATH", tmp_path / "geo_cache.db")
+    geo_cache.init_geo_cache_db()
+    monkeypatch.setattr(geo_cache, "geocode_cache", geo_cache.GeocodeCache())
+    monkeypatch.setattr(geo_cache, "distance_cache", geo_cache.DistanceCache())
+    clock = SimpleNamespace(now=1_000_000.0)
+    clock.time = lambda: clock.now
+    monkeypatch.setattr(geo_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    answers = {"bengaluru": BENGALURU}
+    calls = []
+
+    def geocode(address):
+        calls.append(address)
+        if address == "offline":
+            raise ConnectionError("ORS is offline")
+        return answers.get(geo_cache.normalize_address(address))
+
+    monkeypatch.setattr(geo_cache, "geocode_address", geocode)
+    return calls
+
+
+def test_geocode_is_cached_by_normalized_address(clock, geocoder):
+    assert geo_cache.geocode_address_cached("Bengaluru") == BENGALURU
+    assert geo_cache.geocode_address_cached("  BENGALURU, ") == BENGALURU
+    assert geocoder == ["Bengaluru"]
+    assert geo_cache.geocode_address_cached(" ,. ") is None
+    assert geocoder == ["Bengaluru"]
+
+
+def test_geocode_survives_a_restart(clock, geocoder, monkeypatch):
+    geo_cache.geocode_address_cached("Bengaluru")
+    # new process: empty memory tier, same SQLite file
+    monkeypatch.setattr(geo_cache, "geocode_cache", geo_cache.GeocodeCache())
+    assert geo_cache.geocode_address_cached("bengaluru") == BENGALURU
+    assert geocoder == ["Bengaluru"]
+    assert geo_cache.geocode_cache.stats.db_hits == 1
+
+
+def test_geocode_entries_expire(clock, geocoder):
+    geo_cache.geocode_address_cached("Bengaluru")
+    clock.now += GEOCODE_TTL_S - 1
+    geo_cache.geocode_address_cached("Bengaluru")
+    assert len(geocoder) == 1
+    clock.now += 2
+    geo_cache.geocode_address_cached("Bengaluru")
+    assert len(geocoder) == 2
+
+
+def test_unresolved_addresses_are_cached_briefly(clock, geocoder, monkeypatch):
+    assert geo_cache.geocode_address_cached("Nowhere Lane") is None
+    assert geo_cache.geocode_address_cached("nowhere lane") is None
+    assert len(geocoder) == 1
+
+    # the negative entry is in SQLite too
+    monkeypatch.setattr(geo_cache, "geocode_cache", geo_cache.GeocodeCache())
+    assert geo_cache.geocode_address_cached("Nowhere Lane") is None
+    assert len(geocoder) == 1
+
+    clock.now += GEOCODE_NEGATIVE_TTL_S + 1
+    assert geo_cache.geocode_address_cached("Nowhere Lane") is None
+    assert len(geocoder) == 2
+
+
+def test_geocode_errors_are_not_cached(clock, geocoder):
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            geo_cache.geocode_address_cached("offline")
+    assert geocoder == ["offline", "offline"]
+    assert geo_cache.geocode_cache.stats.misses == 2
+
+
+def test_async_geocode_shares_the_cache(clock, geocoder, monkeypatch):
+    async def async_geocode(address):
+        return geo_cache.geocode_address(address)
+
+    monkeypatch.setattr(geo_cache, "async_geocode_address", async_geocode)
+    geo_cache.geocode_address_cached("Bengaluru")
+    assert asyncio.run(geo_cache.async_geocode_address_cached("bengaluru")) == BENGALURU
+    assert asyncio.run(geo_cache.async_geocode_address_cached("Nowhere")) is None
+    assert asyncio.run(geo_cache.async_geocode_address_cached("nowhere")) is None
+    assert geocoder == ["Bengaluru", "Nowhere"]
+
+
+@pytest.fixture
+def matrix(monkeypatch):
+    """ORS stand-ins recording the destinations they were asked for."""
+    calls = []
+
+    def distance(o, d):
+        lat0, lon0 = map(float, o.split(","))
+        lat1, lon1 = map(float, d.split(","))
+        return round(1e5 * (abs(lat1 - lat0) + abs(lon1 - lon0)), 1)
+
+    def one_to_many(origins, destinations, mode="driving", one_to_many=False):
+        calls.append(list(destinations))
+        row = [None if d.startswith("0") else distance(origins[0], d) for d in destinations]
+        return {"distances": [[0.0] + row], "durations": [[0.0] + [r and r / 10 for r in row]]}
+
+    def many_to_many(origins, destinations):
+        calls.append(list(destinations))
+        rows = [[distance(o, d) for d in destinations] for o in origins]
+        return {"distances": rows, "durations": [[r / 10 for r in row] for row in rows]}
+
+    monkeypatch.setattr(geo_cache, "distance_matrix", one_to_many)
+    monkeypatch.setattr(geo_cache, "distance_matrix_many_to_many", many_to_many)
+    return calls
+
+
+def _row(ors_raw):
+    return ors_raw["distances"][0][1:]
+
+
+def test_road_distances_are_cached_per_cell(clock, matrix):
+    # the first two destinations share a ~110 m grid cell
+    dests = [(12.9801, 77.6001), (12.98012, 77.60008), (12.99, 77.61)]
+    first = geo_cache.cached_road_distances(BENGALURU, dests)
+    assert len(matrix) == 1 and len(matrix[0]) == 2
+    assert _row(first)[0] == _row(first)[1] and None not in _row(first)
+    assert first["metadata"] == {"cache_hits": 0, "ors_requested": 2}
+
+    # a nearby origin snaps to the same cell
+    again = geo_cache.cached_road_distances((12.97162, 77.59458), dests)
+    assert len(matrix) == 1 and _row(again) == _row(first)
+    assert again["metadata"] == {"cache_hits": 3, "ors_requested": 0}
+
+    # only the new destination goes to ORS
+    geo_cache.cached_road_distances(BENGALURU, dests + [(13.0, 77.7)])
+    assert matrix[1] == ["13.0,77.7"]
+
+
+def test_road_distances_survive_a_restart_until_max_age(clock, matrix, monkeypatch):
+    dests = [(12.98, 77.6), (12.99, 77.61)]
+    geo_cache.cached_road_distances(BENGALURU, dests)
+    monkeypatch.setattr(geo_cache, "distance_cache", geo_cache.DistanceCache())
+    geo_cache.cached_road_distances(BENGALURU, dests)
+    assert len(matrix) == 1 and geo_cache.distance_cache.stats.db_hits == 2
+
+    clock.now += geo_cache.distance_cache.max_age_s + 1
+    geo_cache.cached_road_distances(BENGALURU, dests)
+    assert len(matrix) == 2
+
+
+def test_unknown_road_distances_are_not_cached(clock, matrix):
+    # the stand-in has no route to destinations with latitude 0.x
+    dests = [(0.5, 77.6), (12.98, 77.6)]
+    assert _row(geo_cache.cached_road_distances(BENGALURU, dests))[0] is None
+    assert _row(geo_cache.cached_road_distances(BENGALURU, dests))[0] is None
+    assert matrix == [["0.5,77.6", "12.98,77.6"], ["0.5,77.6"]]
+
+
+def test_ors_errors_are_raised_and_not_cached(clock, monkeypatch):
+    def offline(*args, **kwargs):
+        raise ConnectionError("ORS is offline")
+
+    monkeypatch.setattr(geo_cache, "distance_matrix", offline)
+    with pytest.raises(ConnectionError):
+        geo_cache.cached_road_distances(BENGALURU, [(12.98, 77.6)])
+    cached = geo_cache.distance_cache.get_many(geo_cache.snap(*BENGALURU), [geo_cache.snap(12.98, 77.6)])
+    assert cached == [geo_cache._MISSING]
+
+
+def test_batch_lookup_resolves_all_misses_at_once(clock, matrix):
+    origins = [BENGALURU, (12.97162, 77.59458), (13.02, 77.65)]
+    dests = [[(12.98, 77.6)], [(12.98, 77.6), (12.99, 77.61)], [(12.99, 77.61), (13.0, 77.7)]]
+    geo_cache.cached_road_distances(BENGALURU, [(12.98, 77.6)])
+
+    out = geo_cache.cached_road_distances_many(origins, dests)
+    # one many-to-many call; destination cells deduplicated across origins
+    assert len(matrix) == 2 and sorted(matrix[1]) == ["12.99,77.61", "13.0,77.7"]
+    assert [len(_row(o)) for o in out] == [1, 2, 2]
+    assert _row(out[0]) == _row(out[1])[:1]
+    assert out[0]["metadata"] == {"cache_hits": 1, "ors_requested": 0}
+    assert geo_cache.cached_road_distances_many(origins, dests) == [
+        {**o, "metadata": {"cache_hits": len(_row(o)), "ors_requested": 0}} for o in out]
+    assert len(matrix) == 2
@@ -0,0 +1,33 @@
+# tests/test_google_maps.py
+from app import google_maps, http_client
+from app.config import HTTP_CONNECT_TIMEOUT_S, HTTP_READ_TIMEOUT_S
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    def __init__(self, data):
+        self.data = data
+        self.timeouts = []
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        return FakeResponse(self.data)
+
+
+def test_calls_use_the_configured_timeouts(monkeypatch):
+    session = FakeSession({"features": [{"geometry": {"coordinates": [77.6, 12.9]}}],
+                           "durations": [[0, 60]], "distances": [[0, 1000]]})
+    monkeypatch.setattr(http_client, "get_session", lambda: session)
+    assert google_maps.geocode_address("Bengaluru") == (12.9, 77.6)
+    google_maps._post_matrix({"locations": []})
+    assert session.timeouts == [(HTTP_CONNECT_TIMEOUT_S, HTTP_READ_TIMEOUT_S)] * 2
@@ -0,0 +1,52 @@
+# tests/test_match.py
+from app.match_engine import rank_donors_for_request, score_donors
+
+REQ = {"required_blood_group": "B+", "lat": 12.9352, "lon": 77.6964}
+
+
+def test_top_n_none_returns_every_match():
+    scored = score_donors(REQ, top_n=None)
+    matches = rank_donors_for_request(REQ, top_n=None)
+    assert len(matches) == len(scored) > 10
+    assert [m["donor_id"] for m in matches[:10]] == [m["donor_id"] for m in rank_donors_for_request(REQ, top_n=10)]
+
+
+def test_match_top_n_null(client):
+    res = client.post("/api/match", json={**REQ, "top_n": None})
+    assert res.status_code == 200
+    assert len(res.json()["matches"]) == len(score_donors(REQ, top_n=None))
+
+
+def test_match_top_n_zero_is_rejected(client):
+    assert client.post("/api/match", json={**REQ, "top_n": 0}).status_code == 422
+    assert client.post("/api/match/batch", json={"requests": [REQ], "top_n": 0}).status_code == 422
+
+
+def test_match_default_top_n(client):
+    res = client.post("/api/match", json=REQ)
+    assert res.status_code == 200
+    assert len(res.json()["matches"]) == 10
+
+
+def _slow_geocoder(monkeypatch):
+    import asyncio
+    from app import main
+
+    async def slow(address):
+        await asyncio.sleep(1)
+    monkeypatch.setattr(main, "async_geocode_address_cached", slow)
+    monkeypatch.setattr(main, "MATCH_LATENCY_BUDGET_S", 0.05)
+
+
+def test_geocode_timeout_falls_back_to_hospital(client, monkeypatch):
+    _slow_geocoder(monkeypatch)
+    req = {"required_blood_group": "B+", "address": "somewhere", "hospital_id": "H001"}
+    res = client.post("/api/match", json=req)
+    assert res.status_code == 200
+    assert len(res.json()["matches"]) == 10
+
+
+def test_geocode_timeout_without_hospital(client, monkeypatch):
+    _slow_geocoder(monkeypatch)
+    res = client.post("/api/match", json={"required_blood_group": "B+", "address": "somewhere"})
+    assert res.status_code == 504
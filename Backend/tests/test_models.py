@@ -0,0 +1,112 @@
+# tests/test_models.py
+import io
+import shutil
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from app import model_registry
+from app.blood_groups import CODE_LABELS, encode_blood_group
+from app.coherence import write_atomic
+from app.config import ACTIVE_MODEL_POINTER, MODEL_VERSIONS_DIR
+
+GROUPS = list(CODE_LABELS.values())
+
+
+def _model(features=("donor_blood_group", "recipient_blood_group"), seed=0):
+    rng = np.random.default_rng(seed)
+    x = pd.DataFrame({"donor_blood_group": rng.choice(GROUPS, 200), "recipient_blood_group": rng.choice(GROUPS, 200)})
+    if "phone" in features:
+        x["phone"] = rng.integers(0, 10, 200).astype(str)
+    y = (x["donor_blood_group"] == x["recipient_blood_group"]) | (rng.random(200) < 0.3)
+    pre = ColumnTransformer([("cat", OneHotEncoder(handle_unknown="ignore"), list(features))])
+    return Pipeline([("preproc", pre), ("clf", LogisticRegression())]).fit(x[list(features)], y)
+
+
+def _dump(model) -> bytes:
+    buf = io.BytesIO()
+    joblib.dump(model, buf)
+    return buf.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def no_model():
+    yield
+    ACTIVE_MODEL_POINTER.unlink(missing_ok=True)
+    shutil.rmtree(MODEL_VERSIONS_DIR, ignore_errors=True)
+    model_registry._active = None
+    model_registry._initialized = False
+    model_registry._pointer_sig = None
+    model_registry._versions.clear()
+
+
+def test_lookup_table_matches_the_model():
+    model = _model()
+    lut = model_registry.build_ml_lookup(model)
+    for d, donor in CODE_LABELS.items():
+        for r, recipient in CODE_LABELS.items():
+            pair = pd.DataFrame([{"donor_blood_group": donor, "recipient_blood_group": recipient}])
+            assert lut[d, r] == pytest.approx(model.predict_proba(pair)[0, 1])
+    # needs donor columns besides the blood groups: no table, scored per row
+    assert model_registry.build_ml_lookup(_model(("donor_blood_group", "recipient_blood_group", "phone"))) is None
+
+
+def test_upload_validates_and_activates(client):
+    res = client.post("/api/model/upload", files={"file": ("m.joblib", _dump(_model()))})
+    assert res.status_code == 200
+    version = res.json()["version"]
+    # background task ran after the response
+    status = client.get("/api/model/status").json()
+    assert status["active_version"] == version and status["lookup_table"]
+    assert status["versions"][version]["status"] == "active"
+    assert ACTIVE_MODEL_POINTER.read_text().strip() == version
+
+    bad = client.post("/api/model/upload", files={"file": ("m.joblib", b"not a model")}).json()["version"]
+    status = client.get("/api/model/status").json()
+    assert status["versions"][bad]["status"] == "failed"
+    assert status["active_version"] == version
+
+
+def test_matches_use_the_lookup_table(client):
+    model_registry.activate_version(model_registry.store_model_version(_dump(_model())))
+    lut = model_registry.get_active_model().lut
+    res = client.post("/api/match", json={"required_blood_group": "B+", "lat": 12.97, "lon": 77.59, "top_n": 5,
+                                          "weights": {"blood": 0.5, "distance": 0.3, "ml": 0.2}})
+    for m in res.json()["matches"]:
+        assert m["ml_score"] == pytest.approx(lut[encode_blood_group(m["blood_group"]), encode_blood_group("B+")])
+
+
+def test_version_activated_by_another_worker_loads_off_the_request_path(monkeypatch):
+    first = model_registry.store_model_version(_dump(_model(seed=1)))
+    assert model_registry.activate_version(first)
+    second = model_registry.store_model_version(_dump(_model(seed=2)))
+
+    release = threading.Event()
+    load = model_registry._load_state
+
+    def slow_load(version, path):
+        release.wait(5)
+        return load(version, path)
+
+    monkeypatch.setattr(model_registry, "_load_state", slow_load)
+    # what activate_version() in another process leaves behind (a new inode)
+    write_atomic(ACTIVE_MODEL_POINTER, second.encode("utf-8"))
+
+    t0 = time.perf_counter()
+    assert model_registry.get_active_model().version == first
+    assert model_registry.get_active_model().version == first
+    assert time.perf_counter() - t0 < 1.0
+
+    release.set()
+    deadline = time.time() + 5
+    while model_registry.get_active_model().version != second and time.time() < deadline:
+        time.sleep(0.01)
+    assert model_registry.get_active_model().version == second
@@ -0,0 +1,46 @@
+# tests/test_paging.py
+from app import match_engine
+from app.geo_cache import LRUCache
+from app.match_engine import rank_donors_for_request
+
+REQ = {"required_blood_group": "O+", "lat": 12.93, "lon": 77.69, "top_n": 5}
+
+
+def _all_pages(client, cursor, limit=7):
+    ids = []
+    while cursor:
+        res = client.get("/api/match/next", params={"cursor": cursor, "limit": limit})
+        assert res.status_code == 200
+        ids += [m["donor_id"] for m in res.json()["matches"]]
+        cursor = res.json()["next_cursor"]
+    return ids
+
+
+def test_no_cursor_unless_asked(client):
+    before = len(match_engine._snapshots)
+    res = client.post("/api/match", json=REQ)
+    assert res.status_code == 200
+    assert res.json()["next_cursor"] is None
+    assert len(match_engine._snapshots) == before
+
+
+def test_pages_follow_the_full_ranking(client):
+    res = client.post("/api/match", params={"paginate": True}, json=REQ).json()
+    ids = [m["donor_id"] for m in res["matches"]] + _all_pages(client, res["next_cursor"])
+    full = rank_donors_for_request({k: v for k, v in REQ.items() if k != "top_n"}, top_n=None, refine_k=0)
+    assert ids == [m["donor_id"] for m in full]
+
+
+def test_unknown_cursor(client):
+    assert client.get("/api/match/next", params={"cursor": "nope.5"}).status_code == 404
+    assert client.get("/api/match/next", params={"cursor": "x"}).status_code == 404
+
+
+def test_cursor_store_is_bounded_by_bytes():
+    cache = LRUCache(100, max_bytes=250)
+    for i in range(5):
+        cache.put(i, i, float("inf"), nbytes=100)
+    assert len(cache) == 2 and cache.nbytes == 200
+    assert cache.get(4) == 4
+    cache.put(4, 4, float("inf"), nbytes=50)
+    assert cache.nbytes == 150
@@ -0,0 +1,110 @@
+# tests/test_result_cache.py
+import asyncio
+
+import pytest
+
+from app import geo_cache, match_engine, model_registry
+from app.match_engine import rank_donors_for_request, score_and_refine_async
+from app.result_cache import MatchResultCache
+from test_models import _dump, _model, no_model  # noqa: F401
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = MatchResultCache()
+    monkeypatch.setattr(match_engine, "match_result_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def ors(monkeypatch):
+    matrix, calls = _ors()
+    monkeypatch.setattr(geo_cache, "distance_matrix", matrix)
+    return calls
+
+
+def _request(lat: float) -> dict:
+    # a separate origin per test, so road distances cached by another test don't answer
+    return {"required_blood_group": "O+", "lat": lat, "lon": 77.61}
+
+
+def _ors(failed_every: int = 0):
+    """distance_matrix stand-in; every failed_every-th destination comes back unknown."""
+    calls = []
+
+    def matrix(origins, destinations, mode="driving", one_to_many=False):
+        calls.append(len(destinations))
+        row = [None if failed_every and i % failed_every == 0 else 1000.0 + i for i in range(len(destinations))]
+        return {"distances": [[0.0] + row], "durations": [[0.0] + row]}
+
+    return matrix, calls
+
+
+def test_complete_results_are_cached(cache, ors):
+    first = rank_donors_for_request(_request(12.90))
+    assert rank_donors_for_request(_request(12.90)) == first
+    assert len(ors) == 1 and cache.hits == 1
+
+
+def test_partly_refined_results_expire(monkeypatch, cache):
+    matrix, calls = _ors(failed_every=3)
+    monkeypatch.setattr(geo_cache, "distance_matrix", matrix)
+    first = rank_donors_for_request(_request(12.92))
+    assert any(m.get("distance_estimated") for m in first)
+    # served from the cache within the TTL ...
+    rank_donors_for_request(_request(12.92))
+    assert len(calls) == 1 and cache.hits == 1
+
+    # ... and retried once it expires
+    cache.clear()
+    monkeypatch.setattr(match_engine, "MATCH_RESULT_PARTIAL_TTL_S", 0)
+    rank_donors_for_request(_request(12.92))
+    rank_donors_for_request(_request(12.92))
+    assert len(calls) == 3 and cache.hits == 1
+
+
+def test_async_status_reports_partial_refinement(monkeypatch):
+    matrix, _ = _ors(failed_every=3)
+
+    async def async_matrix(*args, **kwargs):
+        return matrix(*args, **kwargs)
+
+    monkeypatch.setattr(geo_cache, "async_distance_matrix", async_matrix)
+    monkeypatch.setattr(match_engine, "MATCH_RESULT_PARTIAL_TTL_S", 0)
+    _, status = asyncio.run(score_and_refine_async(_request(12.94), budget_s=5))
+    assert status == "partial"
+    _, status = asyncio.run(score_and_refine_async(_request(12.94), budget_s=5))
+    assert status == "partial"
+
+
+def test_donor_change_invalidates_results(cache, ors):
+    from app.donor_db import SOURCE_USER, delete_donor
+    from app.store import save_registered_donor
+
+    req = _request(12.96)
+    rank_donors_for_request(req)
+    assert [m["donor_id"] for m in rank_donors_for_request(req)] and cache.hits == 1
+
+    save_registered_donor({"donor_id": "RC1", "name": "Next Door", "blood_group": "O-",
+                           "lat": req["lat"], "lon": req["lon"], "availability": "yes"})
+    try:
+        matches = rank_donors_for_request(req)
+        assert "RC1" in [m["donor_id"] for m in matches]
+        assert cache.invalidated == 1
+    finally:
+        delete_donor("RC1", source=SOURCE_USER)
+    assert "RC1" not in [m["donor_id"] for m in rank_donors_for_request(req)]
+
+
+@pytest.mark.usefixtures("no_model")
+def test_model_change_invalidates_results(cache, ors):
+    req = _request(12.98)
+    rank_donors_for_request(req)
+    rank_donors_for_request(req)
+    assert cache.hits == 1
+
+    model_registry.activate_version(model_registry.store_model_version(_dump(_model())))
+    rank_donors_for_request(req)
+    assert cache.hits == 1 and cache.misses == 2
+    rank_donors_for_request(req)
+    assert cache.hits == 2
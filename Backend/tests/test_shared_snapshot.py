@@ -0,0 +1,128 @@
+# tests/test_shared_snapshot.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import shared_snapshot
+from app.donor_db import donor_db_version
+from app.donor_snapshot import RecordPages, build_donor_snapshot
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_snapshot, "SHARED_SNAPSHOT_DIR", tmp_path)
+    return tmp_path
+
+
+def _snapshot(version=1):
+    df = pd.DataFrame({
+        "donor_id": ["D0", "D1", "D2", "D3"],
+        "name": ["Asha", None, "Ravi", "x" * 100],
+        "phone": [9000000001, "not given", None, 9000000004],
+        "units": [1, 2, None, 4],
+        "lat": [12.9, 13.0, None, 13.1],
+        "lon": [77.6, 77.7, None, 77.8],
+        "availability": ["yes", "no", "yes", "yes"],
+    }, dtype=object)
+    return build_donor_snapshot(df, version)
+
+
+def test_saved_generation_reads_columns_from_typed_files(snapshot_dir):
+    snapshot = _snapshot()
+    shared_snapshot.publish_snapshot(snapshot)
+    mapped = shared_snapshot.attach_snapshot(1)
+    # mixed ints and text, or text past TYPED_COLUMN_MAX_CHARS, stay in records.bin only
+    assert sorted(mapped.record_source.columns) == ["availability", "donor_id", "lat", "lon", "units"]
+    everything = np.arange(snapshot.size)
+    for column in snapshot.columns:
+        assert mapped.values(column, everything) == snapshot.values(column, everything)
+    assert mapped.values("units", [2, 0]) == [None, 1]
+    assert mapped.frame.equals(snapshot.frame)
+    assert mapped.frame_rows(everything[1:]).equals(snapshot.frame_rows(everything[1:]))
+    assert mapped.records(everything) == snapshot.records(everything)
+
+
+def test_next_generation_patches_the_typed_columns(snapshot_dir):
+    shared_snapshot.publish_snapshot(_snapshot())
+    previous = shared_snapshot.attach_snapshot(1)
+    record = {**previous.record(0), "donor_id": "D0-renamed-to-something-longer", "units": None}
+    built = previous.apply_changes([(0, record), (9, {**record, "donor_id": "D9", "units": 7})], 2)
+    shared_snapshot.publish_snapshot(built)
+    mapped = shared_snapshot.attach_snapshot(2)
+    assert "units" in mapped.record_source.columns
+    assert mapped.values("donor_id", [0, 4]) == ["D0-renamed-to-something-longer", "D9"]
+    assert mapped.values("units", [0, 1, 4]) == [None, 2, 7]
+    assert previous.values("donor_id", [0]) == ["D0"]
+
+
+def test_restore_decodes_the_records_once(snapshot_dir):
+    version = donor_db_version()
+    saved = shared_snapshot.restore_donor_snapshot(version)
+    assert (snapshot_dir / f"gen-{shared_snapshot.donor_db_id()}-{version}").is_dir()
+    restored = shared_snapshot.restore_donor_snapshot(version)
+    # from the saved generation, but with the records in memory rather than mapped JSON
+    assert isinstance(restored.record_source, RecordPages)
+    assert restored.frame.equals(saved.frame)
+
+
+def _versions():
+    return [v for v, _ in shared_snapshot._saved_versions()]
+
+
+def test_publishing_a_version_twice_keeps_one_generation(snapshot_dir):
+    first = shared_snapshot.publish_snapshot(_snapshot(1))
+    assert shared_snapshot.publish_snapshot(_snapshot(1)) == first
+    assert _versions() == [1]
+    assert not list(snapshot_dir.glob(".tmp-*"))
+
+
+def test_prune_keeps_the_newest_generations(snapshot_dir, monkeypatch):
+    monkeypatch.setattr(shared_snapshot, "SHARED_SNAPSHOT_KEEP", 2)
+    for version in range(1, 6):
+        shared_snapshot.publish_snapshot(_snapshot(version))
+    reader = shared_snapshot.attach_snapshot(1)
+    (snapshot_dir / "gen-earlier-store-7").mkdir()
+    (snapshot_dir / ".tmp-1-2").mkdir()
+
+    shared_snapshot._prune(5)
+    assert _versions() == [4, 5]
+    assert sorted(p.name for p in snapshot_dir.iterdir() if p.name != ".lock") == [
+        f"gen-{shared_snapshot.donor_db_id()}-{v}" for v in [4, 5]]
+    # pruned generations can't be attached any more; one already mapped still reads
+    assert shared_snapshot.attach_snapshot(1) is None
+    assert reader.values("donor_id", [0, 3]) == ["D0", "D3"]
+
+
+def test_prune_never_removes_the_current_version(snapshot_dir, monkeypatch):
+    monkeypatch.setattr(shared_snapshot, "SHARED_SNAPSHOT_KEEP", 1)
+    for version in [3, 4]:
+        shared_snapshot.publish_snapshot(_snapshot(version))
+    # a worker still on version 3 publishes after version 4 exists
+    shared_snapshot._prune(3)
+    assert _versions() == [3, 4]
+    shared_snapshot._prune(4)
+    assert _versions() == [4]
+
+
+def test_shared_snapshot_follows_donor_changes(snapshot_dir):
+    from app.donor_db import SOURCE_USER, delete_donor
+    from app.store import load_donor_snapshot, save_registered_donor
+
+    load_donor_snapshot()  # donors.db filled from the CSV
+    version = donor_db_version()
+    first = shared_snapshot.shared_donor_snapshot(version)
+    assert shared_snapshot.shared_donor_snapshot(version).record_source.typed
+    save_registered_donor({"donor_id": "SG1", "name": "Shared", "blood_group": "A-",
+                           "lat": 12.9, "lon": 77.6, "availability": "yes"})
+    try:
+        changed = donor_db_version()
+        second = shared_snapshot.shared_donor_snapshot(changed, previous=first)
+        assert _versions() == [version, changed]
+        assert second.version == changed and second.size == first.size + 1
+        assert second.values("donor_id", [second.size - 1]) == ["SG1"]
+        assert "SG1" not in first.values("donor_id", np.arange(first.size))
+        # a worker without a previous snapshot maps the published generation
+        again = shared_snapshot.shared_donor_snapshot(changed)
+        assert again.frame.equals(second.frame)
+    finally:
+        delete_donor("SG1", source=SOURCE_USER)
@@ -0,0 +1,39 @@
+# tests/test_standing_lists.py
+import numpy as np
+
+from app import standing_lists
+from app.donor_db import SOURCE_USER, delete_donor
+from app.store import load_donor_snapshot, save_registered_donor
+
+
+def _lists():
+    return {
+        (hid, code): (scored.ids.copy(), scored.scores().copy())
+        for hid, lst in standing_lists._lists.items() for code, scored in lst.by_code.items()
+    }
+
+
+def test_donor_changes_are_applied_to_the_existing_lists():
+    standing_lists.refresh_standing_lists(force=True)
+    snapshot = load_donor_snapshot()
+    donor = snapshot.record(int(np.flatnonzero(snapshot.available)[0]))
+    save_registered_donor({**donor, "donor_id": "SL1", "blood_group": "O-"})
+    sid = load_donor_snapshot().ids[-1]
+    try:
+        refreshed = standing_lists.refresh_standing_lists()["refreshed"]
+        assert refreshed
+        lst = standing_lists._lists[refreshed[0]]
+        assert not lst.last_refresh["rebuilt"] and lst.last_refresh["rescored_donors"] == 1
+        assert sid in lst.ids
+        incremental = _lists()
+
+        standing_lists.refresh_standing_lists(force=True)
+        rebuilt = _lists()
+        assert incremental.keys() == rebuilt.keys()
+        for key, (ids, scores) in incremental.items():
+            assert np.array_equal(ids, rebuilt[key][0]) and np.allclose(scores, rebuilt[key][1])
+    finally:
+        delete_donor("SL1", source=SOURCE_USER)
+
+    standing_lists.refresh_standing_lists()
+    assert all(sid not in lst.ids for lst in standing_lists._lists.values())